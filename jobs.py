@@ -0,0 +1,226 @@
+import collections
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+class QueueFull(Exception):
+    """
+    Raised when submitting a job while the queue is at its depth limit
+    """
+
+
+def _run_job(function, args):
+    """
+    Runs a job in a worker process and times it.
+
+    Args:
+        function (callable): module level function to run
+        args (tuple): positional arguments
+
+    Returns:
+        (tuple): start timestamp, end timestamp and function result
+    """
+    started = time.time()
+    result = function(*args)
+    return started, time.time(), result
+
+
+class Job(object):
+    """
+    Job state as seen from the web server
+
+    Args:
+        job_id (str): job identifier
+        future (:obj:`concurrent.futures.Future`): worker pool future
+        info (dict): request information kept with the job
+        on_done (callable): called with the job once it finished
+            successfully, before it is reported done
+    """
+
+    def __init__(self, job_id, future, info, on_done=None):
+        self.job_id = job_id
+        self.future = future
+        self.info = info
+        self.on_done = on_done
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        # exception raised by on_done
+        self.error = None
+        self._completed = threading.Event()
+
+    def _complete(self, future):
+        # future done callback, the job stays running until on_done returned
+        try:
+            if (self.on_done is not None and not future.cancelled() and
+                    future.exception() is None):
+                self.on_done(self)
+        except Exception as e:
+            self.error = e
+        finally:
+            self._completed.set()
+
+    @property
+    def state(self):
+        if self.future.cancelled():
+            return CANCELLED
+        if self.future.done() and self.future.exception() is not None:
+            return FAILED
+        if self._completed.is_set():
+            return FAILED if self.error is not None else DONE
+        if self.future.running() or self.future.done():
+            return RUNNING
+        return QUEUED
+
+    def result(self):
+        """
+        Result of a finished job
+
+        Returns:
+            function result, None if the job is not done
+        """
+        if self.state != DONE:
+            return None
+        self.started, self.finished, result = self.future.result()
+        return result
+
+    def status(self):
+        """
+        Job status for polling
+
+        Returns:
+            (dict): job id, state, timings in seconds and error if failed
+        """
+        state = self.state
+        status = {'job_id': self.job_id,
+                  'state': state,
+                  'submitted': self.submitted,
+                  'info': self.info}
+        if state == DONE:
+            self.result()
+            status['queued_seconds'] = self.started - self.submitted
+            status['run_seconds'] = self.finished - self.started
+        else:
+            status['elapsed_seconds'] = time.time() - self.submitted
+        if state == FAILED:
+            status['error'] = repr(self.future.exception() or self.error)
+        return status
+
+
+class JobQueue(object):
+    """
+    Bounded queue of jobs run by a pool of worker processes
+
+    Args:
+        max_workers (int): number of worker processes
+        max_queued (int): maximum number of queued or running jobs
+        max_history (int): number of finished jobs kept for polling
+    """
+
+    def __init__(self, max_workers=2, max_queued=8, max_history=100):
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.max_history = max_history
+        self._executor = None
+        self._jobs = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        # worker processes are only started on the first submission
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def depth(self):
+        """
+        Number of queued or running jobs
+
+        Returns:
+            (int)
+        """
+        with self._lock:
+            return sum(1 for job in self._jobs.values()
+                       if job.state in (QUEUED, RUNNING))
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items()
+                    if job.state not in (QUEUED, RUNNING)]
+        for job_id in finished[:max(0, len(finished) - self.max_history)]:
+            del self._jobs[job_id]
+
+    def submit(self, function, args=(), info=None, on_done=None):
+        """
+        Queues a job.
+
+        Args:
+            function (callable): module level function to run
+            args (tuple): positional arguments
+            info (dict): request information kept with the job
+            on_done (callable): called with the :obj:`Job` once it finished
+                successfully, in the web server process; the job is reported
+                done only after it returned, and failed if it raised
+
+        Returns:
+            (str): job id
+
+        Raises:
+            QueueFull: when `max_queued` jobs are already queued or running
+        """
+        if self.depth() >= self.max_queued:
+            raise QueueFull('{} jobs queued'.format(self.max_queued))
+        job_id = uuid.uuid4().hex
+        future = self._pool().submit(_run_job, function, tuple(args))
+        job = Job(job_id, future, info or {}, on_done)
+        with self._lock:
+            self._jobs[job_id] = job
+            self._prune()
+        future.add_done_callback(job._complete)
+        return job_id
+
+    def get(self, job_id):
+        """
+        Job by id
+
+        Args:
+            job_id (str): job identifier
+
+        Returns:
+            (:obj:`Job`): None if unknown
+        """
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """
+        Cancels a job that has not started yet, running jobs can not be
+        interrupted.
+
+        Args:
+            job_id (str): job identifier
+
+        Returns:
+            (bool): True if the job was cancelled
+        """
+        job = self.get(job_id)
+        if job is None:
+            return False
+        return job.future.cancel()
+
+    def shutdown(self, wait=True):
+        """
+        Stops the worker processes.
+
+        Args:
+            wait (bool): wait for running jobs to finish
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
@@ -0,0 +1,113 @@
+# Accessibility of buildings to commercial POIs
+"""
+Commercial POIs are projected to the local UTM zone and indexed once in a
+cKDTree. Building centroids are queried against it in batches over a
+thread pool (the tree queries release the GIL) for the number of POIs
+within every radius. The nearest cluster is the one of the nearest
+clustered POI, from a second tree over the clustered POIs only.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import shapely
+from scipy import spatial
+
+from model.cluster import projection
+
+RADII = [250, 500, 1000]
+# building centroids per batch
+BATCH_SIZE = 1 << 14
+
+
+def centroids(geometries):
+    """
+    Centroid coordinates of geometries
+
+    Parameters
+    ----------
+    geometries :
+      array of shapely geometries
+
+    Returns
+    (n, 2) array of x/y coordinates
+    """
+    geometries = np.asarray(geometries, dtype=object)
+    if hasattr(shapely, 'centroid'):
+        return shapely.get_coordinates(shapely.centroid(geometries)).reshape(
+            -1, 2)
+    return np.array([(geometry.centroid.x, geometry.centroid.y)
+                     for geometry in geometries]).reshape(-1, 2)
+
+
+def _count_within(tree, xy, radius):
+    # number of tree points within radius of every point
+    try:
+        return tree.query_ball_point(xy, radius, return_length=True)
+    except TypeError:
+        # scipy < 1.3, no return_length
+        return np.array([len(points) for points
+                         in tree.query_ball_point(xy, radius)],
+                        dtype=np.intp)
+
+
+def accessibility(lon, lat, poi_lon, poi_lat, labels, radii=RADII,
+                  max_workers=None):
+    """
+    Commercial POIs around every building and its nearest cluster
+
+    Parameters
+    ----------
+    lon :
+      array of building centroid longitudes in degrees
+    lat :
+      array of building centroid latitudes in degrees
+    poi_lon :
+      array of commercial POI longitudes in degrees
+    poi_lat :
+      array of commercial POI latitudes in degrees
+    labels :
+      array of DBSCAN labels of the POIs, -1 for noise
+    radii :
+      radii in meters
+    max_workers :
+      number of threads, defaults to the number of CPUs
+
+    Returns
+    pandas.DataFrame, one row per building with the `poi_<radius>` counts,
+    the `nearest_cluster` (-1 without clusters) and the `cluster_distance`
+    in meters
+    """
+    labels = np.asarray(labels)
+    poi_xy, proj_string = projection.project_utm(poi_lon, poi_lat)
+    xy, _ = projection.project_utm(lon, lat, proj_string)
+    tree = spatial.cKDTree(poi_xy)
+    clustered = np.flatnonzero(labels >= 0)
+    cluster_tree = spatial.cKDTree(poi_xy[clustered])
+
+    def batch(start):
+        points = xy[start:start + BATCH_SIZE]
+        counts = [_count_within(tree, points, radius) for radius in radii]
+        if not len(clustered):
+            return counts, (np.full(len(points), -1, dtype=np.intp),
+                            np.full(len(points), np.inf))
+        distance, nearest = cluster_tree.query(points)
+        return counts, (labels[clustered[nearest]], distance)
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        batches = list(executor.map(batch, range(0, len(xy), BATCH_SIZE)))
+
+    table = pd.DataFrame(index=np.arange(len(xy)))
+    for position, radius in enumerate(radii):
+        table['poi_{}'.format(radius)] = np.concatenate(
+            [counts[position] for counts, _ in batches]) if batches else \
+            np.zeros(0, dtype=np.intp)
+    table['nearest_cluster'] = np.concatenate(
+        [nearest[0] for _, nearest in batches]) if batches else \
+        np.zeros(0, dtype=np.intp)
+    table['cluster_distance'] = np.concatenate(
+        [nearest[1] for _, nearest in batches]) if batches else np.zeros(0)
+    return table
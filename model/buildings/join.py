@@ -0,0 +1,114 @@
+# Spatial join of POIs to building footprints
+"""
+Footprints are indexed once in an STRtree and every POI is matched to the
+footprint containing it in one bulk `within` query (shapely 2), or through
+a geopandas spatial join with older shapely. Where several footprints
+contain a POI (building parts), the smallest one is kept.
+"""
+import geopandas as gpd
+import numpy as np
+import shapely
+
+from model.tags.taxonomy import taxonomy
+
+
+def containing_buildings(points, footprints):
+    """
+    Footprint containing every point
+
+    Parameters
+    ----------
+    points :
+      array of Point
+    footprints :
+      array of Polygon or MultiPolygon
+
+    Returns
+    array of footprint positions, -1 outside every footprint
+    """
+    points = np.asarray(points, dtype=object)
+    footprints = np.asarray(footprints, dtype=object)
+    building = np.full(len(points), -1, dtype=np.intp)
+    if not len(points) or not len(footprints):
+        return building
+    if hasattr(shapely, 'STRtree') and hasattr(shapely, 'area'):
+        point, footprint = shapely.STRtree(footprints).query(
+            points, predicate='within')
+        area = shapely.area(footprints[footprint])
+    else:
+        joined = gpd.sjoin(gpd.GeoDataFrame(geometry=list(points)),
+                           gpd.GeoDataFrame(geometry=list(footprints)),
+                           how='inner', op='within')
+        point = joined.index.values
+        footprint = joined.index_right.values
+        area = np.array([footprints[position].area
+                         for position in footprint])
+    # smallest footprint first for every point
+    order = np.lexsort((area, point))
+    point, footprint = point[order], footprint[order]
+    first = np.concatenate([[True], point[1:] != point[:-1]]) \
+        if len(point) else np.zeros(0, dtype=bool)
+    building[point[first]] = footprint[first]
+    return building
+
+
+def infer_values(key, column):
+    """
+    Values of a column classified as `infer`
+
+    Parameters
+    ----------
+    key :
+      OSM key
+    column : pandas.Series
+      values of the key
+
+    Returns
+    boolean array
+    """
+    land_use_values = taxonomy.land_use_values.get(key, {})
+    return column.isin(land_use_values.get('infer', ())).values
+
+
+def inherit_building_tags(df_poi, df_building, rows, keys):
+    """
+    Tags of the containing building for some POIs, where the POI tag is
+    missing or only says to infer
+
+    Parameters
+    ----------
+    df_poi : geopandas.GeoDataFrame
+      POI data, left unchanged
+    df_building : geopandas.GeoDataFrame
+      building footprints
+    rows :
+      boolean array of the POIs to enrich
+    keys :
+      OSM keys inherited
+
+    Returns
+    POI data with the inherited tags, array of the footprint position of
+    every POI (-1 outside every footprint or not enriched)
+    """
+    df_poi = df_poi.copy()
+    building = np.full(len(df_poi), -1, dtype=np.intp)
+    rows = np.flatnonzero(rows)
+    building[rows] = containing_buildings(
+        df_poi.geometry.values[rows], df_building.geometry.values)
+    inside = rows[building[rows] >= 0]
+
+    for key in keys:
+        if key not in df_building.columns:
+            continue
+        if key not in df_poi.columns:
+            df_poi[key] = None
+        poi_values = df_poi[key].iloc[inside]
+        building_values = df_building[key].values[building[inside]]
+        replace = (poi_values.isnull().values |
+                   infer_values(key, poi_values)) & \
+            ~df_building[key].iloc[building[inside]].isnull().values
+        if replace.any():
+            values = df_poi[key].values.astype(object)
+            values[inside[replace]] = building_values[replace]
+            df_poi[key] = values
+    return df_poi, building
@@ -0,0 +1,188 @@
+# Residential floor area around commercial clusters
+"""
+Residential footprints are projected to the UTM zone of the clusters, their
+areas computed in one vectorised call and multiplied by their number of
+levels (`building:levels`, else `height` over LEVEL_HEIGHT, else one). The
+catchment of a cluster is its hull polygon buffered by CATCHMENT meters;
+footprints are matched to catchments through an STRtree and only the part
+of a footprint inside a catchment counts. The population estimate is the
+residential floor area over FLOOR_AREA_PER_PERSON.
+"""
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyproj
+import shapely
+from shapely.ops import transform
+
+from model.cluster import projection
+from model.tags.taxonomy import taxonomy
+
+# catchment around the cluster hull in meters
+CATCHMENT = 500.
+# storey height in meters, for buildings tagged with a height only
+LEVEL_HEIGHT = 3.
+# residential floor area per inhabitant in square meters
+FLOOR_AREA_PER_PERSON = 25.
+POPULATION_COLUMNS = ['spatial_cluster', 'residential_buildings',
+                      'residential_area', 'residential_floor_area',
+                      'population_estimate']
+
+
+def _numbers(column):
+    # leading number of every tag value (e.g. '12 m' -> 12), NaN otherwise,
+    # each distinct value parsed once
+    codes, uniques = pd.factorize(column.astype(object))
+    numbers = pd.to_numeric(pd.Series(uniques, dtype=object).astype(
+        str).str.extract(r'^\s*(\d+(?:\.\d+)?)', expand=False),
+        errors='coerce').values
+    return np.where(codes >= 0, numbers[np.maximum(codes, 0)], np.nan) \
+        if len(numbers) else np.full(len(codes), np.nan)
+
+
+def building_levels(df_building):
+    """
+    Number of levels of every building
+
+    Parameters
+    ----------
+    df_building : geopandas.GeoDataFrame
+      building footprints
+
+    Returns
+    array of levels, at least one
+    """
+    levels = np.full(len(df_building), np.nan)
+    if 'building:levels' in df_building.columns:
+        levels = _numbers(df_building['building:levels'])
+    if 'height' in df_building.columns:
+        by_height = np.round(_numbers(df_building['height']) / LEVEL_HEIGHT)
+        levels = np.where(np.isnan(levels), by_height, levels)
+    return np.where(np.isnan(levels) | (levels < 1), 1., levels)
+
+
+def residential_buildings(df_building):
+    """
+    Buildings with a residential `building` or `building:use` value
+
+    Parameters
+    ----------
+    df_building : geopandas.GeoDataFrame
+      building footprints
+
+    Returns
+    boolean array
+    """
+    residential = np.zeros(len(df_building), dtype=bool)
+    for key in ('building', 'building:use'):
+        if key in df_building.columns:
+            values = taxonomy.land_use_values.get(key, {}).get(
+                'residential', ())
+            residential |= df_building[key].isin(values).values
+    return residential
+
+
+def _project(geometries, proj):
+    # geometries from lon/lat to the projection
+    if hasattr(shapely, 'transform'):
+        return shapely.transform(
+            np.asarray(geometries, dtype=object),
+            lambda coords: np.column_stack(proj(coords[:, 0], coords[:, 1])))
+    projected = np.empty(len(geometries), dtype=object)
+    projected[:] = [transform(proj, geometry) for geometry in geometries]
+    return projected
+
+
+def _overlaps(catchments, footprints):
+    # (catchment, footprint) pairs and the area of their intersection
+    if hasattr(shapely, 'STRtree') and hasattr(shapely, 'intersection'):
+        catchment, footprint = shapely.STRtree(footprints).query(
+            catchments, predicate='intersects')
+        return catchment, footprint, shapely.area(shapely.intersection(
+            catchments[catchment], footprints[footprint]))
+    joined = gpd.sjoin(gpd.GeoDataFrame(geometry=list(catchments)),
+                       gpd.GeoDataFrame(geometry=list(footprints)),
+                       how='inner', op='intersects')
+    catchment = joined.index.values
+    footprint = joined.index_right.values
+    return catchment, footprint, np.array(
+        [catchments[c].intersection(footprints[f]).area
+         for c, f in zip(catchment, footprint)])
+
+
+def floor_area(df_building):
+    """
+    Floor area of every building, footprint area times levels
+
+    Parameters
+    ----------
+    df_building : geopandas.GeoDataFrame
+      building footprints in lon/lat
+
+    Returns
+    array of floor areas in square meters
+    """
+    if not len(df_building):
+        return np.zeros(0)
+    min_lon, min_lat, max_lon, max_lat = df_building.total_bounds
+    proj = pyproj.Proj(projection.utm_proj_string((min_lon + max_lon) / 2.,
+                                                  (min_lat + max_lat) / 2.))
+    footprints = _project(df_building.geometry.values, proj)
+    area = shapely.area(footprints) if hasattr(shapely, 'area') else \
+        np.array([footprint.area for footprint in footprints])
+    return area * building_levels(df_building)
+
+
+def catchment_population(clusters, df_building, catchment=CATCHMENT,
+                         floor_area_per_person=FLOOR_AREA_PER_PERSON):
+    """
+    Residential floor area and population estimate in the catchment of
+    every cluster
+
+    Parameters
+    ----------
+    clusters : geopandas.GeoDataFrame
+      cluster hull polygons in lon/lat with their `spatial_cluster`
+    df_building : geopandas.GeoDataFrame
+      building footprints in lon/lat
+    catchment :
+      buffer around the hulls in meters
+    floor_area_per_person :
+      residential floor area per inhabitant in square meters
+
+    Returns
+    pandas.DataFrame, one row per cluster
+    """
+    n_clusters = len(clusters)
+    table = pd.DataFrame({'spatial_cluster': clusters.spatial_cluster.values},
+                         columns=POPULATION_COLUMNS)
+    residential = residential_buildings(df_building)
+    if n_clusters == 0 or not residential.any():
+        for column in POPULATION_COLUMNS[1:]:
+            table[column] = np.zeros(n_clusters)
+        table['residential_buildings'] = table.residential_buildings.astype(
+            np.int64)
+        return table
+
+    min_lon, min_lat, max_lon, max_lat = clusters.total_bounds
+    proj = pyproj.Proj(projection.utm_proj_string((min_lon + max_lon) / 2.,
+                                                  (min_lat + max_lat) / 2.))
+    catchments = _project(clusters.geometry.values, proj)
+    if hasattr(shapely, 'buffer'):
+        catchments = shapely.buffer(catchments, catchment)
+    else:
+        catchments = np.array([polygon.buffer(catchment)
+                               for polygon in catchments], dtype=object)
+    footprints = _project(df_building.geometry.values[residential], proj)
+    levels = building_levels(df_building[residential])
+
+    position, footprint, area = _overlaps(catchments, footprints)
+    table['residential_buildings'] = np.bincount(
+        position, minlength=n_clusters)
+    table['residential_area'] = np.bincount(
+        position, weights=area, minlength=n_clusters)
+    table['residential_floor_area'] = np.bincount(
+        position, weights=area * levels[footprint], minlength=n_clusters)
+    table['population_estimate'] = \
+        table.residential_floor_area.values / floor_area_per_person
+    return table
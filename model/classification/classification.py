@@ -3,7 +3,7 @@ import pandas as pd
 import geopandas as gpd
 import numpy as np
 from osmnx import log
-from model.tags import tags
+from model.tags.taxonomy import taxonomy
 
 
 def aggregate_classification(classification_list):
@@ -53,27 +53,20 @@ def classify_tag(tags, return_key_value=True):
             returns the classification, and a dict relating `key`:`value` defining its classification
     """
     # key_value: Dictionary of osm key : osm value
-    classification, key_value = [], {}
-
-    for key, value in tags.key_classification.items():
-        # Get the corresponding key tag (without its land use)
-        key_tag = key.replace(
-            "activity_",
-            "").replace(
-            "residential_",
-            "").replace(
-            "other_",
-            "").replace(
-                "infer_",
-            "")
-
-        if tags.get(key_tag) in value:
-            # First part of key defines the land use
-            new_classification = key.split("_")[0]
-            # Add the new classification
-            classification.append(new_classification)
-            # Associate the key-value
-            key_value[key_tag] = tags.get(key_tag)
+    matches = []
+    for key in taxonomy.keys:
+        value = tags.get(key)
+        tag_class = taxonomy.classify(key, value)
+        if tag_class is not None:
+            matches.append((tag_class.rank, key, value, tag_class.land_uses))
+    # keep the order of `key_classification`
+    matches.sort(key=lambda match: match[0])
+
+    # First part of key defines the land use
+    classification = [land_use for _, _, _, land_uses in matches
+                      for land_use in land_uses]
+    # Associate the key-value
+    key_value = {key: value for _, key, value, _ in matches}
 
     classification = aggregate_classification(classification)
 
@@ -99,10 +92,7 @@ def value_activity_category(x):
     string
             returns the activity classification
     """
-    for key, value in tags.activity_classification.items():
-        if x in value:
-            return key
-    return None
+    return taxonomy.value_category(x)
 
 
 def key_value_activity_category(key, value):
@@ -124,19 +114,7 @@ def key_value_activity_category(key, value):
     # Note that some values repeat for different keys (e.g. shop=fuel and
     # amenity=fuel), but they do not belong to the same activity
     # classification
-    return {
-        'shop': 'commercial',
-        'leisure': 'commercial',
-        'amenity': 'commercial',
-        'man_made': 'non_commercial',
-        'industrial': 'non_commercial',
-        'landuse': value_activity_category(value),
-        # Inferred cases adopted land use values
-        'inferred': value_activity_category(value),
-        'building': value_activity_category(value),
-        'building:use': value_activity_category(value),
-        'building:part': value_activity_category(value)
-    }.get(key, None)
+    return taxonomy.activity_category(key, value)
 
 
 def classify_activity_category(key_values):
@@ -158,3 +136,104 @@ def classify_activity_category(key_values):
                       for key, value in key_values.items()])
     categories.discard(None)
     return list(categories)
+
+
+# Column oriented classification
+
+
+def classify_tags_frame(df_osm):
+    """
+    Classify the land use of every row of an OSM data frame at once.
+    Equivalent to applying `classify_tag` row by row
+
+    Parameters
+    ----------
+    df_osm : pandas.DataFrame
+            OpenStreetMap data frame with one column per OSM key
+
+    Returns
+    ----------
+    pandas.DataFrame
+            returns the `classification` and `key_value` columns, indexed as `df_osm`
+    """
+    n_rows = len(df_osm)
+    key_values = [{} for _ in range(n_rows)]
+    # Land use -> rows containing at least one key:value of that land use
+    land_use_masks = {}
+
+    match_rows, match_ranks, match_keys, match_values = [], [], [], []
+
+    for key in taxonomy.keys:
+        if key not in df_osm.columns:
+            continue
+
+        column = df_osm[key]
+        matched = np.zeros(n_rows, dtype=bool)
+        for land_use, values in taxonomy.land_use_values[key].items():
+            mask = column.isin(values).values
+            if not mask.any():
+                continue
+            matched |= mask
+            if land_use in land_use_masks:
+                land_use_masks[land_use] |= mask
+            else:
+                land_use_masks[land_use] = mask.copy()
+
+        # Associate the key-value only for the matching rows
+        rows = np.flatnonzero(matched)
+        for i, value in zip(rows, column.values[rows]):
+            match_rows.append(i)
+            match_ranks.append(taxonomy.classify(key, value).rank)
+            match_keys.append(key)
+            match_values.append(value)
+
+    # keep the order of `key_classification` inside each row
+    for j in np.lexsort((match_ranks, match_rows)):
+        key_values[match_rows[j]][match_keys[j]] = match_values[j]
+
+    def has(land_use):
+        return land_use_masks.get(land_use, np.zeros(n_rows, dtype=bool))
+
+    # Same precedence as `aggregate_classification`
+    conditions = [
+        has("other"),
+        has("activity") & has("residential"),
+        has("mixed"),
+        has("activity"),
+        has("residential"),
+        has("infer")]
+    choices = [None, "mixed", "mixed", "activity", "residential", "infer"]
+    classification = np.select(
+        conditions,
+        np.array(choices, dtype=object),
+        default=None)
+
+    return pd.DataFrame({
+        'classification': pd.Series(
+            classification, index=df_osm.index, dtype=object),
+        'key_value': pd.Series(key_values, index=df_osm.index, dtype=object)},
+        columns=['classification', 'key_value'])
+
+
+def classify_activity_category_frame(key_values):
+    """
+    Classify a column of key:value dicts into `commercial`, `non commercial`.
+    Equivalent to applying `classify_activity_category` row by row, each
+    distinct key:value combination is classified only once
+
+    Parameters
+    ----------
+    key_values : pandas.Series
+            dicts with pairs of key:value relating to its usage
+
+    Returns
+    ----------
+    pandas.Series
+            returns the list of activity classifications of each row
+    """
+    combinations = [tuple(key_value.items()) for key_value in key_values]
+    codes, uniques = pd.factorize(pd.Series(combinations, dtype=object))
+    categories = [classify_activity_category(dict(combination))
+                  for combination in uniques]
+    return pd.Series([list(categories[code]) for code in codes],
+                     index=key_values.index, dtype=object)
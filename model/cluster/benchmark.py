@@ -0,0 +1,94 @@
+# Benchmark of the DBSCAN engines
+"""
+python -m model.cluster.benchmark [n_points]
+
+Synthetic commercial cores around New Delhi: dense gaussian clusters over a
+uniform background
+"""
+import sys
+import time
+
+import numpy as np
+from sklearn.cluster import DBSCAN
+
+from model.cluster import dbscan
+from model.cluster import projection
+
+
+def synthetic_points(n_points, n_cores=50, seed=0):
+    """
+    Synthetic POIs
+
+    Parameters
+    ----------
+    n_points :
+      number of points
+    n_cores :
+      number of dense cores
+    seed :
+      random seed
+
+    Returns
+    arrays of longitudes and latitudes
+    """
+    random = np.random.RandomState(seed)
+    n_background = n_points // 5
+    n_core = n_points - n_background
+    centers = random.uniform([77.0, 28.4], [77.4, 28.8], size=(n_cores, 2))
+    core = centers[random.randint(n_cores, size=n_core)] + \
+        random.normal(scale=0.005, size=(n_core, 2))
+    background = random.uniform([77.0, 28.4], [77.4, 28.8],
+                                size=(n_background, 2))
+    points = np.concatenate([core, background])
+    return points[:, 0], points[:, 1]
+
+
+def timed(function, *args, **kwargs):
+    started = time.time()
+    result = function(*args, **kwargs)
+    return result, time.time() - started
+
+
+def benchmark(n_points=100000, eps=300, minpts=5):
+    """
+    Times the haversine, grid and tiled engines and checks the grid and
+    tiled labels against exact DBSCAN on the projected coordinates
+
+    Parameters
+    ----------
+    n_points :
+      number of points
+    eps :
+      neighbourhood radius in meters
+    minpts :
+      smallest cluster size allowed
+
+    Returns
+    dict of timings in seconds and label agreement
+    """
+    lon, lat = synthetic_points(n_points)
+    _, haversine_seconds = timed(dbscan.dbscan, lon, lat, eps, minpts,
+                                 engine='haversine')
+    grid_labels, grid_seconds = timed(dbscan.dbscan, lon, lat, eps, minpts,
+                                      engine='grid')
+    tiled_labels, tiled_seconds = timed(dbscan.dbscan, lon, lat, eps, minpts,
+                                        engine='tiled')
+
+    xy, _ = projection.project_utm(lon, lat)
+    exact_labels, exact_seconds = timed(
+        DBSCAN(eps=eps, min_samples=minpts).fit_predict, xy)
+    result = {'n_points': n_points,
+              'haversine_seconds': haversine_seconds,
+              'grid_seconds': grid_seconds,
+              'tiled_seconds': tiled_seconds,
+              'exact_projected_seconds': exact_seconds,
+              'identical_labels': bool(
+                  np.array_equal(grid_labels, exact_labels) and
+                  np.array_equal(tiled_labels, exact_labels))}
+    for name, value in result.items():
+        print('{}: {}'.format(name, value))
+    return result
+
+
+if __name__ == "__main__":
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,143 @@
+# DBSCAN engines for POI clustering
+"""
+haversine: scikit-learn ball tree over lon/lat in radians
+grid: eps-sized grid over coordinates projected to the local UTM zone,
+  same labels as exact DBSCAN on the projected coordinates
+tiled: grid engine over tiles clustered in a process pool from the main
+  thread, in the calling process elsewhere, same labels as the grid engine
+network: street network distances between points snapped to their nearest
+  node, from Dijkstra bounded at eps
+"""
+import numpy as np
+from sklearn.cluster import DBSCAN
+
+from model.cluster import grid
+from model.cluster import partition
+from model.cluster import projection
+from model.network import distance
+
+# mean Earth radius in meters
+EARTH_RADIUS = 6371008.8
+ENGINES = ('haversine', 'grid', 'tiled', 'network')
+
+
+def haversine_dbscan(lon, lat, eps, minpts):
+    """
+    DBSCAN with great circle distances
+
+    Parameters
+    ----------
+    lon :
+      array of longitudes in degrees
+    lat :
+      array of latitudes in degrees
+    eps :
+      neighbourhood radius in meters
+    minpts :
+      smallest cluster size allowed
+
+    Returns
+    array of labels, -1 for noise
+    """
+    db = DBSCAN(
+        eps=eps / EARTH_RADIUS,  # meters to radians
+        min_samples=minpts,
+        metric='haversine',
+        algorithm='ball_tree')
+    return db.fit_predict(np.deg2rad(np.column_stack([lat, lon])))
+
+
+def projected_dbscan(lon, lat, eps, minpts, tiled=False, max_workers=None):
+    """
+    DBSCAN with euclidean distances in the local UTM zone, through an
+    eps-sized grid
+
+    Parameters
+    ----------
+    lon :
+      array of longitudes in degrees
+    lat :
+      array of latitudes in degrees
+    eps :
+      neighbourhood radius in meters
+    minpts :
+      smallest cluster size allowed
+    tiled :
+      cluster tiles of the extent in parallel processes
+    max_workers :
+      number of processes of the tiles, see `partition.tiled_dbscan`
+
+    Returns
+    array of labels, -1 for noise
+    """
+    xy, _ = projection.project_utm(lon, lat)
+    if tiled:
+        return partition.tiled_dbscan(xy, eps, min_samples=minpts,
+                                      max_workers=max_workers)
+    return grid.grid_dbscan(xy, eps, min_samples=minpts)
+
+
+def network_dbscan(network, lon, lat, eps, minpts):
+    """
+    DBSCAN with street network distances, over the sparse matrix of
+    distances up to eps
+
+    Parameters
+    ----------
+    network : network.store.StreetNetwork
+      street network
+    lon :
+      array of longitudes in degrees
+    lat :
+      array of latitudes in degrees
+    eps :
+      neighbourhood radius in meters
+    minpts :
+      smallest cluster size allowed
+
+    Returns
+    array of labels, -1 for noise
+    """
+    i, j, _ = distance.network_neighbours(network, lon, lat, eps)
+    labels, _ = grid.labels_from_pairs(len(lon), i, j, minpts)
+    return labels
+
+
+def dbscan(lon, lat, eps, minpts, engine='haversine', network=None,
+           max_workers=None):
+    """
+    DBSCAN of lon/lat points
+
+    Parameters
+    ----------
+    lon :
+      array of longitudes in degrees
+    lat :
+      array of latitudes in degrees
+    eps :
+      neighbourhood radius in meters
+    minpts :
+      smallest cluster size allowed
+    engine :
+      'haversine', 'grid', 'tiled' or 'network'
+    network : network.store.StreetNetwork
+      street network of the 'network' engine
+    max_workers :
+      number of processes of the 'tiled' engine, defaults to one per CPU
+      from the main thread and to the calling process elsewhere
+
+    Returns
+    array of labels, -1 for noise
+    """
+    if engine == 'network':
+        if network is None:
+            raise ValueError('The network engine needs a street network')
+        return network_dbscan(network, lon, lat, eps, minpts)
+    if engine == 'haversine':
+        return haversine_dbscan(lon, lat, eps, minpts)
+    if engine in ('grid', 'tiled'):
+        return projected_dbscan(lon, lat, eps, minpts,
+                                tiled=engine == 'tiled',
+                                max_workers=max_workers)
+    raise ValueError('Unknown DBSCAN engine {}, expected one of {}'.format(
+        engine, ', '.join(ENGINES)))
@@ -0,0 +1,202 @@
+# Kernel density raster
+"""
+Points are projected to the local UTM zone and binned onto a grid of
+square cells, the counts are convolved with a Gaussian or Epanechnikov
+kernel through FFT, so the cost depends on the grid size and not on the
+number of points within the bandwidth. Densities are in points per km².
+Peaks are the local maxima of the surface, an alternative to DBSCAN for
+finding commercial centres.
+"""
+import json
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pyproj
+from scipy import ndimage
+from scipy import signal
+
+from model.cluster import projection
+
+KERNELS = ('gaussian', 'epanechnikov')
+# Gaussian kernels are cut at this many bandwidths
+GAUSSIAN_TRUNCATE = 3.
+PEAK_COLUMNS = ['lon', 'lat', 'density']
+
+
+def kernel_weights(bandwidth, cell, kernel='gaussian'):
+    """
+    Kernel sampled at the cell centres, weights summing to one
+
+    Parameters
+    ----------
+    bandwidth :
+      Gaussian standard deviation or Epanechnikov radius, in meters
+    cell :
+      cell size in meters
+    kernel :
+      'gaussian' or 'epanechnikov'
+
+    Returns
+    (2 r + 1, 2 r + 1) array
+    """
+    if kernel not in KERNELS:
+        raise ValueError('Unknown kernel {}, expected one of {}'.format(
+            kernel, ', '.join(KERNELS)))
+    reach = bandwidth * (GAUSSIAN_TRUNCATE if kernel == 'gaussian' else 1.)
+    radius = int(np.ceil(reach / cell))
+    offsets = np.arange(-radius, radius + 1) * cell
+    squared = (offsets[:, None] ** 2 + offsets[None, :] ** 2) / \
+        float(bandwidth) ** 2
+    if kernel == 'gaussian':
+        weights = np.where(squared <= GAUSSIAN_TRUNCATE ** 2,
+                           np.exp(-squared / 2.), 0.)
+    else:
+        weights = np.maximum(1. - squared, 0.)
+    return weights / weights.sum()
+
+
+def density_raster(lon, lat, cell=25., bandwidth=150., kernel='gaussian'):
+    """
+    Kernel density surface of points
+
+    Parameters
+    ----------
+    lon :
+      array of longitudes in degrees
+    lat :
+      array of latitudes in degrees
+    cell :
+      cell size in meters
+    bandwidth :
+      Gaussian standard deviation or Epanechnikov radius, in meters
+    kernel :
+      'gaussian' or 'epanechnikov'
+
+    Returns
+    (rows, cols) array of densities in points per km², north up, (0, 0)
+    without points, and its transform: dict with the PROJ string, the x/y
+    of the top left corner and the cell size
+    """
+    weights = kernel_weights(bandwidth, cell, kernel)
+    radius = weights.shape[0] // 2
+    xy, proj_string = projection.project_utm(lon, lat)
+    if not len(xy):
+        return np.zeros((0, 0)), {'proj_string': proj_string, 'left': 0.,
+                                  'top': 0., 'cell': float(cell)}
+    left, bottom = np.floor(xy.min(axis=0) / cell) * cell
+    right, top = np.floor(xy.max(axis=0) / cell) * cell + cell
+    # grid padded by the kernel radius so the surface is not cut
+    left -= radius * cell
+    bottom -= radius * cell
+    cols = int(round((right - left) / cell)) + radius
+    rows = int(round((top - bottom) / cell)) + radius
+    top = bottom + rows * cell
+
+    col = np.clip(((xy[:, 0] - left) // cell).astype(np.intp), 0, cols - 1)
+    row = np.clip(((top - xy[:, 1]) // cell).astype(np.intp), 0, rows - 1)
+    counts = np.bincount(row * cols + col,
+                         minlength=rows * cols).reshape(rows, cols)
+    surface = signal.fftconvolve(counts.astype(float), weights, mode='same')
+    # FFT round off leaves tiny negative values
+    surface = np.maximum(surface, 0.) * (1e6 / (cell * cell))
+    transform = {'proj_string': proj_string, 'left': float(left),
+                 'top': float(top), 'cell': float(cell)}
+    return surface, transform
+
+
+def cell_centres(rows, cols, transform):
+    """
+    Lon/lat of cell centres
+
+    Parameters
+    ----------
+    rows :
+      array of raster rows
+    cols :
+      array of raster columns
+    transform :
+      raster transform, from `density_raster`
+
+    Returns
+    arrays of longitudes and latitudes in degrees
+    """
+    cell = transform['cell']
+    x = transform['left'] + (np.asarray(cols) + .5) * cell
+    y = transform['top'] - (np.asarray(rows) + .5) * cell
+    return pyproj.Proj(transform['proj_string'])(x, y, inverse=True)
+
+
+def density_peaks(surface, transform, distance=250., min_fraction=.1):
+    """
+    Local maxima of a density surface
+
+    Parameters
+    ----------
+    surface :
+      density raster, from `density_raster`
+    transform :
+      raster transform, from `density_raster`
+    distance :
+      smallest distance between two peaks in meters
+    min_fraction :
+      smallest peak density, as a fraction of the highest density
+
+    Returns
+    pandas.DataFrame with the lon/lat and density of every peak, densest
+    first
+    """
+    size = 2 * int(np.ceil(distance / transform['cell'])) + 1
+    local_max = ndimage.maximum_filter(surface, size=size, mode='constant')
+    peak = (surface == local_max) & \
+        (surface > 0) & (surface >= min_fraction * surface.max()) \
+        if surface.size else np.zeros(surface.shape, dtype=bool)
+    rows, cols = np.nonzero(peak)
+    density = surface[rows, cols]
+    order = np.argsort(-density, kind='mergesort')
+    lon, lat = cell_centres(rows[order], cols[order], transform)
+    return pd.DataFrame({'lon': lon, 'lat': lat, 'density': density[order]},
+                        columns=PEAK_COLUMNS)
+
+
+def save_raster(surface, transform, raster_file):
+    """
+    Stores a raster as `.npy` with its transform in a `.json` file next to
+    it, both replaced atomically
+
+    Parameters
+    ----------
+    surface :
+      raster array
+    transform :
+      raster transform
+    raster_file :
+      `.npy` filename
+    """
+    raster_dir = os.path.dirname(os.path.abspath(raster_file))
+    fd, tmp_file = tempfile.mkstemp(dir=raster_dir, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        np.save(f, surface.astype(np.float32))
+    os.replace(tmp_file, raster_file)
+    fd, tmp_file = tempfile.mkstemp(dir=raster_dir, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(transform, f, indent=1, sort_keys=True)
+    os.replace(tmp_file, os.path.splitext(raster_file)[0] + '.json')
+
+
+def load_raster(raster_file):
+    """
+    Raster stored by `save_raster`, memory mapped
+
+    Parameters
+    ----------
+    raster_file :
+      `.npy` filename
+
+    Returns
+    raster array, transform
+    """
+    with open(os.path.splitext(raster_file)[0] + '.json') as f:
+        transform = json.load(f)
+    return np.load(raster_file, mmap_mode='r'), transform
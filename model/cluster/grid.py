@@ -0,0 +1,186 @@
+# Grid indexed DBSCAN
+"""
+Points are bucketed into a uniform grid of eps-sized cells, so the eps
+neighbours of a point lie in its cell or one of the 8 adjacent cells.
+Candidate pairs are generated per cell pair and filtered by distance in
+vectorised chunks, then DBSCAN labels are derived from the neighbour pairs
+exactly as scikit-learn assigns them.
+"""
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+
+# adjacent cells visited from each cell, the other half yields the same
+# pairs swapped
+HALF_OFFSETS = [(0, 0), (0, 1), (1, -1), (1, 0), (1, 1)]
+# candidate pairs tested at once
+CHUNK_SIZE = 1 << 22
+
+
+def _expand(rows, starts, counts):
+    # pairs (rows[k], starts[k] + t) for t < counts[k]
+    repeats = np.repeat(np.arange(len(rows), dtype=rows.dtype), counts)
+    offsets = (np.cumsum(counts) - counts).astype(rows.dtype)
+    cols = starts[repeats] + (np.arange(repeats.size, dtype=rows.dtype) -
+                              offsets[repeats])
+    return rows[repeats], cols
+
+
+def grid_neighbours(xy, eps, chunk_size=CHUNK_SIZE):
+    """
+    Pairs of points closer than eps, found through an eps-sized grid
+
+    Parameters
+    ----------
+    xy :
+      (n, 2) array of projected coordinates
+    eps :
+      neighbourhood radius, in the unit of the coordinates
+    chunk_size :
+      number of candidate pairs tested at once
+
+    Returns
+    arrays i, j and distances of the neighbour pairs, each pair once
+    with i != j
+    """
+    xy = np.asarray(xy, dtype=float).reshape(-1, 2)
+    if len(xy) == 0:
+        empty = np.zeros(0, dtype=np.intp)
+        return empty, empty, np.zeros(0)
+
+    # cell keys, padded by one cell on each side so that offsets stay valid
+    cells = np.floor((xy - xy.min(axis=0)) / eps).astype(np.int64) + 1
+    width = cells[:, 1].max() + 2
+    keys = cells[:, 0] * width + cells[:, 1]
+    order = np.argsort(keys, kind='mergesort')
+    sorted_keys = keys[order]
+    sorted_x = np.ascontiguousarray(xy[order, 0])
+    sorted_y = np.ascontiguousarray(xy[order, 1])
+    # squared distance bound, distances are compared as scikit-learn does
+    # only near the boundary
+    eps2 = eps * eps * (1 + 1e-9)
+    cell_keys, cell_starts, cell_counts = np.unique(
+        sorted_keys, return_index=True, return_counts=True)
+
+    index_type = np.int32 if len(xy) < np.iinfo(np.int32).max else np.intp
+    rows = np.arange(len(xy), dtype=index_type)
+    cell_starts = cell_starts.astype(index_type)
+    cell_counts = cell_counts.astype(index_type)
+    pairs_i, pairs_j = [rows[:0]], [rows[:0]]
+    pairs_distance = [np.zeros(0)]
+    for dx, dy in HALF_OFFSETS:
+        # cell of each point's neighbours at this offset
+        target = sorted_keys + dx * width + dy
+        position = np.minimum(np.searchsorted(cell_keys, target),
+                              len(cell_keys) - 1)
+        found = cell_keys[position] == target
+        unit_rows = rows[found]
+        unit_starts = cell_starts[position[found]]
+        unit_counts = cell_counts[position[found]]
+        if dx == dy == 0:
+            # same cell, only the points after the row
+            unit_counts = unit_starts + unit_counts - unit_rows - 1
+            unit_starts = unit_rows + 1
+
+        # units (point, cell) batched to about chunk_size candidate pairs
+        bounds = np.searchsorted(
+            np.cumsum(unit_counts),
+            np.arange(chunk_size, unit_counts.sum() + chunk_size,
+                      chunk_size),
+            side='right')
+        start = 0
+        for end in bounds:
+            end = max(end, start + 1)
+            if start >= len(unit_rows):
+                break
+            i, j = _expand(unit_rows[start:end], unit_starts[start:end],
+                           unit_counts[start:end])
+            start = end
+            dx = sorted_x[i] - sorted_x[j]
+            dy = sorted_y[i] - sorted_y[j]
+            near = np.flatnonzero(dx * dx + dy * dy <= eps2)
+            i, j = i[near], j[near]
+            distance = np.sqrt(dx[near] ** 2 + dy[near] ** 2)
+            close = distance <= eps
+            pairs_i.append(order[i[close]])
+            pairs_j.append(order[j[close]])
+            pairs_distance.append(distance[close])
+
+    return (np.concatenate(pairs_i), np.concatenate(pairs_j),
+            np.concatenate(pairs_distance))
+
+
+def labels_from_pairs(n, i, j, min_samples):
+    """
+    DBSCAN labels from the neighbour pairs of the points
+
+    Core points are points with at least min_samples neighbours, the point
+    itself included. Clusters are the connected components of core points,
+    numbered by their first core point; a border point takes the lowest
+    label among its core neighbours, as in scikit-learn.
+
+    Parameters
+    ----------
+    n :
+      number of points
+    i, j :
+      arrays of neighbour pairs, each pair once
+    min_samples :
+      neighbours of a core point
+
+    Returns
+    array of labels, -1 for noise, and array of core point flags
+    """
+    degree = 1 + np.bincount(i, minlength=n) + np.bincount(j, minlength=n)
+    core = degree >= min_samples
+    labels = np.full(n, -1, dtype=np.intp)
+    core_points = np.flatnonzero(core)
+    if len(core_points) == 0:
+        return labels, core
+
+    core_pairs = core[i] & core[j]
+    graph = csr_matrix((np.ones(core_pairs.sum(), dtype=np.int8),
+                        (i[core_pairs], j[core_pairs])), shape=(n, n))
+    n_components, components = connected_components(graph, directed=False)
+    # clusters numbered by their first core point
+    core_components = components[core_points]
+    component_ids, first = np.unique(core_components, return_index=True)
+    component_labels = np.full(n_components, -1, dtype=np.intp)
+    component_labels[component_ids[np.argsort(first)]] = np.arange(
+        len(component_ids))
+    labels[core_points] = component_labels[core_components]
+
+    # border points take the lowest label of their core neighbours
+    to_border = core[i] & ~core[j]
+    from_border = core[j] & ~core[i]
+    border = np.concatenate([j[to_border], i[from_border]])
+    border_labels = np.concatenate([labels[i[to_border]],
+                                    labels[j[from_border]]])
+    # assigned by decreasing label, the last assignment of a point wins
+    order = np.argsort(border_labels, kind='mergesort')[::-1]
+    labels[border[order]] = border_labels[order]
+    return labels, core
+
+
+def grid_dbscan(xy, eps, min_samples=5, chunk_size=CHUNK_SIZE):
+    """
+    DBSCAN on projected coordinates through an eps-sized grid, same labels
+    as `sklearn.cluster.DBSCAN(eps, min_samples).fit_predict(xy)`
+
+    Parameters
+    ----------
+    xy :
+      (n, 2) array of projected coordinates
+    eps :
+      neighbourhood radius, in the unit of the coordinates
+    min_samples :
+      neighbours of a core point, the point itself included
+    chunk_size :
+      number of candidate pairs tested at once
+
+    Returns
+    array of labels, -1 for noise
+    """
+    i, j, _ = grid_neighbours(xy, eps, chunk_size=chunk_size)
+    labels, _ = labels_from_pairs(len(xy), i, j, min_samples)
+    return labels
@@ -0,0 +1,96 @@
+# Cluster hull polygons
+"""
+One polygon per cluster: hull of its points in the local UTM zone, buffered
+and simplified there (tolerances in meters), then transformed back to
+lon/lat. Built in bulk with shapely 2 vectorised functions, per cluster
+with older shapely.
+"""
+import geopandas as gpd
+import numpy as np
+import pyproj
+import shapely
+from shapely.geometry import MultiPoint
+from shapely.ops import transform
+
+from model.cluster import projection
+
+CRS = {'init': 'epsg:4326'}
+# segments per quarter circle of the buffer
+QUAD_SEGMENTS = 8
+
+
+def _hulls(xy, labels, present, concave_ratio):
+    # hull of every present cluster, in the order of `present`
+    order = np.argsort(labels, kind='mergesort')
+    if hasattr(shapely, 'multipoints'):
+        # compact labels, incremental clustering leaves gaps between ids
+        _, dense = np.unique(labels, return_inverse=True)
+        points = shapely.multipoints(xy[order], indices=dense[order])
+        if concave_ratio is not None and hasattr(shapely, 'concave_hull'):
+            return shapely.concave_hull(points, ratio=concave_ratio)
+        return shapely.convex_hull(points)
+    starts = np.searchsorted(labels[order], present)
+    ends = np.searchsorted(labels[order], present, side='right')
+    return [MultiPoint(xy[order[start:end]]).convex_hull
+            for start, end in zip(starts, ends)]
+
+
+def cluster_hulls(lon, lat, labels, buffer=25., tolerance=10.,
+                  concave_ratio=None):
+    """
+    Hull polygon of every cluster
+
+    Parameters
+    ----------
+    lon :
+      array of longitudes in degrees
+    lat :
+      array of latitudes in degrees
+    labels :
+      array of DBSCAN labels, -1 for noise
+    buffer :
+      buffer around the hull in meters, so clusters of one or two points
+      and thin clusters still get an area
+    tolerance :
+      simplification tolerance in meters, topology preserving
+    concave_ratio :
+      None for convex hulls, else the ratio of `shapely.concave_hull`
+      (shapely 2 only, convex hulls otherwise)
+
+    Returns
+    geopandas.GeoDataFrame in lon/lat, one row per cluster with its
+    `spatial_cluster` and `count`, noise excluded
+    """
+    labels = np.asarray(labels)
+    clustered = labels >= 0
+    labels = labels[clustered]
+    n_clusters = int(labels.max()) + 1 if len(labels) else 0
+    count = np.bincount(labels, minlength=n_clusters)
+    present = np.flatnonzero(count)
+
+    xy, proj_string = projection.project_utm(
+        np.asarray(lon, dtype=float)[clustered],
+        np.asarray(lat, dtype=float)[clustered])
+    proj = pyproj.Proj(proj_string)
+    hulls = _hulls(xy, labels, present, concave_ratio)
+
+    if hasattr(shapely, 'multipoints'):
+        hulls = np.asarray(hulls) if len(present) else \
+            np.zeros(0, dtype=object)
+        buffered = shapely.buffer(hulls, buffer, quad_segs=QUAD_SEGMENTS)
+        polygons = shapely.simplify(buffered, tolerance,
+                                    preserve_topology=True)
+        polygons = shapely.transform(
+            polygons, lambda coords: np.column_stack(
+                proj(coords[:, 0], coords[:, 1], inverse=True)))
+    else:
+        polygons = []
+        for hull in hulls:
+            polygon = hull.buffer(buffer, resolution=QUAD_SEGMENTS)
+            polygon = polygon.simplify(tolerance, preserve_topology=True)
+            polygons.append(
+                transform(lambda x, y: proj(x, y, inverse=True), polygon))
+
+    return gpd.GeoDataFrame({'spatial_cluster': present,
+                             'count': count[present]},
+                            geometry=list(polygons), crs=CRS)
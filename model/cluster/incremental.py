@@ -0,0 +1,301 @@
+# Incremental DBSCAN
+"""
+Clusters are kept between runs with their core flags and neighbour counts,
+keyed by point id. When points are inserted or deleted, only neighbour
+counts around the changed points are updated, and only the clusters that
+lost a core point are reconnected; untouched clusters join the new
+connectivity graph as single nodes. Cluster ids are kept stable: a new
+cluster takes the id of the old cluster it shares the most core points
+with, and merges, splits, appearances and disappearances are reported.
+
+The core points and their partition into clusters are the ones of a full
+DBSCAN run on the new points. A border point within eps of several
+clusters keeps its previous cluster when it can.
+"""
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+from scipy import spatial
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+
+from model.cluster import grid
+from model.cluster import projection
+
+STATE_VERSION = 1
+REPORT_COLUMNS = ['event', 'cluster', 'clusters']
+
+
+def _ball_pairs(tree, xy, eps):
+    # (query row, point) pairs within eps, in one tree to tree traversal
+    if len(xy) == 0:
+        empty = np.zeros(0, dtype=np.intp)
+        return empty, empty
+    pairs = spatial.cKDTree(xy).sparse_distance_matrix(
+        tree, eps, output_type='ndarray')
+    return pairs['i'].astype(np.intp), pairs['j'].astype(np.intp)
+
+
+class IncrementalDBSCAN(object):
+    """
+    DBSCAN kept up to date as points are inserted and deleted
+
+    Parameters
+    ----------
+    eps :
+      neighbourhood radius in meters
+    minpts :
+      smallest cluster size allowed
+    """
+
+    def __init__(self, eps, minpts):
+        self.eps = eps
+        self.minpts = minpts
+        self.proj_string = None
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.xy = np.zeros((0, 2))
+        self.degree = np.zeros(0, dtype=np.intp)
+        self.core = np.zeros(0, dtype=bool)
+        self.labels = np.zeros(0, dtype=np.intp)
+        self.next_id = 0
+
+    def fit(self, ids, lon, lat):
+        """
+        Clusters points from scratch
+
+        Parameters
+        ----------
+        ids :
+          unique integer point ids
+        lon :
+          array of longitudes in degrees
+        lat :
+          array of latitudes in degrees
+
+        Returns
+        array of cluster ids, -1 for noise
+        """
+        self.xy, self.proj_string = projection.project_utm(lon, lat)
+        self.ids = np.asarray(ids, dtype=np.int64)
+        n = len(self.ids)
+        i, j, _ = grid.grid_neighbours(self.xy, self.eps)
+        self.degree = 1 + np.bincount(i, minlength=n) + \
+            np.bincount(j, minlength=n)
+        self.labels, self.core = grid.labels_from_pairs(n, i, j, self.minpts)
+        self.next_id = int(self.labels.max()) + 1 if n else 0
+        return self.labels
+
+    def update(self, ids, lon, lat):
+        """
+        Updates the clusters to a new set of points, points are matched to
+        the previous ones by id and a moved point is deleted and inserted
+
+        Parameters
+        ----------
+        ids :
+          unique integer point ids
+        lon :
+          array of longitudes in degrees
+        lat :
+          array of latitudes in degrees
+
+        Returns
+        array of cluster ids, -1 for noise, and report of the cluster
+        changes (pandas.DataFrame with columns event, cluster, clusters)
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        xy, _ = projection.project_utm(lon, lat, self.proj_string)
+        n = len(ids)
+        eps, minpts = self.eps, self.minpts
+
+        # previous position of every point, -1 if inserted or moved
+        previous = pd.Index(self.ids).get_indexer(ids)
+        retained = previous >= 0
+        moved = retained.copy()
+        moved[retained] = np.any(xy[retained] != self.xy[previous[retained]],
+                                 axis=1)
+        previous[moved] = -1
+        retained &= ~moved
+        inserted = np.flatnonzero(~retained)
+        deleted = np.ones(len(self.ids), dtype=bool)
+        deleted[previous[retained]] = False
+        deleted = np.flatnonzero(deleted)
+
+        # neighbour counts updated around deleted and inserted points only
+        tree = spatial.cKDTree(xy)
+        degree = np.zeros(n, dtype=np.intp)
+        degree[retained] = self.degree[previous[retained]]
+        _, lost_neighbours = _ball_pairs(tree, self.xy[deleted], eps)
+        lost_neighbours = lost_neighbours[retained[lost_neighbours]]
+        degree -= np.bincount(lost_neighbours, minlength=n)
+        rows, new_neighbours = _ball_pairs(tree, xy[inserted], eps)
+        degree[inserted] = np.bincount(rows, minlength=len(inserted))
+        degree += np.bincount(
+            new_neighbours[retained[new_neighbours]], minlength=n)
+        core = degree >= minpts
+
+        was_core = np.zeros(n, dtype=bool)
+        was_core[retained] = self.core[previous[retained]]
+        old_labels = np.full(n, -1, dtype=np.intp)
+        old_labels[retained] = self.labels[previous[retained]]
+        # clusters that lost a core point may split, their core points are
+        # reconnected with the new core points
+        demoted = was_core & ~core
+        broken = np.union1d(self.labels[deleted[self.core[deleted]]],
+                            old_labels[demoted])
+        in_broken = np.isin(old_labels, broken)
+        free = np.flatnonzero(core & (~was_core | in_broken))
+        intact = core & ~np.isin(np.arange(n), free)
+
+        # graph of free core points and untouched clusters, nodes of the
+        # clusters are their ids and nodes of free points follow
+        rows, free_neighbours = _ball_pairs(tree, xy[free], eps)
+        core_pair = core[free_neighbours]
+        rows, neighbours = rows[core_pair], free_neighbours[core_pair]
+        node = np.full(n, -1, dtype=np.intp)
+        node[intact] = old_labels[intact]
+        node[free] = self.next_id + np.arange(len(free))
+        n_nodes = self.next_id + len(free)
+        graph = csr_matrix((np.ones(len(rows), dtype=np.int8),
+                            (self.next_id + rows, node[neighbours])),
+                           shape=(n_nodes, n_nodes))
+        _, components = connected_components(graph, directed=False)
+
+        # old cluster ids overlapping every component, weighted by their
+        # core points
+        core_points = np.flatnonzero(core)
+        core_components = components[node[core_points]]
+        overlap = pd.DataFrame({'component': core_components,
+                                'old': old_labels[core_points]})
+        overlap = overlap[(overlap.old.values >= 0) & was_core[core_points]]
+        overlap = overlap.groupby(['component', 'old']).size().reset_index(
+            name='weight').sort_values(['weight', 'old'],
+                                       ascending=[False, True])
+        component_ids = np.full(n_nodes, -1, dtype=np.intp)
+        taken = set()
+        for component, old, _ in overlap.itertuples(index=False):
+            if component_ids[component] < 0 and old not in taken:
+                component_ids[component] = old
+                taken.add(old)
+        new_components = np.unique(core_components)
+        new_components = new_components[component_ids[new_components] < 0]
+        component_ids[new_components] = self.next_id + np.arange(
+            len(new_components))
+        # components without old core points, not split from a cluster
+        appeared = component_ids[new_components[~np.isin(
+            new_components, overlap.component.values)]]
+        next_id = self.next_id + len(new_components)
+
+        labels = np.full(n, -1, dtype=np.intp)
+        labels[core_points] = component_ids[core_components]
+        # previous cluster of every point under the new ids, untouched
+        # clusters follow their component
+        remap = np.arange(max(next_id, 1))
+        intact_ids = np.unique(old_labels[intact])
+        remap[intact_ids] = component_ids[components[intact_ids]]
+        border = ~core & (old_labels >= 0) & ~np.isin(old_labels, broken)
+        labels[border] = remap[old_labels[border]]
+
+        # border points near a change are assigned again, keeping their
+        # previous cluster when still adjacent to it
+        near_change = np.zeros(n, dtype=bool)
+        near_change[inserted] = True
+        near_change[lost_neighbours] = True
+        near_change[free_neighbours] = True
+        _, demoted_neighbours = _ball_pairs(tree, xy[demoted], eps)
+        near_change[demoted_neighbours] = True
+        reassign = np.flatnonzero(~core & (near_change | in_broken))
+        rows, neighbours = _ball_pairs(tree, xy[reassign], eps)
+        core_pair = core[neighbours]
+        candidates = pd.DataFrame({'point': reassign[rows[core_pair]],
+                                   'label': labels[neighbours[core_pair]]})
+        previous_labels = old_labels[candidates.point.values]
+        candidates['kept'] = (previous_labels >= 0) & (
+            candidates.label.values == remap[np.maximum(previous_labels, 0)])
+        candidates = candidates.sort_values(['point', 'kept', 'label'],
+                                            ascending=[True, False, True])
+        candidates = candidates.drop_duplicates('point')
+        labels[reassign] = -1
+        labels[candidates.point.values] = candidates.label.values
+
+        report = self._report(overlap, component_ids, appeared)
+        self.ids, self.xy, self.degree = ids, xy, degree
+        self.core, self.labels, self.next_id = core, labels, next_id
+        return labels, report
+
+    def _report(self, overlap, component_ids, appeared):
+        # merges, splits, appearances and disappearances of the update
+        events = []
+        for component, group in overlap.groupby('component'):
+            if len(group) > 1:
+                events.append(('merged', component_ids[component],
+                               sorted(group.old.tolist())))
+        for old, group in overlap.groupby('old'):
+            if len(group) > 1:
+                events.append(('split', old, sorted(
+                    component_ids[component] for component in group.component)))
+        events.extend(('appeared', cluster, []) for cluster in appeared)
+        previous = np.unique(self.labels[self.labels >= 0])
+        events.extend(('disappeared', old, []) for old
+                      in np.setdiff1d(previous, overlap.old.values))
+        return pd.DataFrame(
+            [(event, int(cluster), ' '.join(str(c) for c in clusters))
+             for event, cluster, clusters in events], columns=REPORT_COLUMNS)
+
+    def save(self, state_file):
+        """
+        Stores the clustering state, the file is replaced atomically
+
+        Parameters
+        ----------
+        state_file :
+          `.npz` filename
+        """
+        state_dir = os.path.dirname(os.path.abspath(state_file))
+        fd, tmp_file = tempfile.mkstemp(dir=state_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, version=STATE_VERSION, eps=self.eps,
+                     minpts=self.minpts, proj_string=self.proj_string,
+                     ids=self.ids, xy=self.xy, degree=self.degree,
+                     core=self.core, labels=self.labels,
+                     next_id=self.next_id)
+        os.replace(tmp_file, state_file)
+
+    @classmethod
+    def load(cls, state_file, eps, minpts):
+        """
+        Clustering state stored by `save`
+
+        Parameters
+        ----------
+        state_file :
+          `.npz` filename
+        eps :
+          neighbourhood radius in meters
+        minpts :
+          smallest cluster size allowed
+
+        Returns
+        IncrementalDBSCAN, None if the file is missing or was stored with
+        other parameters
+        """
+        try:
+            with np.load(state_file) as state:
+                if int(state['version']) != STATE_VERSION or \
+                        float(state['eps']) != eps or \
+                        int(state['minpts']) != minpts:
+                    return None
+                clustering = cls(eps, minpts)
+                clustering.proj_string = str(state['proj_string'])
+                clustering.ids = state['ids']
+                clustering.xy = state['xy']
+                clustering.degree = state['degree']
+                clustering.core = state['core']
+                clustering.labels = state['labels']
+                clustering.next_id = int(state['next_id'])
+                return clustering
+        except (OSError, KeyError, ValueError):
+            return None
+
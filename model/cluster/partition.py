@@ -0,0 +1,256 @@
+# Spatially partitioned parallel DBSCAN
+"""
+The extent is cut into square tiles, each clustered in a worker process
+(in the calling process from a pipeline stage or a job worker) together
+with the points within 2 eps of it (its halo):
+  - points within eps of the tile have all their eps neighbours in the
+    tile and halo, so their core flags are exact
+  - a core pair crossing the tile border is seen from both tiles
+Local clusters of core points are merged across tiles with a union-find,
+then numbered and border points assigned as a global DBSCAN run does.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+
+from model.cluster import grid
+
+# tiles per worker, to even out dense and sparse tiles
+TILES_PER_WORKER = 4
+
+
+class UnionFind(object):
+    """
+    Disjoint sets of integers with path compression
+
+    Parameters
+    ----------
+    n :
+      number of elements
+    """
+
+    def __init__(self, n):
+        self.parent = np.arange(n)
+
+    def find(self, a):
+        root = a
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[a] != root:
+            self.parent[a], a = root, self.parent[a]
+        return root
+
+    def union(self, a, b):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a != root_b:
+            self.parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    def roots(self):
+        """
+        Root of every element
+
+        Returns
+        array of roots
+        """
+        return np.array([self.find(a) for a in range(len(self.parent))],
+                        dtype=np.intp)
+
+
+def _cluster_tile(xy, n_owned, exact, eps, minpts):
+    """
+    Local clusters of a tile, run in a worker process
+
+    Parameters
+    ----------
+    xy :
+      projected coordinates, owned points first then halo points
+    n_owned :
+      number of points owned by the tile
+    exact :
+      flags of the points within eps of the tile, whose core flag is exact
+    eps :
+      neighbourhood radius in meters
+    minpts :
+      smallest cluster size allowed
+
+    Returns
+    dict of core flags and local cluster of the owned points, local
+    cluster of the exact halo core points, and (owned border point, local
+    cluster) candidate pairs
+    """
+    n = len(xy)
+    i, j, _ = grid.grid_neighbours(xy, eps)
+    degree = 1 + np.bincount(i, minlength=n) + np.bincount(j, minlength=n)
+    core = (degree >= minpts) & exact
+
+    core_pairs = core[i] & core[j]
+    graph = csr_matrix((np.ones(core_pairs.sum(), dtype=np.int8),
+                        (i[core_pairs], j[core_pairs])), shape=(n, n))
+    _, components = connected_components(graph, directed=False)
+    # local clusters numbered over core points only
+    component_ids, local = np.unique(components[core], return_inverse=True)
+    clusters = np.full(n, -1, dtype=np.intp)
+    clusters[core] = local
+
+    owned = np.arange(n) < n_owned
+    to_border = core[i] & ~core[j] & owned[j]
+    from_border = core[j] & ~core[i] & owned[i]
+    halo_core = np.flatnonzero(core & ~owned)
+    return {'core': core[:n_owned],
+            'clusters': clusters[:n_owned],
+            'n_clusters': len(component_ids),
+            'halo': halo_core - n_owned,
+            'halo_clusters': clusters[halo_core],
+            'border': np.concatenate([j[to_border], i[from_border]]),
+            'border_clusters': np.concatenate([clusters[i[to_border]],
+                                               clusters[j[from_border]]])}
+
+
+def _tiles(xy, eps, tile_size):
+    # owned points and halo points of every tile
+    origin = xy.min(axis=0)
+    tile_xy = np.floor((xy - origin) / tile_size).astype(np.int64)
+    width = tile_xy[:, 1].max() + 1
+    keys = tile_xy[:, 0] * width + tile_xy[:, 1]
+    order = np.argsort(keys, kind='mergesort')
+    tile_keys, starts, counts = np.unique(
+        keys[order], return_index=True, return_counts=True)
+
+    # points sorted by x, to select the halo of a tile with a range
+    by_x = np.argsort(xy[:, 0], kind='mergesort')
+    sorted_x = xy[by_x, 0]
+    for key, start, count in zip(tile_keys, starts, counts):
+        owned = order[start:start + count]
+        low = origin + np.array([key // width, key % width]) * tile_size
+        high = low + tile_size
+        candidates = by_x[np.searchsorted(sorted_x, low[0] - 2 * eps):
+                          np.searchsorted(sorted_x, high[0] + 2 * eps,
+                                          side='right')]
+        candidates_xy = xy[candidates]
+        in_halo = (np.all(candidates_xy >= low - 2 * eps, axis=1) &
+                   np.all(candidates_xy <= high + 2 * eps, axis=1))
+        halo = candidates[in_halo]
+        halo = halo[keys[halo] != key]
+        points = np.concatenate([owned, halo])
+        points_xy = xy[points]
+        exact = (np.all(points_xy >= low - eps, axis=1) &
+                 np.all(points_xy <= high + eps, axis=1))
+        yield owned, halo, points_xy, exact
+
+
+def default_workers():
+    """
+    Number of worker processes used when the caller gives none: one per
+    CPU from the main thread of the main process, else none (the tiles are
+    clustered in the calling process), since forking from a process running
+    other threads may deadlock and a job worker already is one of several
+    processes
+
+    Returns
+    number of workers
+    """
+    if multiprocessing.current_process().name != 'MainProcess' or \
+            threading.current_thread() is not threading.main_thread():
+        return 1
+    return os.cpu_count() or 1
+
+
+def tiled_dbscan(xy, eps, min_samples=5, tile_size=None, max_workers=None,
+                 executor=None):
+    """
+    DBSCAN on projected coordinates over tiles clustered in parallel, same
+    labels as `sklearn.cluster.DBSCAN(eps, min_samples).fit_predict(xy)`
+
+    Parameters
+    ----------
+    xy :
+      (n, 2) array of projected coordinates
+    eps :
+      neighbourhood radius, in the unit of the coordinates
+    min_samples :
+      neighbours of a core point, the point itself included
+    tile_size :
+      side of the tiles, defaults to about TILES_PER_WORKER tiles per
+      worker and at least 10 eps
+    max_workers :
+      number of worker processes, defaults to `default_workers()`; 1 runs
+      the tiles in this process
+    executor :
+      concurrent.futures executor of the caller to cluster the tiles in,
+      `max_workers` then only sets the tile size
+
+    Returns
+    array of labels, -1 for noise
+    """
+    xy = np.asarray(xy, dtype=float).reshape(-1, 2)
+    n = len(xy)
+    labels = np.full(n, -1, dtype=np.intp)
+    if n == 0:
+        return labels
+    if max_workers is None:
+        max_workers = (os.cpu_count() or 1) if executor is not None else \
+            default_workers()
+    if tile_size is None:
+        extent = (xy.max(axis=0) - xy.min(axis=0)).max()
+        tiles_per_side = np.ceil(np.sqrt(TILES_PER_WORKER * max_workers))
+        tile_size = max(extent / tiles_per_side, 10. * eps)
+    # tiles smaller than their halo only add overhead
+    tile_size = max(tile_size, 2. * eps)
+
+    tiles = list(_tiles(xy, eps, tile_size))
+    tasks = [(points_xy, len(owned), exact, eps, min_samples)
+             for owned, _, points_xy, exact in tiles]
+    if executor is not None:
+        results = list(executor.map(_cluster_tile, *zip(*tasks)))
+    elif max_workers == 1:
+        results = [_cluster_tile(*task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(_cluster_tile, *zip(*tasks)))
+
+    # local clusters of every tile as global nodes
+    offsets = np.cumsum([0] + [result['n_clusters'] for result in results])
+    core = np.zeros(n, dtype=bool)
+    nodes = np.full(n, -1, dtype=np.intp)
+    for (owned, _, _, _), result, offset in zip(tiles, results, offsets):
+        core[owned] = result['core']
+        nodes[owned[result['core']]] = \
+            result['clusters'][result['core']] + offset
+
+    # a halo core point joins its local cluster to its owner's cluster
+    links = [np.column_stack([result['halo_clusters'] + offset,
+                              nodes[halo[result['halo']]]])
+             for (_, halo, _, _), result, offset
+             in zip(tiles, results, offsets)]
+    links = np.unique(np.concatenate(links + [np.zeros((0, 2), np.intp)]),
+                      axis=0)
+    clusters = UnionFind(offsets[-1])
+    for a, b in links:
+        clusters.union(a, b)
+    roots = clusters.roots()
+
+    # clusters numbered by their first core point
+    core_points = np.flatnonzero(core)
+    core_roots = roots[nodes[core_points]]
+    root_ids, first = np.unique(core_roots, return_index=True)
+    root_labels = np.full(offsets[-1], -1, dtype=np.intp)
+    root_labels[root_ids[np.argsort(first)]] = np.arange(len(root_ids))
+    labels[core_points] = root_labels[core_roots]
+
+    # border points take the lowest label of their core neighbours
+    border = np.concatenate(
+        [owned[result['border']] for (owned, _, _, _), result
+         in zip(tiles, results)] + [np.zeros(0, np.intp)])
+    border_labels = np.concatenate(
+        [root_labels[roots[result['border_clusters'] + offset]]
+         for result, offset in zip(results, offsets)] +
+        [np.zeros(0, np.intp)])
+    # assigned by decreasing label, the last assignment of a point wins
+    order = np.argsort(border_labels, kind='mergesort')[::-1]
+    labels[border[order]] = border_labels[order]
+    return labels
@@ -0,0 +1,55 @@
+# Projection of lon/lat coordinates to metres
+"""
+Points are projected to the UTM zone of their centroid, as osmnx does for
+`project_gdf`, so that euclidean distances are metric distances
+"""
+import numpy as np
+import pyproj
+
+
+def utm_proj_string(lon, lat):
+    """
+    PROJ string of the UTM zone containing a point
+
+    Parameters
+    ----------
+    lon :
+      longitude in degrees
+    lat :
+      latitude in degrees
+
+    Returns
+    PROJ string
+    """
+    zone = int(np.floor((lon + 180.) / 6.)) % 60 + 1
+    proj_string = '+proj=utm +zone={} +ellps=WGS84 +datum=WGS84 +units=m ' \
+                  '+no_defs'.format(zone)
+    if lat < 0:
+        proj_string += ' +south'
+    return proj_string
+
+
+def project_utm(lon, lat, proj_string=None):
+    """
+    Project lon/lat coordinates to the UTM zone of their centroid
+
+    Parameters
+    ----------
+    lon :
+      array of longitudes in degrees
+    lat :
+      array of latitudes in degrees
+    proj_string :
+      PROJ string of the projection, defaults to the UTM zone of the
+      centroid
+
+    Returns
+    (n, 2) array of x/y coordinates in metres, PROJ string
+    """
+    lon = np.asarray(lon, dtype=float)
+    lat = np.asarray(lat, dtype=float)
+    if proj_string is None:
+        proj_string = utm_proj_string(np.nanmean(lon) if len(lon) else 0.,
+                                      np.nanmean(lat) if len(lat) else 0.)
+    x, y = pyproj.Proj(proj_string)(lon, lat)
+    return np.column_stack([x, y]), proj_string
@@ -0,0 +1,124 @@
+# Cluster statistics
+"""
+Per cluster reductions over the point arrays in one pass: points are
+sorted by label once, sums come from `np.bincount` and extrema from
+`np.minimum.reduceat`/`np.maximum.reduceat`. Noise (label -1) is kept out
+of the clusters and counted separately.
+"""
+import numpy as np
+import pandas as pd
+import shapely
+from shapely.geometry import MultiPoint
+
+from model.cluster import projection
+
+CLUSTER_COLUMNS = ['spatial_cluster', 'count', 'lon', 'lat', 'min_lon',
+                   'min_lat', 'max_lon', 'max_lat', 'radius_of_gyration',
+                   'hull_area', 'density']
+
+
+def hull_areas(xy, labels, n_clusters):
+    """
+    Convex hull area of every cluster
+
+    Parameters
+    ----------
+    xy :
+      (n, 2) array of projected coordinates of clustered points
+    labels :
+      array of cluster labels, from 0 to n_clusters - 1, not necessarily
+      all present
+    n_clusters :
+      number of clusters
+
+    Returns
+    array of areas, in squared units of the coordinates
+    """
+    order = np.argsort(labels, kind='mergesort')
+    areas = np.zeros(n_clusters)
+    if hasattr(shapely, 'multipoints'):
+        # vectorised hulls with shapely 2, built on compact labels as
+        # incremental clustering leaves gaps between cluster ids
+        present, dense = np.unique(labels, return_inverse=True)
+        points = shapely.multipoints(xy[order], indices=dense[order])
+        areas[present] = np.nan_to_num(
+            shapely.area(shapely.convex_hull(points)))
+        return areas
+    bounds = np.searchsorted(labels[order], np.arange(n_clusters + 1))
+    return np.array([MultiPoint(xy[order[start:end]]).convex_hull.area
+                     for start, end in zip(bounds[:-1], bounds[1:])])
+
+
+def cluster_statistics(lon, lat, labels):
+    """
+    Count, centroid, bounding box, radius of gyration, convex hull area and
+    density of every cluster
+
+    Parameters
+    ----------
+    lon :
+      array of longitudes in degrees
+    lat :
+      array of latitudes in degrees
+    labels :
+      array of DBSCAN labels, -1 for noise
+
+    Returns
+    pandas.DataFrame, one row per cluster (lengths in meters, hull area in
+    square meters, density in points per square kilometer), and the number
+    of noise points
+    """
+    lon = np.asarray(lon, dtype=float)
+    lat = np.asarray(lat, dtype=float)
+    labels = np.asarray(labels)
+    clustered = labels >= 0
+    n_noise = int((~clustered).sum())
+    lon, lat, labels = lon[clustered], lat[clustered], labels[clustered]
+    n_clusters = int(labels.max()) + 1 if len(labels) else 0
+
+    count = np.bincount(labels, minlength=n_clusters)
+    present = count > 0
+    safe_count = np.maximum(count, 1)
+    centroid_lon = np.bincount(labels, lon, n_clusters) / safe_count
+    centroid_lat = np.bincount(labels, lat, n_clusters) / safe_count
+
+    # extrema over runs of equal labels
+    order = np.argsort(labels, kind='mergesort')
+    starts = np.searchsorted(labels[order], np.flatnonzero(present))
+    bbox = np.full((n_clusters, 4), np.nan)
+    if len(starts):
+        sorted_lon, sorted_lat = lon[order], lat[order]
+        bbox[present] = np.column_stack([
+            np.minimum.reduceat(sorted_lon, starts),
+            np.minimum.reduceat(sorted_lat, starts),
+            np.maximum.reduceat(sorted_lon, starts),
+            np.maximum.reduceat(sorted_lat, starts)])
+
+    # radius of gyration from the projected second moments, coordinates
+    # centred first for precision
+    xy, _ = projection.project_utm(lon, lat)
+    xy -= xy.mean(axis=0) if len(xy) else 0.
+    mean_x = np.bincount(labels, xy[:, 0], n_clusters) / safe_count
+    mean_y = np.bincount(labels, xy[:, 1], n_clusters) / safe_count
+    second_moment = np.bincount(labels, (xy ** 2).sum(axis=1),
+                                n_clusters) / safe_count
+    radius_of_gyration = np.sqrt(np.maximum(
+        second_moment - mean_x ** 2 - mean_y ** 2, 0.))
+
+    hull_area = hull_areas(xy, labels, n_clusters)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        density = np.where(hull_area > 0, count / (hull_area / 1e6), np.nan)
+
+    statistics = pd.DataFrame({
+        'spatial_cluster': np.arange(n_clusters),
+        'count': count,
+        'lon': centroid_lon,
+        'lat': centroid_lat,
+        'min_lon': bbox[:, 0],
+        'min_lat': bbox[:, 1],
+        'max_lon': bbox[:, 2],
+        'max_lat': bbox[:, 3],
+        'radius_of_gyration': radius_of_gyration,
+        'hull_area': hull_area,
+        'density': density}, columns=CLUSTER_COLUMNS)
+    return statistics[present].reset_index(drop=True), n_noise
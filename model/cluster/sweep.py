@@ -0,0 +1,149 @@
+# Clustering parameter sweeps
+"""
+One radius neighbour search at the largest eps of interest, every
+(eps, minpts) clustering is then derived from the stored neighbour pairs
+without searching again
+"""
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import NearestNeighbors
+
+from model.cluster import dbscan
+from model.cluster import grid
+from model.cluster import projection
+from model.network import distance as network_distance
+
+SWEEP_COLUMNS = ['eps', 'minpts', 'n_clusters', 'n_core', 'n_noise',
+                 'noise_ratio', 'largest_cluster']
+
+
+class NeighbourGraph(object):
+    """
+    Sparse neighbour graph of points, each pair within max_eps once
+
+    Parameters
+    ----------
+    n :
+      number of points
+    i, j :
+      arrays of neighbour pairs
+    distance :
+      array of pair distances in meters
+    max_eps :
+      radius the pairs were searched with, in meters
+    """
+
+    def __init__(self, n, i, j, distance, max_eps):
+        # sorted by distance, the pairs within an eps are a prefix
+        order = np.argsort(distance, kind='mergesort')
+        self.n = n
+        self.i = i[order]
+        self.j = j[order]
+        self.distance = distance[order]
+        self.max_eps = max_eps
+
+    def pairs(self, eps):
+        """
+        Neighbour pairs within eps
+
+        Parameters
+        ----------
+        eps :
+          radius in meters, at most max_eps
+
+        Returns
+        arrays i, j
+        """
+        if eps > self.max_eps:
+            raise ValueError('eps {} above the graph radius {}'.format(
+                eps, self.max_eps))
+        end = np.searchsorted(self.distance, eps, side='right')
+        return self.i[:end], self.j[:end]
+
+    def labels(self, eps, minpts):
+        """
+        DBSCAN labels for a parameter setting
+
+        Parameters
+        ----------
+        eps :
+          neighbourhood radius in meters, at most max_eps
+        minpts :
+          smallest cluster size allowed
+
+        Returns
+        array of labels, -1 for noise, and array of core point flags
+        """
+        i, j = self.pairs(eps)
+        return grid.labels_from_pairs(self.n, i, j, minpts)
+
+    def sweep(self, eps_values, minpts_values):
+        """
+        Cluster counts and noise ratios of every (eps, minpts) setting
+
+        Parameters
+        ----------
+        eps_values :
+          neighbourhood radii in meters, at most max_eps
+        minpts_values :
+          smallest cluster sizes
+
+        Returns
+        pandas.DataFrame, one row per setting
+        """
+        rows = []
+        for eps in sorted(eps_values):
+            for minpts in sorted(minpts_values):
+                labels, core = self.labels(eps, minpts)
+                sizes = np.bincount(labels[labels >= 0])
+                n_noise = int((labels < 0).sum())
+                rows.append((eps, minpts, len(sizes), int(core.sum()),
+                             n_noise, n_noise / float(max(self.n, 1)),
+                             int(sizes.max()) if len(sizes) else 0))
+        return pd.DataFrame(rows, columns=SWEEP_COLUMNS)
+
+
+def neighbour_graph(lon, lat, max_eps, engine='haversine', network=None):
+    """
+    Neighbour graph of lon/lat points within max_eps
+
+    Parameters
+    ----------
+    lon :
+      array of longitudes in degrees
+    lat :
+      array of latitudes in degrees
+    max_eps :
+      largest neighbourhood radius of interest, in meters
+    engine :
+      'haversine' for great circle distances with a ball tree, 'grid' or
+      'tiled' for distances in the local UTM zone with an eps-sized grid,
+      'network' for street network distances
+    network : network.store.StreetNetwork
+      street network of the 'network' engine
+
+    Returns
+    NeighbourGraph
+    """
+    if engine == 'network':
+        if network is None:
+            raise ValueError('The network engine needs a street network')
+        i, j, distance = network_distance.network_neighbours(
+            network, lon, lat, max_eps)
+    elif engine in ('grid', 'tiled'):
+        xy, _ = projection.project_utm(lon, lat)
+        i, j, distance = grid.grid_neighbours(xy, max_eps)
+    elif engine == 'haversine':
+        points = np.deg2rad(np.column_stack([lat, lon]))
+        nn = NearestNeighbors(radius=max_eps / dbscan.EARTH_RADIUS,
+                              metric='haversine',
+                              algorithm='ball_tree').fit(points)
+        graph = nn.radius_neighbors_graph(points, mode='distance').tocoo()
+        # each pair once, the point itself excluded
+        upper = graph.row < graph.col
+        i, j = graph.row[upper], graph.col[upper]
+        distance = graph.data[upper] * dbscan.EARTH_RADIUS
+    else:
+        raise ValueError('Unknown DBSCAN engine {}, expected one of {}'.format(
+            engine, ', '.join(dbscan.ENGINES)))
+    return NeighbourGraph(len(lon), i, j, distance, max_eps)
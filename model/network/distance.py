@@ -0,0 +1,118 @@
+# Street network distances between points
+"""
+Points are snapped to their nearest network node in the UTM zone of the
+network, and the distance between two points is the access distance of
+each to its node plus the shortest path between the nodes, edges taken in
+both directions. Shortest paths are searched from every snapped node with
+Dijkstra bounded at eps, in chunks of sources, over the nodes within eps of
+a snapped node only: a path no longer than eps never leaves the eps
+neighbourhood of its source.
+"""
+import numpy as np
+from scipy import spatial
+from scipy.sparse.csgraph import dijkstra
+
+from model.cluster import grid
+from model.cluster import projection
+
+# shortest path distances kept in memory at once
+CHUNK_SIZE = 1 << 22
+# margin on eps for the node neighbourhood, edge lengths are great circle
+# distances and the UTM scale factor is up to 1.001
+NEIGHBOURHOOD_MARGIN = 1.01
+
+
+def snap_to_nodes(network, lon, lat):
+    """
+    Nearest network node of every point
+
+    Parameters
+    ----------
+    network : network.store.StreetNetwork
+      street network
+    lon :
+      array of longitudes in degrees
+    lat :
+      array of latitudes in degrees
+
+    Returns
+    arrays of node positions and distances to them in meters, projected
+    node coordinates
+    """
+    node_xy, proj_string = projection.project_utm(network.node_x,
+                                                  network.node_y)
+    xy, _ = projection.project_utm(lon, lat, proj_string)
+    access, node = spatial.cKDTree(node_xy).query(xy)
+    return node.astype(np.intp), access, node_xy
+
+
+def network_neighbours(network, lon, lat, eps, chunk_size=CHUNK_SIZE):
+    """
+    Pairs of points closer than eps along the street network
+
+    Parameters
+    ----------
+    network : network.store.StreetNetwork
+      street network
+    lon :
+      array of longitudes in degrees
+    lat :
+      array of latitudes in degrees
+    eps :
+      neighbourhood radius in meters
+    chunk_size :
+      number of shortest path distances kept at once
+
+    Returns
+    arrays i, j and distances of the neighbour pairs, each pair once
+    with i != j
+    """
+    empty = np.zeros(0, dtype=np.intp)
+    if len(lon) == 0 or network.n_nodes == 0:
+        return empty, empty, np.zeros(0)
+    node, access, node_xy = snap_to_nodes(network, lon, lat)
+
+    # points grouped by node
+    order = np.argsort(node, kind='mergesort')
+    nodes, starts, counts = np.unique(node[order], return_index=True,
+                                      return_counts=True)
+
+    # nodes reachable within eps from a snapped node
+    reachable, _ = spatial.cKDTree(node_xy[nodes]).query(
+        node_xy, distance_upper_bound=eps * NEIGHBOURHOOD_MARGIN)
+    reachable = np.flatnonzero(np.isfinite(reachable))
+    graph = network.adjacency()[reachable][:, reachable]
+    sources = np.searchsorted(reachable, nodes)
+
+    pairs_i, pairs_j, pairs_distance = [empty], [empty], [np.zeros(0)]
+    rows_per_chunk = max(1, chunk_size // len(reachable))
+    for chunk_start in range(0, len(nodes), rows_per_chunk):
+        chunk = sources[chunk_start:chunk_start + rows_per_chunk]
+        path = dijkstra(graph, directed=False, indices=chunk, limit=eps)
+        # node pairs (a, b) with b >= a
+        path = path[:, sources[chunk_start:]]
+        a, b = np.nonzero(np.isfinite(path))
+        later = b >= a
+        a, b = a[later], b[later]
+        path = path[a, b]
+        a, b = a + chunk_start, b + chunk_start
+
+        # every point of node a against every point of node b, points of
+        # one node paired once
+        units, i = grid._expand(np.arange(len(a)), starts[a], counts[a])
+        same = a[units] == b[units]
+        unit_starts = np.where(same, i + 1, starts[b[units]])
+        unit_counts = np.where(same, starts[a[units]] + counts[a[units]] - i -
+                               1, counts[b[units]])
+        repeats, j = grid._expand(np.arange(len(units)), unit_starts,
+                                  unit_counts)
+        i = order[i[repeats]]
+        j = order[j]
+        distance = access[i] + path[units[repeats]] + access[j]
+        close = distance <= eps
+        pairs_i.append(i[close])
+        pairs_j.append(j[close])
+        pairs_distance.append(distance[close])
+
+    return (np.concatenate(pairs_i), np.concatenate(pairs_j),
+            np.concatenate(pairs_distance))
@@ -0,0 +1,270 @@
+# Nearest edge snapping
+"""
+Edges of a street network are cut into straight pieces of at most
+PIECE_LENGTH meters in the UTM zone of the network, and a KD-tree is built
+over the piece midpoints. A point's nearest piece is among its k nearest
+midpoints once the k-th midpoint is farther than the best piece distance
+plus half a piece length, k is doubled for the points where it is not.
+The pieces are cached next to the stored network, which is replaced as a
+whole when downloaded again.
+"""
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+import shapely
+from scipy import spatial
+
+from model.cluster import projection
+
+INDEX_VERSION = 1
+INDEX_FILE = 'snap_index.npz'
+# longest straight piece, bounds the midpoint to piece distance
+PIECE_LENGTH = 50.
+SNAP_COLUMNS = ['edge', 'u', 'v', 'key', 'offset', 'distance']
+
+
+def _edge_coordinates(geometries):
+    # coordinates of every edge and the edge they belong to
+    if hasattr(shapely, 'get_coordinates'):
+        return shapely.get_coordinates(geometries, return_index=True)
+    coords = [np.asarray(geometry.coords)[:, :2] for geometry in geometries]
+    index = np.repeat(np.arange(len(coords)),
+                      [len(edge_coords) for edge_coords in coords])
+    return (np.concatenate(coords) if coords else np.zeros((0, 2)),
+            index)
+
+
+def _point_segment(xy, start, end):
+    # distance of points to segments and position along them, in [0, 1]
+    direction = end - start
+    squared = np.einsum('...i,...i->...', direction, direction)
+    t = np.einsum('...i,...i->...', xy - start, direction) / \
+        np.where(squared > 0, squared, 1.)
+    t = np.clip(t, 0., 1.)
+    nearest = start + t[..., None] * direction
+    return np.hypot(*np.moveaxis(xy - nearest, -1, 0)), t
+
+
+class EdgeIndex(object):
+    """
+    Straight pieces of the network edges in meters, with a KD-tree over
+    their midpoints
+
+    Parameters
+    ----------
+    proj_string :
+      PROJ string of the projection
+    start :
+      (n, 2) array of piece starts
+    end :
+      (n, 2) array of piece ends
+    edge :
+      edge position of every piece, in CSR order
+    offset :
+      distance along the edge to the piece start in meters
+    """
+
+    def __init__(self, proj_string, start, end, edge, offset):
+        self.proj_string = proj_string
+        self.start = start
+        self.end = end
+        self.edge = edge
+        self.offset = offset
+        self.tree = spatial.cKDTree((start + end) / 2.)
+
+    @classmethod
+    def build(cls, network):
+        """
+        Cut the edges of a network into pieces
+
+        Parameters
+        ----------
+        network : network.store.StreetNetwork
+          street network
+
+        Returns
+        EdgeIndex
+        """
+        lonlat, index = _edge_coordinates(network.edge_geometries())
+        xy, proj_string = projection.project_utm(
+            lonlat[:, 0], lonlat[:, 1],
+            projection.utm_proj_string(np.mean(network.node_x),
+                                       np.mean(network.node_y))
+            if network.n_nodes else None)
+
+        # consecutive vertices of one edge form a segment
+        same_edge = index[1:] == index[:-1]
+        start, end = xy[:-1][same_edge], xy[1:][same_edge]
+        edge = index[:-1][same_edge]
+        length = np.hypot(*(end - start).T)
+        # distance along the edge to every segment start
+        before = np.cumsum(length) - length
+        first = np.flatnonzero(np.concatenate([[True], edge[1:] != edge[:-1]]))
+        before -= np.repeat(before[first], np.diff(np.append(first,
+                                                             len(edge))))
+
+        # segments cut into pieces of equal length
+        n_pieces = np.maximum(np.ceil(length / PIECE_LENGTH), 1).astype(
+            np.intp)
+        segment = np.repeat(np.arange(len(edge)), n_pieces)
+        piece = np.arange(len(segment)) - np.repeat(
+            np.cumsum(n_pieces) - n_pieces, n_pieces)
+        t0 = (piece / n_pieces[segment])[:, None]
+        t1 = ((piece + 1) / n_pieces[segment])[:, None]
+        direction = (end - start)[segment]
+        return cls(proj_string,
+                   start[segment] + t0 * direction,
+                   start[segment] + t1 * direction,
+                   edge[segment],
+                   before[segment] + t0[:, 0] * length[segment])
+
+    def save(self, index_file):
+        """
+        Stores the pieces, the file is replaced atomically
+
+        Parameters
+        ----------
+        index_file :
+          `.npz` filename
+        """
+        index_dir = os.path.dirname(os.path.abspath(index_file))
+        fd, tmp_file = tempfile.mkstemp(dir=index_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, version=INDEX_VERSION, proj_string=self.proj_string,
+                     start=self.start, end=self.end, edge=self.edge,
+                     offset=self.offset)
+        os.replace(tmp_file, index_file)
+
+    @classmethod
+    def load(cls, index_file, n_edges):
+        """
+        Pieces stored by `save`
+
+        Parameters
+        ----------
+        index_file :
+          `.npz` filename
+        n_edges :
+          number of edges of the network
+
+        Returns
+        EdgeIndex, None if the file is missing or does not match the
+        network
+        """
+        try:
+            with np.load(index_file) as index:
+                if int(index['version']) != INDEX_VERSION or (
+                        len(index['edge']) and
+                        int(index['edge'].max()) >= n_edges):
+                    return None
+                return cls(str(index['proj_string']), index['start'],
+                           index['end'], index['edge'], index['offset'])
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def nearest(self, lon, lat, k=8):
+        """
+        Nearest piece of every point
+
+        Parameters
+        ----------
+        lon :
+          array of longitudes in degrees
+        lat :
+          array of latitudes in degrees
+        k :
+          number of midpoints looked at first
+
+        Returns
+        arrays of piece positions, offsets along the edges and distances in
+        meters
+        """
+        xy, _ = projection.project_utm(lon, lat, self.proj_string)
+        n = len(xy)
+        if not len(self.edge):
+            return (np.full(n, -1, dtype=np.intp), np.full(n, np.nan),
+                    np.full(n, np.inf))
+        piece = np.zeros(n, dtype=np.intp)
+        t = np.zeros(n)
+        distance = np.full(n, np.inf)
+        half_length = np.hypot(*(self.end - self.start).T).max() / 2.
+        todo = np.arange(n)
+        k = min(k, len(self.edge))
+        while len(todo):
+            midpoint_distance, candidates = self.tree.query(xy[todo], k=k)
+            candidates = candidates.reshape(len(todo), k)
+            midpoint_distance = midpoint_distance.reshape(len(todo), k)
+            candidate_distance, candidate_t = _point_segment(
+                xy[todo][:, None, :], self.start[candidates],
+                self.end[candidates])
+            best = np.argmin(candidate_distance, axis=1)
+            rows = np.arange(len(todo))
+            piece[todo] = candidates[rows, best]
+            t[todo] = candidate_t[rows, best]
+            distance[todo] = candidate_distance[rows, best]
+            # unseen pieces may still be nearer
+            exact = (k == len(self.edge)) | (
+                midpoint_distance[:, -1] > distance[todo] + half_length)
+            todo = todo[~exact]
+            k = min(2 * k, len(self.edge))
+
+        length = np.hypot(*(self.end[piece] - self.start[piece]).T)
+        return piece, self.offset[piece] + t * length, distance
+
+
+def edge_index(network):
+    """
+    Edge index of a stored network, built and cached on first use
+
+    Parameters
+    ----------
+    network : network.store.StreetNetwork
+      street network
+
+    Returns
+    EdgeIndex
+    """
+    index_file = os.path.join(network.directory, INDEX_FILE)
+    index = EdgeIndex.load(index_file, network.n_edges)
+    if index is None:
+        index = EdgeIndex.build(network)
+        index.save(index_file)
+    return index
+
+
+def snap_points(network, lon, lat):
+    """
+    Snap points to their nearest street network edge
+
+    Parameters
+    ----------
+    network : network.store.StreetNetwork
+      street network
+    lon :
+      array of longitudes in degrees
+    lat :
+      array of latitudes in degrees
+
+    Returns
+    pandas.DataFrame with the edge position (CSR order), its `u`, `v` node
+    ids and `key`, the offset along the edge and the distance to it in
+    meters, one row per point
+    """
+    index = edge_index(network)
+    piece, offset, distance = index.nearest(lon, lat)
+    edge = np.where(piece >= 0, index.edge[np.maximum(piece, 0)], -1) \
+        if len(index.edge) else piece
+    valid = edge >= 0
+    u = np.full(len(edge), -1, dtype=np.int64)
+    v = np.full(len(edge), -1, dtype=np.int64)
+    key = np.full(len(edge), -1, dtype=np.int64)
+    u[valid] = np.asarray(network.node_id)[
+        network.edge_sources()[edge[valid]]]
+    v[valid] = np.asarray(network.node_id)[
+        np.asarray(network.indices)[edge[valid]]]
+    key[valid] = np.asarray(network.edge_key)[edge[valid]]
+    return pd.DataFrame({'edge': edge, 'u': u, 'v': v, 'key': key,
+                         'offset': offset, 'distance': distance},
+                        columns=SNAP_COLUMNS)
@@ -0,0 +1,316 @@
+# Binary street network storage
+"""
+A street network is stored as a directory of arrays instead of GraphML:
+  node_id.npy, node_x.npy, node_y.npy   nodes sorted by id
+  indptr.npy, indices.npy               CSR adjacency over node positions,
+                                        edges sorted by (u, v, key)
+  edge_key.npy, edge_length.npy         per edge, in CSR order
+  attributes.parquet                    other node and edge attributes as
+                                        JSON, edge geometries as WKB
+  graph.json                            graph attributes
+Arrays are memory mapped on load; the NetworkX graph is only rebuilt when
+asked for.
+"""
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import shapely
+import shapely.wkb
+from scipy.sparse import csr_matrix
+from shapely.geometry import LineString
+
+from model.storage import storage
+
+FORMAT_VERSION = 1
+ARRAYS = ['node_id', 'node_x', 'node_y', 'indptr', 'indices', 'edge_key',
+          'edge_length']
+FILES = [name + '.npy' for name in ARRAYS] + ['attributes.parquet',
+                                              'graph.json']
+# node and edge attributes stored in arrays
+NODE_ARRAY_ATTRIBUTES = ('x', 'y', 'osmid')
+EDGE_ARRAY_ATTRIBUTES = ('length', 'geometry')
+
+
+def network_files(directory):
+    """
+    Files of a stored network
+
+    Parameters
+    ----------
+    directory :
+      network directory
+
+    Returns
+    List of filenames
+    """
+    return [os.path.join(directory, filename) for filename in FILES]
+
+
+def _json_value(value):
+    # numpy scalars and shapely objects are not JSON serialisable
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+
+def save_network(graph, directory):
+    """
+    Store a street network, the directory is replaced as a whole
+
+    Parameters
+    ----------
+    graph : networkx.MultiDiGraph
+      osmnx street network
+    directory :
+      network directory
+    """
+    storage._require_pyarrow()
+    node_id = np.array(sorted(graph.nodes), dtype=np.int64)
+    nodes = [graph.nodes[node] for node in node_id.tolist()]
+    node_x = np.array([data['x'] for data in nodes], dtype=float)
+    node_y = np.array([data['y'] for data in nodes], dtype=float)
+
+    edges = list(graph.edges(keys=True, data=True))
+    u = np.searchsorted(node_id, np.array([edge[0] for edge in edges],
+                                          dtype=np.int64))
+    v = np.searchsorted(node_id, np.array([edge[1] for edge in edges],
+                                          dtype=np.int64))
+    edge_key = np.array([edge[2] for edge in edges], dtype=np.int64)
+    order = np.lexsort((edge_key, v, u))
+    edges = [edges[position] for position in order]
+    indptr = np.concatenate([[0], np.cumsum(
+        np.bincount(u, minlength=len(node_id)))]).astype(np.int64)
+
+    arrays = {
+        'node_id': node_id,
+        'node_x': node_x,
+        'node_y': node_y,
+        'indptr': indptr,
+        'indices': v[order].astype(np.int64),
+        'edge_key': edge_key[order],
+        'edge_length': np.array([edge[3].get('length', np.nan)
+                                 for edge in edges], dtype=float)}
+
+    node_attributes = [json.dumps(
+        {key: value for key, value in data.items()
+         if key not in NODE_ARRAY_ATTRIBUTES}, default=_json_value)
+        for data in nodes]
+    edge_attributes = [json.dumps(
+        {key: value for key, value in edge[3].items()
+         if key not in EDGE_ARRAY_ATTRIBUTES}, default=_json_value)
+        for edge in edges]
+    edge_geometry = [edge[3]['geometry'].wkb if 'geometry' in edge[3]
+                     else None for edge in edges]
+    # one table, node rows first then edge rows
+    table = storage.pa.Table.from_arrays(
+        [storage.pa.array(node_attributes + edge_attributes,
+                          type=storage.pa.string()),
+         storage.pa.array([None] * len(nodes) + edge_geometry,
+                          type=storage.pa.binary())],
+        names=['attributes', 'geometry'])
+
+    parent = os.path.dirname(os.path.abspath(directory))
+    tmp_dir = tempfile.mkdtemp(dir=parent, suffix='.tmp')
+    try:
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_dir, name + '.npy'), array)
+        storage.pq.write_table(table,
+                               os.path.join(tmp_dir, 'attributes.parquet'))
+        with open(os.path.join(tmp_dir, 'graph.json'), 'w') as f:
+            json.dump({'version': FORMAT_VERSION,
+                       'graph': graph.graph}, f, default=_json_value)
+        if os.path.isdir(directory):
+            shutil.rmtree(directory)
+        os.rename(tmp_dir, directory)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+
+class StreetNetwork(object):
+    """
+    Street network stored by `save_network`, arrays memory mapped
+
+    Parameters
+    ----------
+    directory :
+      network directory
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, 'graph.json')) as f:
+            info = json.load(f)
+        if info.get('version') != FORMAT_VERSION:
+            raise ValueError('Unsupported network format {}'.format(
+                info.get('version')))
+        self.graph_attributes = info['graph']
+        for name in ARRAYS:
+            setattr(self, name, np.load(os.path.join(directory, name + '.npy'),
+                                        mmap_mode='r'))
+        self._attributes = None
+        self._graph = None
+
+    @property
+    def n_nodes(self):
+        return len(self.node_id)
+
+    @property
+    def n_edges(self):
+        return len(self.indices)
+
+    def edge_sources(self):
+        """
+        Source node position of every edge
+
+        Returns
+        array of node positions, in CSR order
+        """
+        return np.repeat(np.arange(self.n_nodes), np.diff(self.indptr))
+
+    def _attribute_table(self):
+        if self._attributes is None:
+            self._attributes = storage.pq.read_table(
+                os.path.join(self.directory, 'attributes.parquet'),
+                memory_map=True)
+        return self._attributes
+
+    def edge_geometries(self):
+        """
+        Geometry of every edge, straight lines between the nodes where osmnx
+        stored none
+
+        Returns
+        array of LineString, in CSR order
+        """
+        wkb = np.array(self._attribute_table().column('geometry').to_pylist()[
+            self.n_nodes:], dtype=object)
+        sources, targets = self.edge_sources(), np.asarray(self.indices)
+        straight = np.array([geometry is None for geometry in wkb],
+                            dtype=bool)
+        if hasattr(shapely, 'from_wkb'):
+            # vectorised with shapely 2
+            geometries = np.empty(len(wkb), dtype=object)
+            geometries[~straight] = shapely.from_wkb(wkb[~straight])
+            ends = np.stack([sources[straight], targets[straight]], axis=1)
+            coords = np.stack([np.asarray(self.node_x)[ends.ravel()],
+                               np.asarray(self.node_y)[ends.ravel()]], axis=1)
+            geometries[straight] = shapely.linestrings(
+                coords, indices=np.repeat(np.arange(straight.sum()), 2))
+            return geometries
+        geometries = np.empty(len(wkb), dtype=object)
+        geometries[:] = [
+            shapely.wkb.loads(geometry) if geometry is not None else
+            LineString([(self.node_x[u], self.node_y[u]),
+                        (self.node_x[v], self.node_y[v])])
+            for geometry, u, v in zip(wkb, sources, targets)]
+        return geometries
+
+    def segments(self):
+        """
+        Coordinates of every edge, for plotting
+
+        Returns
+        list of (k, 2) arrays, in CSR order
+        """
+        geometries = self.edge_geometries()
+        if hasattr(shapely, 'get_coordinates'):
+            coords, index = shapely.get_coordinates(geometries,
+                                                    return_index=True)
+            return np.split(coords, np.flatnonzero(np.diff(index)) + 1) \
+                if len(coords) else []
+        return [np.asarray(geometry.coords) for geometry in geometries]
+
+    def adjacency(self, weight='length'):
+        """
+        Sparse adjacency matrix over node positions, the shortest of
+        parallel edges
+
+        Parameters
+        ----------
+        weight :
+          'length' for edge lengths in meters
+
+        Returns
+        scipy.sparse.csr_matrix
+        """
+        if weight != 'length':
+            raise ValueError('Unsupported weight {}'.format(weight))
+        sources = self.edge_sources()
+        # parallel edges are consecutive, (u, v) runs
+        pair = sources * self.n_nodes + np.asarray(self.indices)
+        starts = np.flatnonzero(np.concatenate([[True],
+                                                pair[1:] != pair[:-1]])) \
+            if len(pair) else np.zeros(0, dtype=np.intp)
+        lengths = np.minimum.reduceat(np.asarray(self.edge_length), starts) \
+            if len(starts) else np.zeros(0)
+        return csr_matrix((lengths, (sources[starts],
+                                     np.asarray(self.indices)[starts])),
+                          shape=(self.n_nodes, self.n_nodes))
+
+    @property
+    def graph(self):
+        """
+        NetworkX graph, rebuilt on first use
+
+        Returns
+        networkx.MultiDiGraph
+        """
+        if self._graph is None:
+            self._graph = self.to_networkx()
+        return self._graph
+
+    def to_networkx(self):
+        """
+        Rebuild the osmnx street network
+
+        Returns
+        networkx.MultiDiGraph
+        """
+        import networkx as nx
+
+        attributes = self._attribute_table()
+        attribute_json = attributes.column('attributes').to_pylist()
+        wkb = attributes.column('geometry').to_pylist()
+        graph = nx.MultiDiGraph(**self.graph_attributes)
+        if 'streets_per_node' in graph.graph:
+            graph.graph['streets_per_node'] = {
+                int(node): count for node, count
+                in graph.graph['streets_per_node'].items()}
+
+        node_id = self.node_id.tolist()
+        for position, node in enumerate(node_id):
+            data = json.loads(attribute_json[position])
+            data.update(x=float(self.node_x[position]),
+                        y=float(self.node_y[position]), osmid=node)
+            graph.add_node(node, **data)
+        sources = self.edge_sources()
+        for position in range(self.n_edges):
+            data = json.loads(attribute_json[self.n_nodes + position])
+            if not np.isnan(self.edge_length[position]):
+                data['length'] = float(self.edge_length[position])
+            if wkb[self.n_nodes + position] is not None:
+                data['geometry'] = shapely.wkb.loads(
+                    wkb[self.n_nodes + position])
+            graph.add_edge(node_id[sources[position]],
+                           node_id[self.indices[position]],
+                           key=int(self.edge_key[position]), **data)
+        return graph
+
+
+def load_network(directory):
+    """
+    Load a stored street network
+
+    Parameters
+    ----------
+    directory :
+      network directory
+
+    Returns
+    StreetNetwork
+    """
+    return StreetNetwork(directory)
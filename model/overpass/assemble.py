@@ -0,0 +1,505 @@
+# Columnar assembly of Overpass elements into GeoDataFrames
+"""
+Elements are appended to typed columns (ids, coordinates, tags of interest)
+and the GeoDataFrame is built once, with geometries created in bulk
+"""
+from array import array
+
+import geopandas as gpd
+import numpy as np
+import shapely
+from shapely.geometry import LineString, Polygon
+from shapely.ops import polygonize, unary_union
+
+CRS = {'init': 'epsg:4326'}
+
+
+def object_array(values):
+    """
+    Object array from a list without numpy unpacking its items
+
+    Parameters
+    ----------
+    values :
+      list of values
+
+    Returns
+    numpy.ndarray
+    """
+    column = np.empty(len(values), dtype=object)
+    column[:] = values
+    return column
+
+
+def unique_rows(ids):
+    """
+    Rows to keep when elements repeat (e.g. over several sub-polygons):
+    the last occurrence of each id, in order of first occurrence
+
+    Parameters
+    ----------
+    ids :
+      element ids
+
+    Returns
+    numpy.ndarray of row positions
+    """
+    ids = np.asarray(ids)
+    n_rows = len(ids)
+    if n_rows == 0:
+        return np.arange(0)
+    _, first = np.unique(ids, return_index=True)
+    _, last_reversed = np.unique(ids[::-1], return_index=True)
+    last = n_rows - 1 - last_reversed
+    return last[np.argsort(first, kind='mergesort')]
+
+
+class ElementColumns(object):
+    """
+    Ids and tags of interest of OSM elements, stored column by column
+
+    Parameters
+    ----------
+    columns_of_interest :
+      output columns, `osm_id` and `geometry` are always present
+    """
+
+    def __init__(self, columns_of_interest):
+        self.tag_columns = [column for column in columns_of_interest
+                            if column not in ('osm_id', 'geometry')]
+        self.ids = array('q')
+        self.tags = {column: [] for column in self.tag_columns}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def append(self, element_id, tags):
+        """
+        Add an element
+
+        Parameters
+        ----------
+        element_id :
+          OSM id
+        tags :
+          dict of OSM tags, only tags of interest are kept
+
+        Returns
+        ------
+
+        """
+        self.ids.append(element_id)
+        for column, values in self.tags.items():
+            values.append(tags.get(column))
+
+    def ids_array(self):
+        """
+        Element ids
+
+        Returns
+        numpy.ndarray of int64
+        """
+        return np.frombuffer(self.ids, dtype=np.int64)
+
+    def frame(self, rows, geometry):
+        """
+        Build the GeoDataFrame of some rows
+
+        Parameters
+        ----------
+        rows :
+          row positions to keep
+        geometry :
+          geometries of the kept rows
+
+        Returns
+        geopandas.GeoDataFrame
+        """
+        data = {column: object_array(values)[rows]
+                for column, values in self.tags.items()}
+        data['osm_id'] = self.ids_array()[rows]
+        return gpd.GeoDataFrame(
+            data,
+            columns=self.tag_columns + ['osm_id'],
+            geometry=gpd.GeoSeries(geometry),
+            crs=CRS)
+
+    def to_geodataframe(self, geometry, rows=None):
+        """
+        Build the GeoDataFrame
+
+        Parameters
+        ----------
+        geometry :
+          geometries of all appended elements
+        rows :
+          row positions to keep, defaults to `unique_rows`
+
+        Returns
+        geopandas.GeoDataFrame
+        """
+        if rows is None:
+            rows = unique_rows(self.ids_array())
+        return self.frame(rows, object_array(list(geometry))[rows])
+
+
+class PointColumns(ElementColumns):
+    """
+    OSM nodes as ids, lon/lat arrays and tags of interest
+
+    Parameters
+    ----------
+    columns_of_interest :
+      output columns, `osm_id` and `geometry` are always present
+    """
+
+    def __init__(self, columns_of_interest):
+        super(PointColumns, self).__init__(columns_of_interest)
+        self.lon = array('d')
+        self.lat = array('d')
+
+    def append(self, element_id, lon, lat, tags):
+        """
+        Add a node
+
+        Parameters
+        ----------
+        element_id :
+          OSM id
+        lon :
+          longitude
+        lat :
+          latitude
+        tags :
+          dict of OSM tags, only tags of interest are kept
+
+        Returns
+        ------
+
+        """
+        super(PointColumns, self).append(element_id, tags)
+        self.lon.append(lon)
+        self.lat.append(lat)
+
+    def to_geodataframe(self, rows=None):
+        """
+        Build the GeoDataFrame, points are created from the coordinate arrays
+
+        Parameters
+        ----------
+        rows :
+          row positions to keep, defaults to `unique_rows`
+
+        Returns
+        geopandas.GeoDataFrame
+        """
+        if rows is None:
+            rows = unique_rows(self.ids_array())
+        points = gpd.points_from_xy(
+            np.frombuffer(self.lon, dtype=np.float64)[rows],
+            np.frombuffer(self.lat, dtype=np.float64)[rows])
+        return self.frame(rows, points)
+
+
+class NodeIndex(object):
+    """
+    OSM node coordinates as sorted id/lon/lat arrays, node references are
+    resolved with a vectorised binary search
+    """
+
+    def __init__(self):
+        self._ids = array('q')
+        self._lon = array('d')
+        self._lat = array('d')
+        self.ids = None
+        self.lon = None
+        self.lat = None
+
+    def __len__(self):
+        return len(self._ids)
+
+    def append(self, node_id, lon, lat):
+        """
+        Add a node
+
+        Parameters
+        ----------
+        node_id :
+          OSM id
+        lon :
+          longitude
+        lat :
+          latitude
+
+        Returns
+        ------
+
+        """
+        self._ids.append(node_id)
+        self._lon.append(lon)
+        self._lat.append(lat)
+        self.ids = None
+
+    def freeze(self):
+        """
+        Sort the nodes by id, a repeated node keeps its last coordinates
+
+        Returns
+        ------
+
+        """
+        ids = np.frombuffer(self._ids, dtype=np.int64)
+        order = np.argsort(ids, kind='mergesort')
+        sorted_ids = ids[order]
+        last = np.ones(len(sorted_ids), dtype=bool)
+        last[:-1] = sorted_ids[1:] != sorted_ids[:-1]
+        order = order[last]
+        self.ids = ids[order]
+        self.lon = np.frombuffer(self._lon, dtype=np.float64)[order]
+        self.lat = np.frombuffer(self._lat, dtype=np.float64)[order]
+
+    def locate(self, refs):
+        """
+        Coordinates of node references
+
+        Parameters
+        ----------
+        refs :
+          array of node ids
+
+        Returns
+        (n, 2) array of lon/lat, and boolean array of found references
+        """
+        if self.ids is None:
+            self.freeze()
+        refs = np.asarray(refs, dtype=np.int64)
+        coords = np.full((len(refs), 2), np.nan)
+        if not len(self.ids):
+            return coords, np.zeros(len(refs), dtype=bool)
+        positions = np.searchsorted(self.ids, refs)
+        positions[positions == len(self.ids)] = 0
+        found = self.ids[positions] == refs
+        coords[found, 0] = self.lon[positions[found]]
+        coords[found, 1] = self.lat[positions[found]]
+        return coords, found
+
+
+class WayRefs(object):
+    """
+    Node references of OSM ways, flattened with an offsets array
+    """
+
+    def __init__(self):
+        self.ids = array('q')
+        self.refs = array('q')
+        self.offsets = array('q', [0])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def append(self, way_id, refs):
+        """
+        Add a way
+
+        Parameters
+        ----------
+        way_id :
+          OSM id
+        refs :
+          list of node ids
+
+        Returns
+        Position of the way
+        """
+        self.ids.append(way_id)
+        self.refs.extend(refs)
+        self.offsets.append(len(self.refs))
+        return len(self.ids) - 1
+
+    def positions(self, way_ids):
+        """
+        Position of ways given their ids, the last occurrence of a repeated way
+
+        Parameters
+        ----------
+        way_ids :
+          array of way ids
+
+        Returns
+        Array of positions, -1 for unknown ways
+        """
+        ids = np.frombuffer(self.ids, dtype=np.int64)
+        way_ids = np.asarray(way_ids, dtype=np.int64)
+        result = np.full(len(way_ids), -1, dtype=np.int64)
+        if not len(ids):
+            return result
+        order = np.argsort(ids, kind='mergesort')
+        sorted_ids = ids[order]
+        # last occurrence of each id
+        found_at = np.searchsorted(sorted_ids, way_ids, side='right') - 1
+        found = (found_at >= 0) & (sorted_ids[np.maximum(found_at, 0)] == way_ids)
+        result[found] = order[found_at[found]]
+        return result
+
+    def coordinates(self, nodes):
+        """
+        Resolve every node reference at once
+
+        Parameters
+        ----------
+        nodes :
+          NodeIndex
+
+        Returns
+        (n, 2) array of lon/lat, boolean array of found references,
+        offsets array of each way
+        """
+        coords, found = nodes.locate(np.frombuffer(self.refs, dtype=np.int64))
+        return coords, found, np.frombuffer(self.offsets, dtype=np.int64)
+
+
+def ring_polygons(coords, found, offsets):
+    """
+    Polygons of rings given as runs of coordinates
+
+    Parameters
+    ----------
+    coords :
+      (n, 2) array of lon/lat
+    found :
+      boolean array, False for unresolved coordinates
+    offsets :
+      start of each ring in `coords`, followed by the end of the last one
+
+    Returns
+    Object array of Polygons, None where the ring is not valid
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    n_rings = len(offsets) - 1
+    counts = np.diff(offsets)
+    ring_index = np.repeat(np.arange(n_rings), counts)
+    missing = np.bincount(ring_index, weights=~found, minlength=n_rings) > 0
+
+    # a ring needs 3 distinct coordinates, closed here if not closed already
+    closed = np.zeros(n_rings, dtype=bool)
+    nonempty = counts > 0
+    starts, ends = offsets[:-1][nonempty], offsets[1:][nonempty] - 1
+    closed[nonempty] = np.all(coords[starts] == coords[ends], axis=1)
+    valid = ~missing & np.where(closed, counts >= 4, counts >= 3)
+
+    polygons = np.empty(n_rings, dtype=object)
+    if not valid.any():
+        return polygons
+
+    if hasattr(shapely, 'polygons'):
+        # vectorised construction (shapely >= 2)
+        keep = np.repeat(valid, counts)
+        rings = shapely.linearrings(
+            coords[keep],
+            indices=np.repeat(np.arange(valid.sum()), counts[valid]))
+        polygons[valid] = shapely.polygons(rings)
+    else:
+        for i in np.flatnonzero(valid):
+            polygons[i] = Polygon(coords[offsets[i]:offsets[i + 1]])
+    return polygons
+
+
+def multipolygon(outer_lines, inner_lines):
+    """
+    Geometry of a multipolygon relation
+
+    Parameters
+    ----------
+    outer_lines :
+      LineStrings of the outer member ways
+    inner_lines :
+      LineStrings of the inner member ways
+
+    Returns
+    Polygon or MultiPolygon, None if the outer ways do not close
+    """
+    outer = list(polygonize(outer_lines))
+    if not outer:
+        return None
+    geometry = unary_union(outer)
+    inner = list(polygonize(inner_lines))
+    if inner:
+        geometry = geometry.difference(unary_union(inner))
+    if geometry.is_empty:
+        return None
+    return geometry
+
+
+def buildings_from_elements(elements, columns_of_interest):
+    """
+    Assemble building footprints from Overpass elements: closed ways, and
+    multipolygon relations made of outer and inner member ways
+
+    Parameters
+    ----------
+    elements :
+      iterable of Overpass elements
+    columns_of_interest :
+      output columns, `osm_id` and `geometry` are always present
+
+    Returns
+    geopandas.GeoDataFrame, with the `osm_type` ('way' or 'relation') of
+    every `osm_id`
+    """
+    nodes = NodeIndex()
+    ways = WayRefs()
+    building_columns = ElementColumns(columns_of_interest)
+    building_ways = array('q')
+    relations = []
+
+    for result in elements:
+        element_type = result.get('type')
+        if element_type == 'node':
+            nodes.append(result['id'], result['lon'], result['lat'])
+        elif element_type == 'way':
+            position = ways.append(result['id'], result['nodes'])
+            tags = result.get('tags', {})
+            # ways without building tag are relation members
+            if 'building' in tags:
+                building_columns.append(result['id'], tags)
+                building_ways.append(position)
+        elif element_type == 'relation':
+            tags = result.get('tags', {})
+            if tags.get('type') == 'multipolygon' and 'building' in tags:
+                relations.append(result)
+
+    coords, found, offsets = ways.coordinates(nodes)
+    way_polygons = ring_polygons(coords, found, offsets)
+
+    n_ways = len(building_ways)
+    geometries = np.empty(n_ways + len(relations), dtype=object)
+    geometries[:n_ways] = way_polygons[
+        np.frombuffer(building_ways, dtype=np.int64)]
+
+    for i, relation in enumerate(relations):
+        members = [member for member in relation.get('members', [])
+                   if member.get('type') == 'way']
+        positions = ways.positions([member['ref'] for member in members])
+        lines = {'outer': [], 'inner': []}
+        for member, position in zip(members, positions):
+            role = member.get('role') or 'outer'
+            if position < 0 or role not in lines:
+                continue
+            start, end = offsets[position], offsets[position + 1]
+            if end - start >= 2 and found[start:end].all():
+                lines[role].append(LineString(coords[start:end]))
+        geometries[n_ways + i] = multipolygon(lines['outer'], lines['inner'])
+        building_columns.append(relation['id'], relation['tags'])
+
+    # ways and relations are deduplicated separately, their ids may collide
+    ids = building_columns.ids_array()
+    rows = np.concatenate([unique_rows(ids[:n_ways]),
+                           n_ways + unique_rows(ids[n_ways:])])
+    rows = rows[np.array([geometries[row] is not None for row in rows],
+                         dtype=bool)]
+    df_building = building_columns.frame(rows, geometries[rows])
+    # way and relation ids share one column, told apart by the type
+    df_building.insert(list(df_building.columns).index('osm_id') + 1,
+                       'osm_type', object_array(np.where(
+                           rows < n_ways, 'way', 'relation').tolist()))
+    return df_building
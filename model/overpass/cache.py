@@ -0,0 +1,433 @@
+# Persistent cache for Overpass API responses
+"""
+Content addressed response cache:
+	key: digest of the API url and the normalised query
+	value: gzip compressed JSON response, one file per key
+	expiry: time to live on write time, LRU eviction under a byte budget,
+	the cache directory is scanned only when its tracked size goes over
+	budget or every EVICT_INTERVAL seconds
+"""
+import gzip
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+
+# under POI_CACHE_DIR or the `cache` folder of the repository
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get('POI_CACHE_DIR') or os.path.join(os.path.dirname(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+        'cache'),
+    'overpass')
+DEFAULT_TTL = 7 * 24 * 3600  # seconds
+DEFAULT_MAX_BYTES = 1024 ** 3  # 1 GB
+# seconds between two full scans for expired entries
+EVICT_INTERVAL = 3600
+CACHE_SUFFIX = '.json.gz'
+
+
+class GzipSpool(object):
+    """
+    Compressed temporary file written in chunks
+
+    Parameters
+    ----------
+    spool_dir :
+      directory of the temporary file, None for the system default
+    """
+
+    def __init__(self, spool_dir=None):
+        if spool_dir is not None and not(os.path.isdir(spool_dir)):
+            os.makedirs(spool_dir, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(dir=spool_dir, suffix='.tmp')
+        self.target = None
+        self._raw = os.fdopen(fd, 'wb')
+        self._file = gzip.GzipFile(fileobj=self._raw, mode='wb')
+
+    def write(self, chunk):
+        self._file.write(chunk)
+
+    def close(self):
+        """
+        Flush and close the temporary file
+
+        Returns
+        Filename of the temporary file
+        """
+        if not self._raw.closed:
+            self._file.close()
+            self._raw.close()
+        return self.path
+
+    def discard(self):
+        """
+        Close and remove the temporary file
+
+        Returns
+        ------
+
+        """
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def normalise_query(query):
+    """
+    Normalise an Overpass query so equivalent queries share a cache entry
+
+    Parameters
+    ----------
+    query : string
+      Overpass query
+
+    Returns
+    Normalised query
+    """
+    # server timeout does not change the result
+    query = re.sub(r'\[timeout:\d+\]', '', query)
+    # insignificant whitespace
+    query = re.sub(r'\s+', ' ', query).strip()
+    return query
+
+
+class ResponseCache(object):
+    """
+    On-disk Overpass response cache, safe to share between threads and
+    processes: entries are written to a temporary file and renamed
+
+    Parameters
+    ----------
+    cache_dir :
+      directory of the cache files
+    ttl :
+      seconds an entry stays valid, None for no expiry
+    max_bytes :
+      disk budget, least recently used entries are evicted above it
+    evict_interval :
+      seconds between two full scans for expired entries
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, ttl=DEFAULT_TTL,
+                 max_bytes=DEFAULT_MAX_BYTES, evict_interval=EVICT_INTERVAL):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.evict_interval = evict_interval
+        self._lock = threading.Lock()
+        # disk usage tracked between scans, None until the first scan
+        self._size = None
+        self._scanned = time.time()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.evictions = 0
+
+    def key(self, url, query):
+        """
+        Cache key of a query
+
+        Parameters
+        ----------
+        url :
+          Overpass API url
+        query :
+          Overpass query
+
+        Returns
+        Hexadecimal digest
+        """
+        content = url + '\n' + normalise_query(query)
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        """
+        Cache file of a key
+
+        Parameters
+        ----------
+        key :
+          cache key
+
+        Returns
+        Filename
+        """
+        return os.path.join(self.cache_dir, key[:2], key + CACHE_SUFFIX)
+
+    def _count(self, **counters):
+        with self._lock:
+            for name, value in counters.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def _expired(self, stat, now):
+        return self.ttl is not None and now - stat.st_mtime > self.ttl
+
+    def lookup(self, url, query):
+        """
+        Cache file of a query if it holds a valid entry
+
+        Parameters
+        ----------
+        url :
+          Overpass API url
+        query :
+          Overpass query
+
+        Returns
+        Filename, None on a miss
+        """
+        path = self.path(self.key(url, query))
+        now = time.time()
+        try:
+            stat = os.stat(path)
+            if self._expired(stat, now):
+                os.remove(path)
+                raise OSError('expired')
+            # access time drives the LRU eviction, keep write time for TTL
+            os.utime(path, (now, stat.st_mtime))
+        except OSError:
+            self._count(misses=1)
+            return None
+
+        self._count(hits=1, bytes_read=stat.st_size)
+        return path
+
+    def open_entry(self, url, query):
+        """
+        Open the cache file of a query if it holds a valid entry, the open
+        file stays readable if the entry is evicted meanwhile
+
+        Parameters
+        ----------
+        url :
+          Overpass API url
+        query :
+          Overpass query
+
+        Returns
+        Binary file object of the compressed body, None on a miss
+        """
+        path = self.lookup(url, query)
+        if path is None:
+            return None
+        try:
+            return open(path, 'rb')
+        except OSError:
+            # entry evicted by another commit since the lookup
+            self._count(hits=-1, misses=1)
+            return None
+
+    def get(self, url, query):
+        """
+        Cached response of a query
+
+        Parameters
+        ----------
+        url :
+          Overpass API url
+        query :
+          Overpass query
+
+        Returns
+        Response JSON, None on a miss
+        """
+        path = self.lookup(url, query)
+        if path is None:
+            return None
+        try:
+            with gzip.open(path, 'rb') as f:
+                return json.loads(f.read().decode('utf-8'))
+        except (OSError, EOFError, ValueError):
+            # entry removed or corrupted by another process
+            self._count(hits=-1, misses=1)
+            return None
+
+    def put(self, url, query, response_json):
+        """
+        Store the response of a query
+
+        Parameters
+        ----------
+        url :
+          Overpass API url
+        query :
+          Overpass query
+        response_json :
+          Response JSON
+
+        Returns
+        Filename of the entry
+        """
+        content = json.dumps(response_json).encode('utf-8')
+        return self.put_bytes(url, query, content)
+
+    def put_bytes(self, url, query, content):
+        """
+        Store the raw JSON body of a query response
+
+        Parameters
+        ----------
+        url :
+          Overpass API url
+        query :
+          Overpass query
+        content :
+          JSON body as bytes
+
+        Returns
+        Filename of the entry
+        """
+        spool = self.spool(url, query)
+        try:
+            spool.write(content)
+        except BaseException:
+            spool.discard()
+            raise
+        return self.commit(spool)
+
+    def spool(self, url, query):
+        """
+        Open a compressed temporary file for a response body streamed in
+        chunks, see `commit`
+
+        Parameters
+        ----------
+        url :
+          Overpass API url
+        query :
+          Overpass query
+
+        Returns
+        GzipSpool
+        """
+        path = self.path(self.key(url, query))
+        spool = GzipSpool(os.path.dirname(path))
+        spool.target = path
+        return spool
+
+    def commit(self, spool):
+        """
+        Atomically move a spooled response body to its cache entry
+
+        Parameters
+        ----------
+        spool :
+          GzipSpool returned by `spool`
+
+        Returns
+        Filename of the entry
+        """
+        path = spool.target
+        spool.close()
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+        os.replace(spool.path, path)
+        size = os.path.getsize(path)
+        self._count(bytes_written=size)
+
+        # the cache is scanned only when over budget or on an interval
+        with self._lock:
+            if self._size is not None:
+                self._size += size - replaced
+            scan = self._size is None or (
+                self.max_bytes is not None and self._size > self.max_bytes) \
+                or time.time() - self._scanned > self.evict_interval
+        if scan:
+            self.evict()
+        return path
+
+    def entries(self):
+        """
+        Cache entries
+
+        Returns
+        List of (filename, os.stat_result)
+        """
+        entries = []
+        if not(os.path.isdir(self.cache_dir)):
+            return entries
+        for entry_dir, _, filenames in os.walk(self.cache_dir):
+            for filename in filenames:
+                if not filename.endswith(CACHE_SUFFIX):
+                    continue
+                path = os.path.join(entry_dir, filename)
+                try:
+                    entries.append((path, os.stat(path)))
+                except OSError:
+                    pass
+        return entries
+
+    def size(self):
+        """
+        Disk usage of the cache
+
+        Returns
+        Bytes
+        """
+        return sum(stat.st_size for _, stat in self.entries())
+
+    def evict(self):
+        """
+        Remove expired entries, then least recently used entries until the
+        cache fits in its byte budget
+
+        Returns
+        Number of removed entries
+        """
+        now = time.time()
+        entries = sorted(self.entries(), key=lambda entry: entry[1].st_atime)
+        total = sum(stat.st_size for _, stat in entries)
+        removed = 0
+        for path, stat in entries:
+            if not self._expired(stat, now) and (
+                    self.max_bytes is None or total <= self.max_bytes):
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                # already removed by another process
+                pass
+            total -= stat.st_size
+            removed += 1
+
+        self._count(evictions=removed)
+        with self._lock:
+            self._size = total
+            self._scanned = now
+        return removed
+
+    def clear(self):
+        """
+        Remove every cache entry
+
+        Returns
+        ------
+
+        """
+        for path, _ in self.entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        with self._lock:
+            self._size = None
+
+    def stats(self):
+        """
+        Cache counters
+
+        Returns
+        Dict of hits, misses, bytes read and written, evictions
+        """
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'bytes_read': self.bytes_read,
+                    'bytes_written': self.bytes_written,
+                    'evictions': self.evictions}
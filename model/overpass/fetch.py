@@ -0,0 +1,297 @@
+# Concurrent Overpass API client
+"""
+Bounded concurrent fetching of Overpass sub-queries:
+	connection pooled session shared by all requests
+	at most `max_in_flight` requests at a time, token bucket rate limiting
+	exponential backoff on 429 (too many requests) and 5xx gateway errors
+	responses returned in query order so merging them is deterministic
+"""
+import gzip
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from model.overpass import cache as overpass_cache
+from model.overpass import stream
+
+RETRY_STATUS = (429, 502, 503, 504)
+# bytes kept from the end of a body to look for an Overpass remark
+TAIL_SIZE = 4096
+
+
+class TokenBucket(object):
+    """
+    Token bucket rate limiter, safe to share between threads
+
+    Parameters
+    ----------
+    rate :
+      tokens added per second, None for no limit
+    capacity :
+      maximum number of tokens, i.e. allowed burst
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take one token, waiting until one is available
+
+        Returns
+        Seconds waited
+        """
+        if self.rate is None:
+            return 0.
+        waited = 0.
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+class OverpassFetcher(object):
+    """
+    Overpass API client
+
+    Parameters
+    ----------
+    url :
+      Overpass API url
+    cache :
+      model.overpass.cache.ResponseCache, None to disable caching
+    max_in_flight :
+      maximum number of concurrent requests
+    rate :
+      maximum requests per second, None for no limit
+    burst :
+      requests allowed at once above the rate
+    max_retries :
+      retries of a request on 429/5xx or connection errors
+    backoff :
+      first retry delay in seconds, doubled on each retry
+    max_backoff :
+      maximum retry delay in seconds
+    timeout :
+      request timeout in seconds
+    """
+
+    def __init__(self, url, cache=None, max_in_flight=2, rate=1., burst=2,
+                 max_retries=5, backoff=1., max_backoff=60., timeout=180):
+        self.url = url
+        self.cache = cache
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.bucket = TokenBucket(rate, burst)
+        # shared by every caller, e.g. POI and building downloads running
+        # as concurrent stages
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_in_flight)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _retry_delay(self, attempt, response=None):
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        if response is not None:
+            try:
+                delay = max(delay, float(response.headers['Retry-After']))
+            except (KeyError, ValueError):
+                pass
+        return delay
+
+    def post(self, query, stream=False):
+        """
+        Request a query, retrying with exponential backoff
+
+        Parameters
+        ----------
+        query :
+          Overpass query
+        stream :
+          leave the response body unread
+
+        Returns
+        requests.Response
+        """
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            try:
+                response = self.session.post(
+                    self.url, data={'data': query}, timeout=self.timeout,
+                    stream=stream)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.max_retries:
+                    raise
+                time.sleep(self._retry_delay(attempt))
+                attempt += 1
+                continue
+
+            if response.status_code in RETRY_STATUS and \
+                    attempt < self.max_retries:
+                delay = self._retry_delay(attempt, response)
+                response.close()
+                print('Overpass status {}, retrying in {:.1f} s'.format(
+                    response.status_code, delay))
+                time.sleep(delay)
+                attempt += 1
+                continue
+
+            response.raise_for_status()
+            return response
+
+    def fetch(self, query):
+        """
+        Get Overpass Data, from the response cache when available
+
+        Parameters
+        ----------
+        query :
+          Overpass query
+
+        Returns
+        Query Data
+        """
+        if self.cache is not None:
+            response_json = self.cache.get(self.url, query)
+            if response_json is not None:
+                return response_json
+
+        with self._slots:
+            response = self.post(query)
+            response_json = response.json()
+
+        # a remark reports a server side error or timeout, never cache it
+        if self.cache is not None and 'remark' not in response_json:
+            self.cache.put_bytes(self.url, query, response.content)
+        return response_json
+
+    def fetch_file(self, query):
+        """
+        Get Overpass Data as a gzip compressed JSON file, the response body is
+        streamed to disk without being parsed
+
+        Parameters
+        ----------
+        query :
+          Overpass query
+
+        Returns
+        Binary file object opened on the compressed body, and the filename of
+        the temporary file to remove after use, None for a cache entry
+        """
+        if self.cache is not None:
+            # opened at once, a concurrent eviction can not remove it before
+            # it is read
+            f = self.cache.open_entry(self.url, query)
+            if f is not None:
+                return f, None
+            spool = self.cache.spool(self.url, query)
+        else:
+            spool = overpass_cache.GzipSpool()
+
+        tail = b''
+        try:
+            with self._slots:
+                response = self.post(query, stream=True)
+                try:
+                    for chunk in response.iter_content(stream.CHUNK_SIZE):
+                        spool.write(chunk)
+                        tail = (tail + chunk)[-TAIL_SIZE:]
+                finally:
+                    response.close()
+        except BaseException:
+            spool.discard()
+            raise
+
+        f = open(spool.close(), 'rb')
+        # a remark reports a server side error or timeout, never cache it
+        if self.cache is not None and b'"remark"' not in tail:
+            self.cache.commit(spool)
+            return f, None
+        return f, spool.path
+
+    def iter_elements(self, queries):
+        """
+        Stream the elements of several queries: bodies are downloaded
+        concurrently to compressed files, then parsed one element at a time
+
+        Parameters
+        ----------
+        queries :
+          list of Overpass queries
+
+        Returns
+        Iterator of element dicts, in query order
+        """
+        files = self.map(self.fetch_file, queries)
+        try:
+            for f, _ in files:
+                with gzip.GzipFile(fileobj=f, mode='rb') as body:
+                    element_stream = stream.ElementStream(
+                        stream.iter_file_chunks(body))
+                    for element in element_stream:
+                        yield element
+                if element_stream.remark is not None:
+                    print('Overpass remark: {}'.format(element_stream.remark))
+        finally:
+            for f, temporary in files:
+                f.close()
+                if temporary is not None and os.path.exists(temporary):
+                    os.remove(temporary)
+
+    def map(self, function, queries):
+        """
+        Apply a function to every query with at most `max_in_flight`
+        concurrent calls
+
+        Parameters
+        ----------
+        function :
+          callable taking a query
+        queries :
+          list of Overpass queries
+
+        Returns
+        List of results, in query order
+        """
+        queries = list(queries)
+        if len(queries) <= 1 or self.max_in_flight <= 1:
+            return [function(query) for query in queries]
+        workers = min(self.max_in_flight, len(queries))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(function, queries))
+
+    def fetch_all(self, queries):
+        """
+        Get Overpass Data of several queries concurrently
+
+        Parameters
+        ----------
+        queries :
+          list of Overpass queries
+
+        Returns
+        List of Query Data, in query order
+        """
+        return self.map(self.fetch, queries)
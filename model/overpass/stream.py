@@ -0,0 +1,131 @@
+# Streaming parser for Overpass JSON responses
+"""
+Incremental reading of the `elements` array of an Overpass JSON body:
+	elements are decoded one at a time from byte chunks, so memory grows
+	with the current element and not with the whole response
+"""
+import codecs
+import json
+import re
+
+CHUNK_SIZE = 1 << 16  # bytes
+
+_ELEMENTS_START = re.compile(r'"elements"\s*:\s*\[')
+_REMARK = re.compile(r'"remark"\s*:\s*("(?:[^"\\]|\\.)*")')
+_SEPARATORS = ' \t\n\r,'
+
+
+def iter_file_chunks(file, chunk_size=CHUNK_SIZE):
+    """
+    Read a binary file in chunks
+
+    Parameters
+    ----------
+    file :
+      binary file object
+    chunk_size :
+      bytes per chunk
+
+    Returns
+    Iterator of bytes
+    """
+    return iter(lambda: file.read(chunk_size), b'')
+
+
+class ElementStream(object):
+    """
+    Iterator over the elements of an Overpass JSON body
+
+    Parameters
+    ----------
+    chunks :
+      iterable of bytes of the JSON body
+
+    Attributes
+    ----------
+    remark :
+      Overpass remark (server side error or timeout), available once the
+      stream is exhausted
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+        self.remark = None
+
+    def _read(self):
+        # append the next chunk to the buffer, False at the end of the body
+        if self._eof:
+            return False
+        try:
+            chunk = next(self._chunks)
+            text = self._decoder.decode(chunk)
+        except StopIteration:
+            text = self._decoder.decode(b'', final=True)
+            self._eof = True
+        self._buffer = self._buffer[self._pos:] + text
+        self._pos = 0
+        return True
+
+    def _read_remark(self):
+        while self._read():
+            pass
+        match = _REMARK.search(self._buffer, self._pos)
+        if match is not None:
+            self.remark = json.loads(match.group(1))
+
+    def __iter__(self):
+        decoder = json.JSONDecoder()
+
+        # skip the header up to the elements array
+        while True:
+            match = _ELEMENTS_START.search(self._buffer, self._pos)
+            if match is not None:
+                self._pos = match.end()
+                break
+            if not self._read():
+                # no elements, e.g. an error response
+                self._read_remark()
+                return
+
+        while True:
+            buffer, pos = self._buffer, self._pos
+            while pos < len(buffer) and buffer[pos] in _SEPARATORS:
+                pos += 1
+            self._pos = pos
+            if pos == len(buffer):
+                if not self._read():
+                    raise ValueError('Truncated Overpass response')
+                continue
+            if buffer[pos] == ']':
+                self._pos = pos + 1
+                break
+            try:
+                element, end = decoder.raw_decode(buffer, pos)
+            except ValueError:
+                # element split between chunks
+                if not self._read():
+                    raise
+                continue
+            self._pos = end
+            yield element
+
+        self._read_remark()
+
+
+def iter_elements(chunks):
+    """
+    Iterate over the elements of an Overpass JSON body
+
+    Parameters
+    ----------
+    chunks :
+      iterable of bytes of the JSON body
+
+    Returns
+    Iterator of element dicts
+    """
+    return iter(ElementStream(chunks))
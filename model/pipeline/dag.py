@@ -0,0 +1,311 @@
+# Incremental pipeline of stages
+"""
+Stages form a DAG: each stage declares its input stages, output files and
+parameters. A stage hash covers its name, version, parameters and the
+content digests of its inputs' outputs; a stage whose hash and outputs did
+not change since its last run is skipped. Values are passed in memory
+between stages, a skipped stage loads its value from its outputs only if a
+stage downstream needs it.
+"""
+import collections
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+from model.pipeline import stages as stage_runner
+
+STATE_VERSION = 1
+
+
+class Stage(object):
+    """
+    Pipeline stage
+
+    Parameters
+    ----------
+    name :
+      stage name, also the keyword its value is passed with downstream
+    function :
+      callable taking the values of the input stages as keywords
+    inputs :
+      names of the input stages
+    outputs :
+      files written by the stage
+    load :
+      callable without arguments loading the value from the outputs, None if
+      the value is not needed downstream
+    params :
+      JSON serialisable parameters, part of the stage hash
+    version :
+      bumped when the stage code changes its outputs
+    """
+
+    def __init__(self, name, function, inputs=(), outputs=(), load=None,
+                 params=None, version=1):
+        self.name = name
+        self.function = function
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.load = load
+        self.params = params or {}
+        self.version = version
+
+
+def file_digest(filename, chunk_size=1 << 20):
+    """
+    Content digest of a file
+
+    Parameters
+    ----------
+    filename :
+      file to hash
+
+    Returns
+    Hexadecimal digest
+    """
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class _Value(object):
+    # value of a stage, loaded from its outputs on first use if skipped
+
+    def __init__(self, load=None, value=None, loaded=False):
+        self._load = load
+        self._value = value
+        self._loaded = loaded
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if not self._loaded:
+                if self._load is None:
+                    raise ValueError('Stage value can not be loaded')
+                self._value = self._load()
+                self._loaded = True
+            return self._value
+
+
+class Pipeline(object):
+    """
+    DAG of stages with artifact freshness checks
+
+    Parameters
+    ----------
+    stages :
+      list of Stage
+    state_file :
+      JSON file recording the hash and output digests of each stage run
+    """
+
+    def __init__(self, stages, state_file):
+        self.stages = _index_stages(stages)
+        self.state_file = state_file
+        self._state = None
+        self._lock = threading.Lock()
+
+    def _load_state(self):
+        try:
+            with open(self.state_file) as f:
+                state = json.load(f)
+            if state.get('version') == STATE_VERSION:
+                return state
+        except (OSError, ValueError):
+            pass
+        return {'version': STATE_VERSION, 'stages': {}, 'files': {}}
+
+    def _save_state(self):
+        state_dir = os.path.dirname(os.path.abspath(self.state_file))
+        fd, tmp_file = tempfile.mkstemp(dir=state_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self._state, f, indent=1, sort_keys=True)
+        os.replace(tmp_file, self.state_file)
+
+    def _file_digest(self, filename):
+        # digests are cached by size and modification time
+        stat = os.stat(filename)
+        with self._lock:
+            cached = self._state['files'].get(filename)
+        if cached is not None and cached['size'] == stat.st_size and \
+                cached['mtime'] == stat.st_mtime:
+            return cached['digest']
+        digest = file_digest(filename)
+        with self._lock:
+            self._state['files'][filename] = {'size': stat.st_size,
+                                              'mtime': stat.st_mtime,
+                                              'digest': digest}
+        return digest
+
+    def _outputs_digest(self, stage):
+        # None if an output is missing
+        digest = hashlib.sha1()
+        for filename in stage.outputs:
+            if not os.path.isfile(filename):
+                return None
+            digest.update(filename.encode('utf-8'))
+            digest.update(self._file_digest(filename).encode('utf-8'))
+        return digest.hexdigest()
+
+    def _stage_hash(self, stage):
+        inputs = {name: self._state['stages'][name]['digest']
+                  for name in stage.inputs}
+        content = json.dumps({'name': stage.name,
+                              'version': stage.version,
+                              'params': stage.params,
+                              'inputs': inputs}, sort_keys=True)
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+    def _record(self, stage, stage_hash):
+        digest = self._outputs_digest(stage) if stage.outputs else stage_hash
+        with self._lock:
+            self._state['stages'][stage.name] = {'hash': stage_hash,
+                                                 'digest': digest}
+
+    def _is_fresh(self, stage, stage_hash):
+        recorded = self._state['stages'].get(stage.name)
+        if recorded is None or recorded['hash'] != stage_hash:
+            return False
+        if not stage.outputs:
+            return True
+        return self._outputs_digest(stage) == recorded['digest']
+
+    def required(self, targets=None, stop=()):
+        """
+        Stages needed for some targets, in topological order
+
+        Parameters
+        ----------
+        targets :
+          stage names, None for every stage
+        stop :
+          stage names whose inputs are not needed
+
+        Returns
+        List of stage names
+        """
+        if targets is None:
+            targets = list(self.stages)
+        order, visiting, visited = [], set(), set()
+
+        def visit(name):
+            if name in visited:
+                return
+            if name in visiting:
+                raise ValueError('Cycle at stage {}'.format(name))
+            if name not in self.stages:
+                raise KeyError('Unknown stage {}'.format(name))
+            visiting.add(name)
+            if name not in stop:
+                for input_name in self.stages[name].inputs:
+                    visit(input_name)
+            visiting.discard(name)
+            visited.add(name)
+            order.append(name)
+
+        for name in targets:
+            visit(name)
+        return order
+
+    def run(self, targets=None, force=(), trusted=(), fail_fast=True):
+        """
+        Run the stages needed for some targets, skipping up-to-date stages
+
+        Parameters
+        ----------
+        targets :
+          stage names, None for every stage
+        force :
+          stage names to run even if up to date
+        trusted :
+          stage names whose existing outputs are taken as up to date even
+          without a recorded run (e.g. files downloaded by an older version)
+        fail_fast :
+          if True raise StageError on the first failure, else skip the
+          stages downstream of a failure and report it in the results
+
+        Returns
+        Ordered dict of stage name -> StageResult, value None for skipped
+        stages
+        """
+        self._state = self._load_state()
+        # trusted stages with outputs on disk cut the DAG upstream of them
+        trusted = set(name for name in trusted if name not in force and
+                      self.stages[name].outputs and
+                      self._outputs_digest(self.stages[name]) is not None)
+        order = self.required(targets, stop=trusted)
+        values, results, failed = {}, {}, set()
+        done = set()
+
+        while len(done) < len(order):
+            # stages whose inputs are all done run together
+            wave = [name for name in order if name not in done and (
+                name in trusted or all(input_name in done for input_name
+                                       in self.stages[name].inputs))]
+            to_run = {}
+            for name in wave:
+                stage = self.stages[name]
+                done.add(name)
+                if name not in trusted and any(
+                        input_name in failed for input_name in stage.inputs):
+                    failed.add(name)
+                    results[name] = stage_runner.StageResult(
+                        name, None, RuntimeError('Input stage failed'), 0.)
+                    continue
+                if name in trusted:
+                    # its upstream stages are cut, it is never run: outputs
+                    # changed since recorded are taken as they are
+                    recorded = self._state['stages'].get(name)
+                    if recorded is None or \
+                            recorded['digest'] != self._outputs_digest(stage):
+                        self._record(stage, 'trusted')
+                    print('Stage {} trusted'.format(name))
+                    values[name] = _Value(load=stage.load)
+                    results[name] = stage_runner.StageResult(
+                        name, None, None, 0.)
+                    continue
+                stage_hash = self._stage_hash(stage)
+                if name not in force and self._is_fresh(stage, stage_hash):
+                    print('Stage {} up to date'.format(name))
+                    values[name] = _Value(load=stage.load)
+                    results[name] = stage_runner.StageResult(
+                        name, None, None, 0.)
+                    continue
+                to_run[name] = self._stage_call(stage, values, stage_hash)
+
+            try:
+                wave_results = stage_runner.run_stages(
+                    to_run, fail_fast=fail_fast)
+            finally:
+                self._save_state()
+            for name, result in wave_results.items():
+                results[name] = result
+                if result.error is not None:
+                    failed.add(name)
+                else:
+                    values[name] = _Value(value=result.value, loaded=True)
+
+        self._save_state()
+        return collections.OrderedDict(
+            (name, results[name]) for name in order if name in results)
+
+    def _stage_call(self, stage, values, stage_hash):
+        def call():
+            kwargs = {name: values[name].get() for name in stage.inputs}
+            value = stage.function(**kwargs)
+            self._record(stage, stage_hash)
+            return value
+        return call
+
+
+def _index_stages(stages):
+    indexed = collections.OrderedDict()
+    for stage in stages:
+        if stage.name in indexed:
+            raise ValueError('Duplicate stage {}'.format(stage.name))
+        indexed[stage.name] = stage
+    return indexed
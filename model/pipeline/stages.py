@@ -0,0 +1,91 @@
+# Concurrent execution of independent pipeline stages
+"""
+Stages are callables without arguments run in a thread pool, each stage
+stores its own artifacts as soon as it is done
+"""
+import collections
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+StageResult = collections.namedtuple(
+    'StageResult', ['name', 'value', 'error', 'seconds'])
+
+
+class StageError(Exception):
+    """
+    A stage failed
+
+    Parameters
+    ----------
+    name :
+      stage name
+    error :
+      exception raised by the stage
+    results :
+      results of the stages run so far
+    """
+
+    def __init__(self, name, error, results):
+        super(StageError, self).__init__(
+            'Stage {} failed: {!r}'.format(name, error))
+        self.name = name
+        self.error = error
+        self.results = results
+
+
+def _timed(name, function):
+    start_time = time.time()
+    try:
+        value = function()
+    except Exception as error:
+        return StageResult(name, None, error, time.time() - start_time)
+    return StageResult(name, value, None, time.time() - start_time)
+
+
+def run_stages(stages, max_workers=None, fail_fast=True):
+    """
+    Run independent stages concurrently
+
+    Parameters
+    ----------
+    stages :
+      ordered dict of stage name -> callable without arguments
+    max_workers :
+      maximum number of concurrent stages, defaults to one per stage
+    fail_fast :
+      if True raise StageError on the first failure and cancel the stages
+      not started yet, else keep running and report errors in the results
+
+    Returns
+    Ordered dict of stage name -> StageResult, in `stages` order
+    """
+    if not stages:
+        return collections.OrderedDict()
+
+    results, pending = {}, {}
+    executor = ThreadPoolExecutor(max_workers=max_workers or len(stages))
+    try:
+        pending = {executor.submit(_timed, name, function): name
+                   for name, function in stages.items()}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                del pending[future]
+                result = future.result()
+                results[result.name] = result
+                if result.error is None:
+                    print('Stage {} done in {:.1f} s'.format(
+                        result.name, result.seconds))
+                    continue
+                print('Stage {} failed after {:.1f} s: {!r}'.format(
+                    result.name, result.seconds, result.error))
+                if fail_fast:
+                    for other in pending:
+                        other.cancel()
+                    raise StageError(result.name, result.error, results)
+    finally:
+        # running stages can not be interrupted, do not wait for them on error
+        executor.shutdown(wait=not pending)
+
+    return collections.OrderedDict(
+        (name, results[name]) for name in stages)
@@ -3,22 +3,76 @@
 import osmnx as ox
 import geopandas as gpd
 import time
-from shapely.geometry import Point, Polygon
+from shapely import wkt
 import os
-import requests
 import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
 import pandas as pd
-from sklearn.cluster import DBSCAN
-from scipy.sparse import csr_matrix
 import itertools
-from scipy import spatial
+import threading
+from model.buildings import accessibility
+from model.buildings import join as building_join
+from model.buildings import population
 from model.classification import classification
+from model.cluster import dbscan
+from model.cluster import density
+from model.cluster import hulls
+from model.cluster import incremental as incremental_dbscan
+from model.cluster import stats
+from model.cluster import sweep
+from model.network import snap
+from model.network import store as network_store
+from model.overpass import assemble
+from model.overpass import cache
+from model.overpass import fetch
+from model.pipeline import dag
+from model.storage import storage
+from model.tags.taxonomy import taxonomy
+
+OVERPASS_URL = 'http://overpass-api.de/api/interpreter'
+# Overpass client shared by POI and building requests: response cache,
+# concurrent sub-queries, rate limiting and retries
+overpass_fetcher = fetch.OverpassFetcher(
+    OVERPASS_URL, cache=cache.ResponseCache(cache.DEFAULT_CACHE_DIR))
+
+# Tags kept for POIs and buildings, all other tags are dropped on download
+POI_COLUMNS = [
+    "amenity",
+    "landuse",
+    "leisure",
+    "shop",
+    "man_made",
+    "building",
+    "building:use",
+    "building:part",
+    "osm_id",
+    "geometry"]
+BUILDING_COLUMNS = POI_COLUMNS + ["height_tags", "building:levels", "height"]
+
+# Pipeline stages run by `download_data` and `analyse_data`
+DOWNLOAD_STAGES = ['poi', 'buildings', 'street']
+ANALYSIS_STAGES = ['poi_image', 'classification_image', 'street_image',
+                   'population_index', 'cluster_hulls', 'accessibility']
+# Pipeline stages run only when asked for
+OPTIONAL_STAGES = ['cluster_sweep', 'street_snap', 'commercial_density']
+# DBSCAN settings of the `cluster_sweep` stage
+SWEEP_EPS = [100, 200, 300, 400, 500]
+SWEEP_MINPTS = [3, 5, 10, 20]
+# Cluster hull polygons: buffer and simplification tolerance in meters
+HULL_BUFFER = 25.
+HULL_TOLERANCE = 10.
+# Commercial density raster: cell size and kernel bandwidth in meters
+DENSITY_CELL = 25.
+DENSITY_BANDWIDTH = 150.
+DENSITY_KERNEL = 'gaussian'
+# pyplot is not thread safe
+plot_lock = threading.Lock()
 
 
 def call_overpass(data):
     """
-    Get Overpass Data
+    Get Overpass Data, from the response cache when available
 
     Parameters
     ----------
@@ -30,9 +84,7 @@ def call_overpass(data):
     """
 
     # requesting OverPass API
-    url = 'http://overpass-api.de/api/interpreter'
-    response = requests.post(url, data=data, timeout=180, headers=None)
-    response_json = response.json()
+    response_json = overpass_fetcher.fetch(data['data'])
     return response_json
 
 
@@ -72,73 +124,24 @@ def get_buildings(place, polygon):
     start_time = time.time()
 
     # pass each polygon coordinates in the list to Overpass API
-    response_jsons = []
-    for polygon_coord_str in polygon_coord_strs:
-        query_template = ('[out:json][timeout:{timeout}]{maxsize};(way'
-                          '(poly:"{polygon}")["building"];(._;>;);relation'
-                          '(poly:"{polygon}")["building"];(._;>;););out;')
-        query_str = query_template.format(
-            polygon=polygon_coord_str,
-            timeout=timeout,
-            maxsize=maxsize)
-        # call overpass API with query
-        response_json = call_overpass(data={'data': query_str})
-        response_jsons.append(response_json)
-
-    # collectiong Buildings
-    vertices = {}
-    for response in response_jsons:
-        for result in response['elements']:
-            if 'type' in result and result['type'] == 'node':
-                vertices[result['id']] = {'lat': result['lat'],
-                                          'lon': result['lon']}
-
-    buildings = {}
-    for response in response_jsons:
-        for result in response['elements']:
-            if 'type' in result and result['type'] == 'way':
-                nodes = result['nodes']
-                try:
-                    polygon = Polygon(
-                        [(vertices[node]['lon'], vertices[node]['lat']) for node in nodes])
-                except Exception:
-                    print('Polygon has invalid geometry: {}'.format(nodes))
-                building = {'nodes': nodes,
-                            'geometry': polygon}
-
-                if 'tags' in result:
-                    for tag in result['tags']:
-                        building[tag] = result['tags'][tag]
-
-                buildings[result['id']] = building
-
-    # converting it into geo pandas
-    df_building = gpd.GeoDataFrame(buildings).T
-    df_building.crs = {'init': 'epsg:4326'}
+    query_template = ('[out:json][timeout:{timeout}]{maxsize};(way'
+                      '(poly:"{polygon}")["building"];(._;>;);relation'
+                      '(poly:"{polygon}")["building"];(._;>;););out;')
+    query_strs = [query_template.format(polygon=polygon_coord_str,
+                                        timeout=timeout,
+                                        maxsize=maxsize)
+                  for polygon_coord_str in polygon_coord_strs]
+    # call overpass API with all queries, elements are streamed in query
+    # order into node/way arrays, polygons of ways and multipolygon relations
+    # are built once every node is known
+    df_building = assemble.buildings_from_elements(
+        overpass_fetcher.iter_elements(query_strs), BUILDING_COLUMNS)
 
     # drop all invalid geometries
     df_building = df_building[df_building['geometry'].is_valid]
-
-    df_building["osm_id"] = df_building.index
     df_building.reset_index(drop=True, inplace=True)
     df_building.gdf_name = str(
         place['state']) + '_buildings' if not place['state'] is None else 'buildings'
-    columns_of_interest = [
-        "amenity",
-        "landuse",
-        "leisure",
-        "shop",
-        "man_made",
-        "building",
-        "building:use",
-        "building:part",
-        "osm_id",
-        "geometry",
-        "height_tags"]
-
-    # drop all unused columns
-    df_building.drop([col for col in list(df_building.columns)
-                      if col not in columns_of_interest], axis=1, inplace=True)
     return df_building
 
 
@@ -179,72 +182,35 @@ def get_poi_data(place, polygon):
     start_time = time.time()
 
     # pass each polygon coordinates in the list to Overpass API
-    response_jsons = []
-    for polygon_coord_str in polygon_coord_strs:
-        query_template = ('[out:json][timeout:{timeout}]{maxsize};('
-                          '(node["office"](poly:"{polygon}"););'
-                          '(node["shop"](poly:"{polygon}"););'
-                          '(node["amenity"](poly:"{polygon}"););'
-                          '(node["leisure"](poly:"{polygon}"););'
-                          '(node["building"](poly:"{polygon}"););'
-                          '(node["sport"](poly:"{polygon}");););out;')
-        query_str = query_template.format(
-            polygon=polygon_coord_str,
-            timeout=timeout,
-            maxsize=maxsize)
-        # call overpass API with query
-        response_json = call_overpass(data={'data': query_str})
-        response_jsons.append(response_json)
-
-    # collectiong POI
-    vertices = {}
-    for response in response_jsons:
-        for result in response['elements']:
-            if 'type' in result and result['type'] == 'node':
-
-                point = Point(result['lon'], result['lat'])
-
-                POI = {'geometry': point}
-
-                if 'tags' in result:
-                    for tag in result['tags']:
-                        POI[tag] = result['tags'][tag]
-
-                vertices[result['id']] = POI
-
-    # converting it into geo pandas
-    df_poi = gpd.GeoDataFrame(vertices).T
-    df_poi.crs = {'init': 'epsg:4326'}
-
-    try:
-        # drop all invalid geometries
-        df_poi = df_poi[df_poi['geometry'].is_valid]
-    except BaseException:
+    query_template = ('[out:json][timeout:{timeout}]{maxsize};('
+                      '(node["office"](poly:"{polygon}"););'
+                      '(node["shop"](poly:"{polygon}"););'
+                      '(node["amenity"](poly:"{polygon}"););'
+                      '(node["leisure"](poly:"{polygon}"););'
+                      '(node["building"](poly:"{polygon}"););'
+                      '(node["sport"](poly:"{polygon}");););out;')
+    query_strs = [query_template.format(polygon=polygon_coord_str,
+                                        timeout=timeout,
+                                        maxsize=maxsize)
+                  for polygon_coord_str in polygon_coord_strs]
+    # call overpass API with all queries, elements are streamed in query
+    # order and only the tags of interest are collected as they arrive
+    poi_columns = assemble.PointColumns(POI_COLUMNS)
+    for result in overpass_fetcher.iter_elements(query_strs):
+        if 'type' in result and result['type'] == 'node':
+            poi_columns.append(result['id'], result['lon'], result['lat'],
+                               result.get('tags', {}))
+
+    if not len(poi_columns):
         # Empty data frame
         # Create one-row data frame with null information
         point = polygon.centroid
-        data = {"geometry": [point], "osm_id": [0]}
-        df_poi = gpd.GeoDataFrame(data, crs={'init': 'epsg:4326'})
+        poi_columns.append(0, point.x, point.y, {})
 
-    df_poi["osm_id"] = df_poi.index
-    df_poi.reset_index(drop=True, inplace=True)
+    # converting it into geo pandas, points are built from coordinate arrays
+    df_poi = poi_columns.to_geodataframe()
     df_poi.gdf_name = str(
         place['state']) + '_points' if not place['state'] is None else 'points'
-    columns_of_interest = [
-        "amenity",
-        "landuse",
-        "leisure",
-        "shop",
-        "man_made",
-        "building",
-        "building:use",
-        "building:part",
-        "osm_id",
-        "geometry"]
-
-    # drop all unused columns
-    df_poi.drop([col for col in list(df_poi.columns)
-                 if col not in columns_of_interest], axis=1, inplace=True)
     return df_poi
 
 
@@ -278,7 +244,8 @@ def store_geodataframe(df_osm_data, geo_filename):
     df_osm_data : geopandas.GeoDataFrame
       input OSM data frame
     geo_filename : string
-      filename for GeoDataFrame storage
+      filename for GeoDataFrame storage, `.parquet` or `.feather` for
+      working files, `.geojson` for export
 
     Returns
     ------
@@ -286,11 +253,11 @@ def store_geodataframe(df_osm_data, geo_filename):
     """
     # To EPSG 4326 - Project GeoDataFrame to the UTM zone
     df_osm_data = ox.project_gdf(df_osm_data, to_latlong=True)
-    # Save to file
-    df_osm_data.to_file(geo_filename, driver='GeoJSON')
+    # Save to file, missing values are normalised once here
+    storage.write_geodataframe(df_osm_data, geo_filename)
 
 
-def load_geodataframe(geo_filename):
+def load_geodataframe(geo_filename, columns=None):
     """
     Load input GeoDataFrame
 
@@ -298,214 +265,888 @@ def load_geodataframe(geo_filename):
     ----------
     geo_filename : string
       filename for GeoDataFrame storage
+    columns : list
+      columns to load, None for all
 
     Returns
     df_osm_data : geopandas.GeoDataFrame
       output OSM data frame
     """
 
-    # Load using geopandas
-    df_osm_data = gpd.read_file(geo_filename)
+    # Load only the requested columns, memory mapped for columnar files
+    df_osm_data = storage.read_geodataframe(geo_filename, columns=columns)
+    return df_osm_data
 
-    # Replace None as NaN
-    df_osm_data.fillna(value=np.nan, inplace=True)
 
-    # Replace empty string for NaN
-    df_osm_data.replace('', np.nan, inplace=True)
+def poi_cluster(poi_data, path_to_output, eps=300, minpts=5,
+                engine='haversine', incremental=False, street_data=None):
+    """
+    Spatial clustering of commercial POIs
 
-    # To UTM coordinates
-    return df_osm_data
+    Parameters
+    ----------
+    poi_data : pandas.DataFrame
+      classified POIs, output of `poi_classification`
+    path_to_output :
+      output folder
+    eps :
+      DBSCAN neighbourhood radius in meters
+    minpts :
+      smallest cluster size allowed
+    engine :
+      'haversine' for great circle distances with a ball tree, 'grid' for
+      distances in the local UTM zone with an eps-sized grid, 'tiled' for
+      the grid engine over tiles clustered in parallel processes, 'network'
+      for street network distances between POIs snapped to their nearest
+      node
+    incremental :
+      update the clusters of the previous run from the POIs inserted and
+      deleted since, by `osm_id`, with stable cluster ids (distances in the
+      local UTM zone, `engine` unused); cluster changes are written to
+      poi_commercial_cluster_changes.csv
+    street_data : network.store.StreetNetwork
+      street network of the 'network' engine, loaded from path_to_output
+      if None
 
+    Returns
+    Commercial POIs with their `spatial_cluster`
+    """
+    file_path = path_to_output + '/poi_commercial_clustered_DBSCAN.csv'
+    state_file = path_to_output + '/poi_commercial_cluster_state.npz'
+    changes_file = path_to_output + '/poi_commercial_cluster_changes.csv'
 
-def poi_cluster(df_poi, path_to_output):
-    poi_data = pd.DataFrame(
-        {'x': df_poi.geometry.x, 'y': df_poi.geometry.y, 'amenity': df_poi.amenity})
-    file_input_path = path_to_output + '/poi_category.csv'
+    # predicting and assigning each cmmercial point to cluster
+    # eps in meters, minpts smallest cluster size allowed
+    poi_data = poi_data[poi_data.category == 'commercial'].copy()
+    if not incremental:
+        if engine == 'network' and street_data is None:
+            street_data = network_store.load_network(
+                path_to_output + '/network')
+        poi_data['spatial_cluster'] = dbscan.dbscan(
+            poi_data.x.values, poi_data.y.values, eps, minpts, engine=engine,
+            network=street_data)
+    else:
+        clustering = incremental_dbscan.IncrementalDBSCAN.load(
+            state_file, eps, minpts)
+        if clustering is None:
+            clustering = incremental_dbscan.IncrementalDBSCAN(eps, minpts)
+            labels = clustering.fit(poi_data.osm_id.values,
+                                    poi_data.x.values, poi_data.y.values)
+            changes = pd.DataFrame(columns=incremental_dbscan.REPORT_COLUMNS)
+        else:
+            labels, changes = clustering.update(
+                poi_data.osm_id.values, poi_data.x.values, poi_data.y.values)
+        poi_data['spatial_cluster'] = labels
+        clustering.save(state_file)
+        changes.to_csv(changes_file, encoding='utf-8', index=False)
+
+    # save clustered POI data set
+    poi_data.to_csv(file_path, encoding='utf-8', index=False)
+    return poi_data
 
-    file_path = path_to_output + '/poi_commercial_clustered_DBSCAN.csv'
-    file_path_2 = path_to_output + '/poi_commercial_population_index.csv'
 
-    poi_data = pd.read_csv(file_input_path, encoding='utf-8')
+def poi_cluster_sweep(poi_data, path_to_output, eps_values=SWEEP_EPS,
+                      minpts_values=SWEEP_MINPTS, engine='haversine',
+                      street_data=None):
+    """
+    Cluster counts and noise ratios of commercial POIs for several DBSCAN
+    settings, from a single neighbour search at the largest eps
 
-    # parameterize DBSCAN
-    eps = 300  # meters
-    minpts = 5  # smallest cluster size allowed
-    eps_rad = eps / 3671000.  # meters to radians
-    db = DBSCAN(
-        eps=eps_rad,
-        min_samples=minpts,
-        metric='haversine',
-        algorithm='ball_tree')
+    Parameters
+    ----------
+    poi_data : pandas.DataFrame
+      classified POIs, output of `poi_classification`
+    path_to_output :
+      output folder
+    eps_values :
+      DBSCAN neighbourhood radii in meters
+    minpts_values :
+      smallest cluster sizes allowed
+    engine :
+      'haversine', 'grid', 'tiled' or 'network', as for `poi_cluster`
+    street_data : network.store.StreetNetwork
+      street network of the 'network' engine, loaded from path_to_output
+      if None
+
+    Returns
+    Summary table, one row per (eps, minpts) setting
+    """
+    file_path = path_to_output + '/poi_commercial_cluster_sweep.csv'
 
-    # predicting and assigning each cmmercial point to cluster
     poi_data = poi_data[poi_data.category == 'commercial']
-    poi_data['spatial_cluster'] = db.fit_predict(
-        np.deg2rad(poi_data[['y', 'x']]))
+    if engine == 'network' and street_data is None:
+        street_data = network_store.load_network(path_to_output + '/network')
+    graph = sweep.neighbour_graph(poi_data.x.values, poi_data.y.values,
+                                  max(eps_values), engine=engine,
+                                  network=street_data)
+    summary = graph.sweep(eps_values, minpts_values)
+    summary.to_csv(file_path, encoding='utf-8', index=False)
+    return summary
+
+
+def poi_commercial_density(poi_data, path_to_output, cell=DENSITY_CELL,
+                           bandwidth=DENSITY_BANDWIDTH,
+                           kernel=DENSITY_KERNEL):
+    """
+    Kernel density raster of commercial POIs and its peaks, stored as
+    poi_commercial_density.npy with its transform in
+    poi_commercial_density.json
 
-    # save clustered POI data set
-    poi_data.to_csv(file_path, encoding='utf-8', index=False)
+    Parameters
+    ----------
+    poi_data : pandas.DataFrame
+      classified POIs, output of `poi_classification`
+    path_to_output :
+      output folder
+    cell :
+      cell size in meters
+    bandwidth :
+      Gaussian standard deviation or Epanechnikov radius, in meters
+    kernel :
+      'gaussian' or 'epanechnikov'
+
+    Returns
+    Density peaks, densest first
+    """
+    raster_file = path_to_output + '/poi_commercial_density.npy'
+    peaks_file = path_to_output + '/poi_commercial_density_peaks.csv'
+
+    poi_data = poi_data[poi_data.category == 'commercial']
+    surface, transform = density.density_raster(
+        poi_data.x.values, poi_data.y.values, cell=cell, bandwidth=bandwidth,
+        kernel=kernel)
+    density.save_raster(surface, transform, raster_file)
+    peaks = density.density_peaks(surface, transform)
+    peaks.to_csv(peaks_file, encoding='utf-8', index=False)
+    return peaks
+
+
+def poi_cluster_statistics(poi_data, path_to_output):
+    """
+    Statistics of the commercial clusters: count, centroid, bounding box,
+    radius of gyration, convex hull area and density
+
+    Parameters
+    ----------
+    poi_data : pandas.DataFrame
+      clustered commercial POIs, output of `poi_cluster`
+    path_to_output :
+      output folder
+
+    Returns
+    Cluster table, one row per cluster, noise excluded
+    """
+    file_path = path_to_output + '/poi_commercial_clusters.csv'
+
+    cluster_table, n_noise = stats.cluster_statistics(
+        poi_data.x.values, poi_data.y.values, poi_data.spatial_cluster.values)
+    print('{} commercial clusters, {} noise POIs'.format(
+        len(cluster_table), n_noise))
+    cluster_table.to_csv(file_path, encoding='utf-8', index=False)
+    return cluster_table
+
+
+def poi_cluster_hulls(poi_data, cluster_table, path_to_output,
+                      buffer=HULL_BUFFER, tolerance=HULL_TOLERANCE):
+    """
+    Hull polygon of every commercial cluster, stored as GeoParquet and
+    exported as GeoJSON
+
+    Parameters
+    ----------
+    poi_data : pandas.DataFrame
+      clustered commercial POIs, output of `poi_cluster`
+    cluster_table : pandas.DataFrame
+      cluster statistics, output of `poi_cluster_statistics`
+    path_to_output :
+      output folder
+    buffer :
+      buffer around the hulls in meters
+    tolerance :
+      simplification tolerance in meters
+
+    Returns
+    geopandas.GeoDataFrame, one polygon per cluster
+    """
+    cluster_hulls = hulls.cluster_hulls(
+        poi_data.x.values, poi_data.y.values, poi_data.spatial_cluster.values,
+        buffer=buffer, tolerance=tolerance)
+    cluster_hulls['density'] = cluster_hulls.spatial_cluster.map(
+        cluster_table.set_index('spatial_cluster').density)
+
+    for extension in ('.parquet', '.geojson'):
+        storage.write_geodataframe(
+            cluster_hulls,
+            path_to_output + '/poi_commercial_clusters' + extension)
+    return cluster_hulls
+
+
+def poi_cluster_population(cluster_hulls, df_building, path_to_output,
+                           catchment=population.CATCHMENT):
+    """
+    Residential floor area and population estimate in the catchment of
+    every commercial cluster
+
+    Parameters
+    ----------
+    cluster_hulls : geopandas.GeoDataFrame
+      cluster hull polygons, output of `poi_cluster_hulls`
+    df_building : geopandas.GeoDataFrame
+      building footprints
+    path_to_output :
+      output folder
+    catchment :
+      buffer around the hulls in meters
+
+    Returns
+    Population table, one row per cluster
+    """
+    file_path = path_to_output + '/poi_commercial_cluster_population.csv'
+
+    cluster_population = population.catchment_population(
+        cluster_hulls, df_building, catchment=catchment)
+    cluster_population.to_csv(file_path, encoding='utf-8', index=False)
+    return cluster_population
+
+
+def poi_building_accessibility(poi_data, df_building, path_to_output,
+                               radii=accessibility.RADII):
+    """
+    Commercial POIs within several radii of every residential building and
+    its nearest commercial cluster, and the population each cluster is the
+    nearest for
+
+    Parameters
+    ----------
+    poi_data : pandas.DataFrame
+      clustered commercial POIs, output of `poi_cluster`
+    df_building : geopandas.GeoDataFrame
+      building footprints
+    path_to_output :
+      output folder
+    radii :
+      radii in meters
+
+    Returns
+    Accessibility table, one row per residential building, and served
+    population table, one row per cluster
+    """
+    file_path = path_to_output + '/poi_building_accessibility.csv'
+    served_file = path_to_output + '/poi_commercial_cluster_served.csv'
+
+    df_building = df_building[population.residential_buildings(df_building)]
+    centroids = accessibility.centroids(df_building.geometry.values)
+    building_accessibility = accessibility.accessibility(
+        centroids[:, 0], centroids[:, 1], poi_data.x.values,
+        poi_data.y.values, poi_data.spatial_cluster.values, radii=radii)
+    building_accessibility.insert(0, 'osm_id', df_building.osm_id.values)
+    building_accessibility.insert(1, 'x', centroids[:, 0])
+    building_accessibility.insert(2, 'y', centroids[:, 1])
+    building_accessibility['population_estimate'] = population.floor_area(
+        df_building) / population.FLOOR_AREA_PER_PERSON
+    building_accessibility.to_csv(file_path, encoding='utf-8', index=False)
+
+    # commercial centres ranked by the population they are nearest for
+    served = building_accessibility[
+        building_accessibility.nearest_cluster.values >= 0].groupby(
+        'nearest_cluster').agg({'osm_id': 'size',
+                                'population_estimate': 'sum',
+                                'cluster_distance': 'mean'})
+    served.columns = ['buildings', 'population_served', 'mean_distance']
+    served = served.rename_axis('spatial_cluster').reset_index()
+    served = served.sort_values('population_served', ascending=False)
+    served.to_csv(served_file, encoding='utf-8', index=False)
+    return building_accessibility, served
+
+
+def poi_population_index(poi_data, cluster_table, path_to_output,
+                         cluster_population=None):
+    """
+    Population index of clustered commercial POIs
+
+    Parameters
+    ----------
+    poi_data : pandas.DataFrame
+      clustered commercial POIs, output of `poi_cluster`
+    cluster_table : pandas.DataFrame
+      cluster statistics, output of `poi_cluster_statistics`
+    path_to_output :
+      output folder
+    cluster_population : pandas.DataFrame
+      population estimates, output of `poi_cluster_population`, None to
+      leave them out
+
+    Returns
+    Commercial POIs with their `population_index` and the
+    `population_estimate` of their cluster catchment
+    """
+    file_path_2 = path_to_output + '/poi_commercial_population_index.csv'
 
     # Calculating Population Index
     # more population index more population as compare to other commercial
-    # center with low population index
-    poi_data['count'] = 1
-    cluster_count = poi_data.groupby(
-        ['spatial_cluster'])['count'].sum().reset_index().sort_values(
-        by=['count'], ascending=False)
-    poi_data = poi_data.drop(['count'], 1)
-    commercial_cluster_population_index = pd.merge(
-        poi_data,
-        cluster_count,
-        on='spatial_cluster',
-        how='inner').sort_values(
-        by=['count'],
-        ascending=False)
-    commercial_cluster_population_index = commercial_cluster_population_index.drop([
-                                                                                   'spatial_cluster'], 1)
-    commercial_cluster_population_index.rename(
-        columns={
-            'count': 'population_index'},
-        inplace=True)
+    # center with low population index, 0 for noise POIs
+    labels = poi_data.spatial_cluster.values
+    cluster_count = np.zeros(max(labels.max() + 1, 1) if len(labels) else 1,
+                             dtype=np.int64)
+    cluster_count[cluster_table.spatial_cluster.values] = \
+        cluster_table['count'].values
+    population_index = np.where(labels >= 0, cluster_count[labels], 0)
+
+    # sorted once, rows taken once
+    order = np.argsort(-population_index, kind='mergesort')
+    commercial_cluster_population_index = poi_data.iloc[order]
+    commercial_cluster_population_index.insert(
+        len(poi_data.columns), 'population_index', population_index[order])
+    if cluster_population is not None:
+        estimate = np.zeros(len(cluster_count))
+        estimate[cluster_population.spatial_cluster.values] = \
+            cluster_population.population_estimate.values
+        commercial_cluster_population_index.insert(
+            len(poi_data.columns) + 1, 'population_estimate',
+            np.where(labels >= 0, estimate[labels], 0.)[order])
     commercial_cluster_population_index.to_csv(
         file_path_2, encoding='utf-8', index=False)
+    return commercial_cluster_population_index
 
 
-def poi_street(df_poi, path_to_output):
-    street_file = path_to_output + '/network.graphml'
+def poi_street_snap(poi_data, path_to_output, street_data=None):
+    """
+    Nearest street network edge of every commercial POI, the edge index is
+    cached next to the stored network
+
+    Parameters
+    ----------
+    poi_data : pandas.DataFrame
+      classified POIs, output of `poi_classification`
+    path_to_output :
+      output folder
+    street_data : network.store.StreetNetwork
+      street network, loaded from path_to_output if None
+
+    Returns
+    Commercial POIs with their edge position, `u`, `v` and `key`, the
+    `offset` along the edge and the `distance` to it in meters
+    """
+    file_path = path_to_output + '/poi_commercial_street_snap.csv'
+
+    if street_data is None:
+        street_data = network_store.load_network(
+            path_to_output + '/network')
+    poi_data = poi_data[poi_data.category == 'commercial']
+    snapped = snap.snap_points(street_data, poi_data.x.values,
+                               poi_data.y.values)
+    snapped.index = poi_data.index
+    poi_snap = pd.concat([poi_data[['osm_id', 'x', 'y']], snapped], axis=1)
+    poi_snap.to_csv(file_path, encoding='utf-8', index=False)
+    return poi_snap
+
+
+def poi_street(df_poi, path_to_output, street_data=None):
+    """
+    Plot of all downloaded POIs over the street network
+
+    Parameters
+    ----------
+    df_poi : geopandas.GeoDataFrame
+      POI data
+    path_to_output :
+      output folder
+    street_data : network.store.StreetNetwork
+      street network, loaded from path_to_output if None
+
+    Returns
+    ------
+
+    """
+    network_dir = path_to_output + '/network'
     image_path = path_to_output + '/street_with_poi.png'
 
-    street_data = ox.load_graphml(street_file)
-    poi_data = pd.DataFrame(
-        {'x': df_poi.geometry.x, 'y': df_poi.geometry.y, 'amenity': df_poi.amenity})
-
-    # plot the poi data and street
-    fig, ax = ox.plot_graph(street_data, node_color='#ff3300',
-                            edge_color='#aaaaaa', node_size=0, show=False, close=True, dpi=600)
-    ax.scatter(
-        x=poi_data['x'],
-        y=poi_data['y'],
-        c='blue',
-        marker='.',
-        s=40,
-        zorder=3,
-        label='POI')
-    ax.legend(title="LEGEND")
-    ax.set(title='POI with Street')
-    ax.set(xlabel='Longitude')
-    ax.set(ylabel='Latitude')
-    ax.grid(True)
-    fig.savefig(image_path, dpi=600)
+    if street_data is None:
+        street_data = network_store.load_network(network_dir)
+    # edges drawn straight from the stored arrays, no graph rebuilt
+    segments = street_data.segments()
+
+    # pyplot is not thread safe, render stages may run concurrently
+    with plot_lock:
+        # plot the poi data and street
+        fig, ax = plt.subplots(figsize=(6, 6))
+        ax.add_collection(LineCollection(segments, colors='#aaaaaa',
+                                         linewidths=1, zorder=2))
+        ax.autoscale_view()
+        ax.set_aspect('equal')
+        ax.scatter(
+            x=df_poi.geometry.x,
+            y=df_poi.geometry.y,
+            c='blue',
+            marker='.',
+            s=40,
+            zorder=3,
+            label='POI')
+        ax.legend(title="LEGEND")
+        ax.set(title='POI with Street')
+        ax.set(xlabel='Longitude')
+        ax.set(ylabel='Latitude')
+        ax.grid(True)
+        fig.savefig(image_path, dpi=600)
+        plt.close(fig)
 
 
 def poi_image(df_poi, path_to_output):
     image_path = path_to_output + '/poi_data.png'
-    fig, ax = plt.subplots(figsize=(10, 10))
-    df_poi.plot(ax=ax, label='POI', color="blue")
-    ax.legend(title="LEGEND")
-    ax.set(title='POI Data')
-    ax.set(xlabel='Longitude')
-    ax.set(ylabel='Latitude')
-    # ax.set_axis_off()
-    fig.savefig(image_path, dpi=600)
+    with plot_lock:
+        fig, ax = plt.subplots(figsize=(10, 10))
+        df_poi.plot(ax=ax, label='POI', color="blue")
+        ax.legend(title="LEGEND")
+        ax.set(title='POI Data')
+        ax.set(xlabel='Longitude')
+        ax.set(ylabel='Latitude')
+        # ax.set_axis_off()
+        fig.savefig(image_path, dpi=600)
+
+
+def poi_building_enrichment(df_poi, df_building, path_to_output):
+    """
+    POIs without a land use of their own (classified `infer` or not
+    classified) inherit the tags of the building footprint containing them
+
+    Parameters
+    ----------
+    df_poi : geopandas.GeoDataFrame
+      POI data, left unchanged
+    df_building : geopandas.GeoDataFrame
+      building footprints
+    path_to_output :
+      output folder
+
+    Returns
+    POI data with the inherited tags and the `building_id` and
+    `building_osm_type` of the footprint they inherited from, -1 and None
+    for none
+    """
+    file_path = path_to_output + '/poi_enriched.parquet'
+
+    df_classified = classification.classify_tags_frame(df_poi)
+    unresolved = (df_classified.classification.isnull() |
+                  (df_classified.classification == 'infer')).values
+    df_enriched, building = building_join.inherit_building_tags(
+        df_poi, df_building, unresolved, taxonomy.keys)
+    inside = building >= 0
+    df_enriched['building_id'] = np.where(
+        inside, df_building.osm_id.values[np.maximum(building, 0)],
+        -1).astype(np.int64) if len(df_building) else \
+        np.full(len(df_enriched), -1, dtype=np.int64)
+    # way and relation ids may collide, buildings stored before the type
+    # was recorded have none
+    building_type = np.full(len(df_enriched), None, dtype=object)
+    if 'osm_type' in df_building.columns:
+        building_type[inside] = df_building.osm_type.values[building[inside]]
+    df_enriched['building_osm_type'] = building_type
+    print('POIs enriched with building tags: {} of {} unresolved'.format(
+        int((building >= 0).sum()), int(unresolved.sum())))
+
+    storage.write_geodataframe(df_enriched, file_path)
+    return df_enriched
 
 
 def poi_classification(df_poi, path_to_output):
-    image_path = path_to_output + '/type_of_poi.png'
+    """
+    Classification of POIs into commercial and non commercial
+
+    Parameters
+    ----------
+    df_poi : geopandas.GeoDataFrame
+      POI data, left unchanged
+    path_to_output :
+      output folder
+
+    Returns
+    Classified POIs with their coordinates
+    """
     file_path = path_to_output + '/poi_category.csv'
 
-    df_poi['classification'], df_poi['key_value'] = list(
-        zip(*df_poi.apply(classification.classify_tag, axis=1)))
+    # classify all POIs at once, same output as `classify_tag` row by row
+    df_classified = classification.classify_tags_frame(df_poi)
     # Remove unnecessary POIs
-    df_poi.drop(df_poi[df_poi.classification.isin(
-        ["infer", "other"]) | df_poi.classification.isnull()].index, inplace=True)
-    df_poi.reset_index(inplace=True, drop=True)
+    keep = ~(df_classified.classification.isin(["infer", "other"])
+             | df_classified.classification.isnull())
+    df_poi = df_poi[keep.values].reset_index(drop=True)
+    df_classified = df_classified[keep.values].reset_index(drop=True)
 
     # Assigning commercial or non commercial tag depending on POIs
-    df_poi['category'] = df_poi.apply(
-        lambda x: classification.classify_activity_category(
-            x.key_value), axis=1)
-    poi_data = pd.DataFrame({'x': df_poi.geometry.x,
+    category = classification.classify_activity_category_frame(
+        df_classified.key_value)
+    poi_data = pd.DataFrame({'osm_id': df_poi.osm_id,
+                             'x': df_poi.geometry.x,
                              'y': df_poi.geometry.y,
                              'amenity': df_poi.amenity,
-                             'classification': df_poi.classification,
-                             'key_value': df_poi.key_value,
-                             'category': df_poi.category.str[0]})
+                             'classification': df_classified.classification,
+                             'key_value': df_classified.key_value,
+                             'category': category.str[0]},
+                            columns=['osm_id', 'x', 'y', 'amenity',
+                                     'classification', 'key_value',
+                                     'category'])
     poi_data.to_csv(file_path, encoding='utf-8', index=False)
+    return poi_data
+
+
+def poi_classification_image(poi_data, path_to_output):
+    image_path = path_to_output + '/type_of_poi.png'
 
     # for visualisation of categories
-    df_pois_commercial = df_poi[df_poi.category.str[0].isin(["commercial"])]
-    df_pois_non_commercial = df_poi[df_poi.category.str[0].isin(
+    df_poi = gpd.GeoDataFrame(
+        poi_data, geometry=gpd.points_from_xy(poi_data.x, poi_data.y))
+    df_pois_commercial = df_poi[df_poi.category.isin(["commercial"])]
+    df_pois_non_commercial = df_poi[df_poi.category.isin(
         ["non_commercial"])]
-    fig, ax = plt.subplots(figsize=(10, 10))
-    df_pois_commercial.plot(ax=ax, label='commercial', color="blue")
-    df_pois_non_commercial.plot(ax=ax, label='non_commercial', color="red")
-    ax.legend(title="LEGEND")
-    ax.set(title='POI Classification')
-    ax.set(xlabel='Longitude')
-    ax.set(ylabel='Latitude')
-    fig.savefig(image_path, dpi=600)
+    with plot_lock:
+        fig, ax = plt.subplots(figsize=(10, 10))
+        df_pois_commercial.plot(ax=ax, label='commercial', color="blue")
+        df_pois_non_commercial.plot(ax=ax, label='non_commercial', color="red")
+        ax.legend(title="LEGEND")
+        ax.set(title='POI Classification')
+        ax.set(xlabel='Longitude')
+        ax.set(ylabel='Latitude')
+        fig.savefig(image_path, dpi=600)
+
+
+def build_pipeline(place, data_path, eps=300, minpts=5, network_type='drive',
+                   export_geojson=False, cluster_engine='haversine',
+                   incremental_clustering=False, export_graphml=False):
+    """
+    Pipeline of a place analysis: polygon -> POI/buildings/street network ->
+    POI building enrichment -> classification -> clustering -> population
+    index, and renders
 
+    Parameters
+    ----------
+    place :
+      input place
+    data_path :
+      output folder
+    eps :
+      DBSCAN neighbourhood radius in meters
+    minpts :
+      smallest cluster size allowed
+    network_type :
+      osmnx street network type
+    export_geojson :
+      also export POI and buildings as GeoJSON
+    cluster_engine :
+      DBSCAN engine of `poi_cluster`
+    incremental_clustering :
+      update the clusters of the previous run instead of clustering again
+    export_graphml :
+      also export the street network as GraphML
 
-def analyse_data(place, path_to_output):
-    place_ref = str(place['state'])
+    Returns
+    dag.Pipeline
+    """
     path_to_output = data_path
-    poi_file = path_to_output + '/poi.geojson'
 
-    df_poi = load_geodataframe(poi_file)
-
-    # saving POI as image
-    poi_image(df_poi, path_to_output)
-
-    # Classification of POI and saving as image
-    poi_classification(df_poi, path_to_output)
-
-    # POI analyse using street of city
-    poi_street(df_poi, path_to_output)
+    # if folder not exist create folder with place name
+    if not(os.path.isdir(path_to_output)):
+        os.makedirs(path_to_output)
 
-    # POI spatial clustering
-    poi_cluster(df_poi, path_to_output)
+    polygon_file = path_to_output + '/polygon.wkt'
+    poi_file = path_to_output + '/poi.parquet'
+    building_file = path_to_output + '/buildings.parquet'
+    street_file = path_to_output + '/network.graphml'
+    network_dir = path_to_output + '/network'
+    enriched_file = path_to_output + '/poi_enriched.parquet'
+    category_file = path_to_output + '/poi_category.csv'
+    cluster_file = path_to_output + '/poi_commercial_clustered_DBSCAN.csv'
+    cluster_table_file = path_to_output + '/poi_commercial_clusters.csv'
+    cluster_population_file = path_to_output + \
+        '/poi_commercial_cluster_population.csv'
+
+    def polygon_stage():
+        # Requesting polygon of place
+        polygon = get_polygon(place)
+        with open(polygon_file, 'w') as f:
+            f.write(polygon.wkt)
+        return polygon
+
+    def load_polygon():
+        with open(polygon_file) as f:
+            return wkt.loads(f.read())
+
+    def poi_stage(polygon):
+        # Requesting POI data within polygon
+        poi_data = get_poi_data(place, polygon)
+        # saving POI data as GeoParquet
+        store_geodataframe(poi_data, poi_file)
+        if export_geojson:
+            store_geodataframe(poi_data, path_to_output + '/poi.geojson')
+        return storage.normalise_nulls(poi_data)
+
+    def building_stage(polygon):
+        # Requesting building data of city using polygon
+        buildings_data = get_buildings(place, polygon)
+        # saving building data as GeoParquet
+        store_geodataframe(buildings_data, building_file)
+        if export_geojson:
+            store_geodataframe(
+                buildings_data, path_to_output + '/buildings.geojson')
+        return storage.normalise_nulls(buildings_data)
+
+    def street_stage(polygon):
+        # Requesting street network using polygon
+        street_data = ox.graph_from_polygon(polygon, network_type=network_type)
+        # Save street network as memory mappable arrays, GraphML on export
+        network_store.save_network(street_data, network_dir)
+        if export_graphml:
+            ox.save_graphml(street_data, filename=street_file)
+        return network_store.load_network(network_dir)
+
+    def read_csv(filename):
+        return lambda: pd.read_csv(filename, encoding='utf-8')
+
+    # street network distances need the network downstream
+    network_input = ['street'] if cluster_engine == 'network' else []
+
+    geojson_files = lambda name: (
+        [path_to_output + '/' + name + '.geojson'] if export_geojson else [])
+
+    return dag.Pipeline([
+        dag.Stage('polygon', polygon_stage,
+                  outputs=[polygon_file], load=load_polygon,
+                  params={'place': place}),
+        dag.Stage('poi', poi_stage, inputs=['polygon'],
+                  outputs=[poi_file] + geojson_files('poi'),
+                  load=lambda: load_geodataframe(poi_file)),
+        dag.Stage('buildings', building_stage, inputs=['polygon'],
+                  outputs=[building_file] + geojson_files('buildings'),
+                  load=lambda: load_geodataframe(building_file),
+                  version=3),
+        dag.Stage('street', street_stage, inputs=['polygon'],
+                  outputs=network_store.network_files(network_dir) +
+                  ([street_file] if export_graphml else []),
+                  load=lambda: network_store.load_network(network_dir),
+                  params={'network_type': network_type},
+                  version=2),
+        dag.Stage('poi_enrichment',
+                  lambda poi, buildings: poi_building_enrichment(
+                      poi, buildings, path_to_output),
+                  inputs=['poi', 'buildings'], outputs=[enriched_file],
+                  load=lambda: load_geodataframe(enriched_file),
+                  params={'taxonomy': taxonomy.version},
+                  version=2),
+        dag.Stage('classification',
+                  lambda poi_enrichment: poi_classification(
+                      poi_enrichment, path_to_output),
+                  inputs=['poi_enrichment'], outputs=[category_file],
+                  load=read_csv(category_file),
+                  params={'taxonomy': taxonomy.version},
+                  version=2),
+        dag.Stage('clustering',
+                  lambda classification, street=None: poi_cluster(
+                      classification, path_to_output, eps=eps, minpts=minpts,
+                      engine=cluster_engine,
+                      incremental=incremental_clustering, street_data=street),
+                  inputs=['classification'] + network_input,
+                  outputs=[cluster_file],
+                  load=read_csv(cluster_file),
+                  params={'eps': eps, 'minpts': minpts,
+                          'engine': cluster_engine,
+                          'incremental': incremental_clustering},
+                  version=2),
+        dag.Stage('cluster_sweep',
+                  lambda classification, street=None: poi_cluster_sweep(
+                      classification, path_to_output, engine=cluster_engine,
+                      street_data=street),
+                  inputs=['classification'] + network_input,
+                  outputs=[path_to_output +
+                           '/poi_commercial_cluster_sweep.csv'],
+                  params={'eps': SWEEP_EPS, 'minpts': SWEEP_MINPTS,
+                          'engine': cluster_engine}),
+        dag.Stage('commercial_density',
+                  lambda classification: poi_commercial_density(
+                      classification, path_to_output),
+                  inputs=['classification'],
+                  outputs=[path_to_output + '/poi_commercial_density.npy',
+                           path_to_output + '/poi_commercial_density.json',
+                           path_to_output +
+                           '/poi_commercial_density_peaks.csv'],
+                  params={'cell': DENSITY_CELL,
+                          'bandwidth': DENSITY_BANDWIDTH,
+                          'kernel': DENSITY_KERNEL}),
+        dag.Stage('cluster_statistics',
+                  lambda clustering: poi_cluster_statistics(
+                      clustering, path_to_output),
+                  inputs=['clustering'], outputs=[cluster_table_file],
+                  load=read_csv(cluster_table_file)),
+        dag.Stage('cluster_hulls',
+                  lambda clustering, cluster_statistics: poi_cluster_hulls(
+                      clustering, cluster_statistics, path_to_output),
+                  inputs=['clustering', 'cluster_statistics'],
+                  outputs=[path_to_output + '/poi_commercial_clusters.parquet',
+                           path_to_output + '/poi_commercial_clusters.geojson'],
+                  load=lambda: load_geodataframe(
+                      path_to_output + '/poi_commercial_clusters.parquet'),
+                  params={'buffer': HULL_BUFFER,
+                          'tolerance': HULL_TOLERANCE}),
+        dag.Stage('cluster_population',
+                  lambda cluster_hulls, buildings: poi_cluster_population(
+                      cluster_hulls, buildings, path_to_output),
+                  inputs=['cluster_hulls', 'buildings'],
+                  outputs=[cluster_population_file],
+                  load=read_csv(cluster_population_file),
+                  params={'catchment': population.CATCHMENT,
+                          'level_height': population.LEVEL_HEIGHT,
+                          'floor_area_per_person':
+                          population.FLOOR_AREA_PER_PERSON}),
+        dag.Stage('population_index',
+                  lambda clustering, cluster_statistics, cluster_population:
+                  poi_population_index(
+                      clustering, cluster_statistics, path_to_output,
+                      cluster_population=cluster_population),
+                  inputs=['clustering', 'cluster_statistics',
+                          'cluster_population'],
+                  outputs=[path_to_output +
+                           '/poi_commercial_population_index.csv']),
+        dag.Stage('accessibility',
+                  lambda clustering, buildings: poi_building_accessibility(
+                      clustering, buildings, path_to_output),
+                  inputs=['clustering', 'buildings'],
+                  outputs=[path_to_output + '/poi_building_accessibility.csv',
+                           path_to_output +
+                           '/poi_commercial_cluster_served.csv'],
+                  params={'radii': accessibility.RADII,
+                          'floor_area_per_person':
+                          population.FLOOR_AREA_PER_PERSON}),
+        dag.Stage('poi_image',
+                  lambda poi: poi_image(poi, path_to_output),
+                  inputs=['poi'],
+                  outputs=[path_to_output + '/poi_data.png']),
+        dag.Stage('classification_image',
+                  lambda classification: poi_classification_image(
+                      classification, path_to_output),
+                  inputs=['classification'],
+                  outputs=[path_to_output + '/type_of_poi.png']),
+        dag.Stage('street_image',
+                  lambda poi, street: poi_street(
+                      poi, path_to_output, street_data=street),
+                  inputs=['poi', 'street'],
+                  outputs=[path_to_output + '/street_with_poi.png']),
+        dag.Stage('street_snap',
+                  lambda classification, street: poi_street_snap(
+                      classification, path_to_output, street_data=street),
+                  inputs=['classification', 'street'],
+                  outputs=[path_to_output +
+                           '/poi_commercial_street_snap.csv'],
+                  params={'piece_length': snap.PIECE_LENGTH})],
+        state_file=path_to_output + '/pipeline_state.json')
+
+
+def analysis_targets(optional_stages=()):
+    """
+    Pipeline stages of an analysis
 
+    Parameters
+    ----------
+    optional_stages :
+      stages of OPTIONAL_STAGES run as well
 
-def download_data(place, data_path):
+    Returns
+    list of stage names
+    """
+    unknown = [name for name in optional_stages
+               if name not in OPTIONAL_STAGES]
+    if unknown:
+        raise ValueError('Unknown optional stages {}, expected some of '
+                         '{}'.format(', '.join(unknown),
+                                     ', '.join(OPTIONAL_STAGES)))
+    return ANALYSIS_STAGES + [name for name in OPTIONAL_STAGES
+                              if name in optional_stages]
+
+
+def analyse_data(place, path_to_output, eps=300, minpts=5,
+                 cluster_engine='haversine', optional_stages=()):
+    """
+    Analyse the downloaded OSM data of a place, up-to-date stages are
+    skipped
 
-    place_ref = str(place['state'])
-    print('OSM data requested for city: ' + str(place_ref))
-    path_to_output = data_path
+    Parameters
+    ----------
+    place :
+      input place
+    path_to_output :
+      folder of the downloaded data
+    eps :
+      DBSCAN neighbourhood radius in meters
+    minpts :
+      smallest cluster size allowed
+    cluster_engine :
+      DBSCAN engine of `poi_cluster`
+    optional_stages :
+      stages of OPTIONAL_STAGES run as well
 
-    # if folder not exist create folder with place name
-    if not(os.path.isdir(path_to_output)):
-        os.makedirs(path_to_output)
+    Returns
+    Ordered dict of stage name -> StageResult
+    """
+    pipeline = build_pipeline(place, path_to_output, eps=eps, minpts=minpts,
+                              cluster_engine=cluster_engine)
+    # downloaded files are used as they are
+    return pipeline.run(targets=analysis_targets(optional_stages),
+                        trusted=['poi', 'buildings', 'street'])
 
-    poi_file = path_to_output + '/poi.geojson'
-    building_file = path_to_output + '/buildings.geojson'
-    street_file = path_to_output + '/network.graphml'
 
-    # Requesting polygon of place
-    polygon = get_polygon(place)
+def download_data(place, data_path, fail_fast=True, network_type='drive',
+                  export_geojson=False, export_graphml=False):
+    """
+    Download and store OSM data of a place: the polygon first, then POI,
+    buildings and street network concurrently, up-to-date stages are
+    skipped
 
-    # Requesting POI data within polygon
-    poi_data = get_poi_data(place, polygon)
-    # saving POI data as geojson
-    store_geodataframe(poi_data, poi_file)
+    Parameters
+    ----------
+    place :
+      input place
+    data_path :
+      output folder
+    fail_fast :
+      if True stop on the first failed stage, else keep the artifacts of
+      the stages that succeeded
+    network_type :
+      osmnx street network type
+    export_geojson :
+      also export POI and buildings as GeoJSON
+    export_graphml :
+      also export the street network as GraphML
 
-    # Requesting building data of city using polygon
-    buildings_data = get_buildings(place, polygon)
-    # saving building data as geojson
-    store_geodataframe(buildings_data, building_file)
+    Returns
+    Ordered dict of stage name -> StageResult
+    """
 
-    # Requesting street network using polygon
-    street_data = ox.graph_from_polygon(polygon, network_type='drive')
-    # Save street network as GraphML file
-    ox.save_graphml(street_data, filename=street_file)
+    place_ref = str(place['state'])
+    print('OSM data requested for city: ' + str(place_ref))
 
+    pipeline = build_pipeline(place, data_path, network_type=network_type,
+                              export_geojson=export_geojson,
+                              export_graphml=export_graphml)
+    # stages depend only on the polygon, each stores its file when done
+    results = pipeline.run(targets=DOWNLOAD_STAGES, fail_fast=fail_fast)
+
+    failed = [name for name, result in results.items()
+              if result.error is not None]
+    if failed:
+        print('Failed OSM data stages for city: {}: {}'.format(
+            place_ref, ', '.join(failed)))
     print('Stored OSM data files for city: ' + place_ref)
+    return results
 
 
-def main(input_place, data_path):
+def main(input_place, data_path, eps=300, minpts=5, network_type='drive',
+         cluster_engine='haversine', incremental_clustering=False,
+         optional_stages=()):
     place = {'state': input_place,
              'country': 'India'}
-    download_data(place, data_path)
-    analyse_data(place, data_path)
+    # frames are passed in memory between stages, up-to-date stages skipped
+    pipeline = build_pipeline(place, data_path, eps=eps, minpts=minpts,
+                              network_type=network_type,
+                              cluster_engine=cluster_engine,
+                              incremental_clustering=incremental_clustering)
+    pipeline.run(targets=DOWNLOAD_STAGES + analysis_targets(optional_stages))
 
     return 'Done'
 
@@ -0,0 +1,217 @@
+# Storage of GeoDataFrames
+"""
+Working format: GeoParquet (`.parquet`) or Feather (`.feather`) with WKB
+geometries, read with column projection and memory mapping
+Export format: GeoJSON (`.geojson`)
+"""
+import json
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_string_dtype
+import shapely
+import shapely.wkb
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+except ImportError:  # columnar formats unavailable, GeoJSON only
+    pa = None
+
+CRS = {'init': 'epsg:4326'}
+GEOMETRY_COLUMN = 'geometry'
+FORMATS = {'.parquet': 'parquet',
+           '.feather': 'feather',
+           '.geojson': 'geojson',
+           '.json': 'geojson'}
+
+
+def storage_format(geo_filename):
+    """
+    Storage format of a file given its extension
+
+    Parameters
+    ----------
+    geo_filename : string
+      filename for GeoDataFrame storage
+
+    Returns
+    `parquet`, `feather` or `geojson`
+    """
+    extension = os.path.splitext(geo_filename)[1].lower()
+    try:
+        return FORMATS[extension]
+    except KeyError:
+        raise ValueError('Unknown storage format: {}'.format(geo_filename))
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError('pyarrow is required for parquet and feather files')
+
+
+def normalise_nulls(df_osm_data):
+    """
+    Use None for every missing value (NaN or empty string) of object columns
+
+    Parameters
+    ----------
+    df_osm_data : geopandas.GeoDataFrame
+      input OSM data frame
+
+    Returns
+    df_osm_data : geopandas.GeoDataFrame
+      data frame with normalised nulls
+    """
+    df_osm_data = df_osm_data.copy()
+    for column in df_osm_data.columns:
+        if column == GEOMETRY_COLUMN or \
+                not is_string_dtype(df_osm_data[column]):
+            continue
+        values = df_osm_data[column].astype(object)
+        missing = (values.isnull() | (values == '')).values
+        values = values.values.copy()
+        values[missing] = None
+        df_osm_data[column] = pd.Series(
+            values, index=df_osm_data.index, dtype=object)
+    return df_osm_data
+
+
+def to_wkb(geometries):
+    """
+    Encode geometries as WKB
+
+    Parameters
+    ----------
+    geometries :
+      iterable of shapely geometries
+
+    Returns
+    numpy.ndarray of bytes
+    """
+    geometries = np.asarray(list(geometries), dtype=object)
+    if hasattr(shapely, 'to_wkb'):
+        # vectorised encoding (shapely >= 2)
+        return shapely.to_wkb(geometries)
+    wkb = np.empty(len(geometries), dtype=object)
+    wkb[:] = [None if geometry is None else geometry.wkb
+              for geometry in geometries]
+    return wkb
+
+
+def from_wkb(wkb):
+    """
+    Decode WKB geometries
+
+    Parameters
+    ----------
+    wkb :
+      iterable of bytes
+
+    Returns
+    numpy.ndarray of shapely geometries
+    """
+    wkb = np.asarray(list(wkb), dtype=object)
+    if hasattr(shapely, 'from_wkb'):
+        # vectorised decoding (shapely >= 2)
+        return shapely.from_wkb(wkb)
+    geometries = np.empty(len(wkb), dtype=object)
+    geometries[:] = [None if value is None else shapely.wkb.loads(value)
+                     for value in wkb]
+    return geometries
+
+
+def write_geodataframe(df_osm_data, geo_filename):
+    """
+    Store a GeoDataFrame in lon/lat coordinates, nulls are normalised once
+    here so loading needs no cleaning
+
+    Parameters
+    ----------
+    df_osm_data : geopandas.GeoDataFrame
+      input OSM data frame, in lon/lat coordinates
+    geo_filename : string
+      filename for GeoDataFrame storage, the extension sets the format
+
+    Returns
+    ------
+
+    """
+    file_format = storage_format(geo_filename)
+    df_osm_data = normalise_nulls(df_osm_data)
+
+    if file_format == 'geojson':
+        df_osm_data.to_file(geo_filename, driver='GeoJSON')
+        return
+
+    _require_pyarrow()
+    df_attributes = df_osm_data.drop(GEOMETRY_COLUMN, axis=1)
+    df_attributes = df_attributes.reset_index(drop=True)
+    table = pa.Table.from_pandas(df_attributes, preserve_index=False)
+    table = table.append_column(
+        GEOMETRY_COLUMN,
+        pa.array(to_wkb(df_osm_data[GEOMETRY_COLUMN]), type=pa.binary()))
+    # GeoParquet metadata, no crs means lon/lat (OGC:CRS84)
+    geo_metadata = {'version': '0.4.0',
+                    'primary_column': GEOMETRY_COLUMN,
+                    'columns': {GEOMETRY_COLUMN: {'encoding': 'WKB',
+                                                  'geometry_types': []}}}
+    metadata = dict(table.schema.metadata or {})
+    metadata[b'geo'] = json.dumps(geo_metadata).encode('utf-8')
+    table = table.replace_schema_metadata(metadata)
+
+    if file_format == 'parquet':
+        pq.write_table(table, geo_filename)
+    else:
+        # uncompressed so reads can be memory mapped without copies
+        feather.write_feather(table, geo_filename, compression='uncompressed')
+
+
+def read_geodataframe(geo_filename, columns=None):
+    """
+    Load a GeoDataFrame
+
+    Parameters
+    ----------
+    geo_filename : string
+      filename for GeoDataFrame storage, the extension sets the format
+    columns : list
+      attribute columns to load, None for all, geometry is always loaded
+
+    Returns
+    df_osm_data : geopandas.GeoDataFrame
+      output OSM data frame
+    """
+    file_format = storage_format(geo_filename)
+
+    if file_format == 'geojson':
+        df_osm_data = gpd.read_file(geo_filename)
+        # files not written by `write_geodataframe` may hold NaN and ''
+        df_osm_data = normalise_nulls(df_osm_data)
+        if columns is not None:
+            df_osm_data = df_osm_data[
+                [column for column in columns if column != GEOMETRY_COLUMN]
+                + [GEOMETRY_COLUMN]]
+        return df_osm_data
+
+    _require_pyarrow()
+    if columns is not None:
+        columns = [column for column in columns if column != GEOMETRY_COLUMN]
+        columns.append(GEOMETRY_COLUMN)
+    if file_format == 'parquet':
+        table = pq.read_table(geo_filename, columns=columns, memory_map=True)
+    else:
+        table = feather.read_table(
+            geo_filename, columns=columns, memory_map=True)
+
+    geometries = from_wkb(
+        table.column(GEOMETRY_COLUMN).to_pandas().values)
+    table = table.remove_column(
+        table.schema.get_field_index(GEOMETRY_COLUMN))
+    df_attributes = table.to_pandas()
+    return gpd.GeoDataFrame(df_attributes,
+                            geometry=gpd.GeoSeries(geometries),
+                            crs=CRS)
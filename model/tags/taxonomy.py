@@ -0,0 +1,365 @@
+# Compiled tag taxonomy
+"""
+Inverted hash indexes over `key_classification` and `activity_classification`:
+	(osm key, value) -> land uses and activity category
+	built once on first use so every tag resolves with O(1) lookups
+"""
+import collections
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+from types import MappingProxyType
+
+from model.tags import tags as osm_tags
+
+# Keys whose activity category does not depend on their value
+# Note that some values repeat for different keys (e.g. shop=fuel and
+# amenity=fuel), but they do not belong to the same activity classification
+KEY_ACTIVITY_CATEGORY = {
+    'shop': 'commercial',
+    'leisure': 'commercial',
+    'amenity': 'commercial',
+    'man_made': 'non_commercial',
+    'industrial': 'non_commercial'}
+# Keys whose activity category is the one of their value
+VALUE_ACTIVITY_KEYS = frozenset([
+    'landuse',
+    # Inferred cases adopted land use values
+    'inferred',
+    'building',
+    'building:use',
+    'building:part'])
+
+# Compiled taxonomy shared by every process, recompiled when tags.py changes,
+# under POI_CACHE_DIR or the `cache` folder of the repository
+DEFAULT_CACHE_FILE = os.path.join(
+    os.environ.get('POI_CACHE_DIR') or os.path.join(os.path.dirname(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+        'cache'),
+    'taxonomy.pickle')
+
+# rank: position of the first `key_classification` entry matching the tag
+TagClass = collections.namedtuple(
+    'TagClass', ['rank', 'land_uses', 'activity_category'])
+
+
+def split_key(key):
+    """
+    Split a `key_classification` key into its land use and OSM key
+
+    Parameters
+    ----------
+    key : string
+            key of `key_classification` (e.g. `activity_building:use`)
+
+    Returns
+    ----------
+    string, string
+            returns the land use (e.g. `activity`) and the OSM key (e.g. `building:use`)
+    """
+    land_use = key.split("_")[0]
+    key_tag = key.replace(
+        "activity_",
+        "").replace(
+        "residential_",
+        "").replace(
+        "other_",
+        "").replace(
+            "infer_",
+        "")
+    return land_use, key_tag
+
+
+def source_version():
+    """
+    Version of the tag lists, digest of `model/tags/tags.py`
+
+    Returns
+    ----------
+    string
+            returns the hexadecimal digest
+    """
+    source_file = os.path.splitext(osm_tags.__file__)[0] + '.py'
+    with open(source_file, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def _activity_category(key, value, value_categories):
+    if key in KEY_ACTIVITY_CATEGORY:
+        return KEY_ACTIVITY_CATEGORY[key]
+    if key in VALUE_ACTIVITY_KEYS:
+        try:
+            return value_categories.get(value)
+        except TypeError:
+            # unhashable value
+            return None
+    return None
+
+
+class Taxonomy(object):
+    """
+    Frozen compiled taxonomy
+
+    Attributes
+    ----------
+    version : string
+            version of the tag lists it was compiled from
+    keys : tuple
+            OSM keys used for land use classification
+    tag_classes : mapping
+            (key, value) -> TagClass
+    land_use_values : mapping
+            key -> land use -> frozenset of values
+    value_categories : mapping
+            value -> activity category
+    """
+    __slots__ = ('version', 'keys', 'tag_classes', 'land_use_values',
+                 'value_categories')
+
+    def __init__(self, version, keys, tag_classes, land_use_values,
+                 value_categories):
+        object.__setattr__(self, 'version', version)
+        object.__setattr__(self, 'keys', tuple(keys))
+        object.__setattr__(self, 'tag_classes',
+                           MappingProxyType(dict(tag_classes)))
+        object.__setattr__(self, 'land_use_values', MappingProxyType(
+            {key: MappingProxyType(dict(values))
+             for key, values in land_use_values.items()}))
+        object.__setattr__(self, 'value_categories',
+                           MappingProxyType(dict(value_categories)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Taxonomy is frozen')
+
+    def __delattr__(self, name):
+        raise AttributeError('Taxonomy is frozen')
+
+    def __reduce__(self):
+        return (Taxonomy, (self.version,
+                           self.keys,
+                           dict(self.tag_classes),
+                           {key: dict(values) for key, values
+                            in self.land_use_values.items()},
+                           dict(self.value_categories)))
+
+    def classify(self, key, value):
+        """
+        Classification of a key:value pair
+
+        Parameters
+        ----------
+        key : string
+                OSM key
+        value : string
+                OSM value
+
+        Returns
+        ----------
+        TagClass
+                returns the tag classification, None if not classified
+        """
+        try:
+            return self.tag_classes.get((key, value))
+        except TypeError:
+            # unhashable value
+            return None
+
+    def value_category(self, value):
+        """
+        Activity category of an activity value
+
+        Parameters
+        ----------
+        value : string
+                activity value
+
+        Returns
+        ----------
+        string
+                returns the activity classification
+        """
+        try:
+            return self.value_categories.get(value)
+        except TypeError:
+            return None
+
+    def activity_category(self, key, value):
+        """
+        Activity category of a key:value pair
+
+        Parameters
+        ----------
+        key : string
+                OSM key
+        value : string
+                OSM value
+
+        Returns
+        ----------
+        string
+                returns the activity classification
+        """
+        return _activity_category(key, value, self.value_categories)
+
+
+def compile_taxonomy(key_classification=None, activity_classification=None,
+                     version=None):
+    """
+    Compile the tag lists into a Taxonomy
+
+    Parameters
+    ----------
+    key_classification : dict
+            land use key -> values, defaults to `tags.key_classification`
+    activity_classification : dict
+            activity category -> values, defaults to `tags.activity_classification`
+    version : string
+            version of the tag lists, defaults to `source_version()`
+
+    Returns
+    ----------
+    Taxonomy
+            returns the compiled taxonomy
+    """
+    if key_classification is None:
+        key_classification = osm_tags.key_classification
+    if activity_classification is None:
+        activity_classification = osm_tags.activity_classification
+    if version is None:
+        version = source_version()
+
+    # first category listing a value wins, as in a sequential scan
+    value_categories = {}
+    for category, values in activity_classification.items():
+        for value in values:
+            value_categories.setdefault(value, category)
+
+    keys = []
+    land_use_values = collections.OrderedDict()
+    ranks, land_uses = {}, collections.OrderedDict()
+    for rank, (key, values) in enumerate(key_classification.items()):
+        land_use, key_tag = split_key(key)
+        if key_tag not in land_use_values:
+            keys.append(key_tag)
+            land_use_values[key_tag] = collections.OrderedDict()
+        land_use_values[key_tag].setdefault(land_use, set()).update(values)
+        for value in values:
+            ranks.setdefault((key_tag, value), rank)
+            pair_land_uses = land_uses.setdefault((key_tag, value), [])
+            if land_use not in pair_land_uses:
+                pair_land_uses.append(land_use)
+
+    tag_classes = {}
+    for (key, value), pair_land_uses in land_uses.items():
+        tag_classes[(key, value)] = TagClass(
+            ranks[(key, value)],
+            tuple(pair_land_uses),
+            _activity_category(key, value, value_categories))
+    land_use_values = {
+        key: {land_use: frozenset(values)
+              for land_use, values in key_land_uses.items()}
+        for key, key_land_uses in land_use_values.items()}
+
+    return Taxonomy(version, keys, tag_classes, land_use_values,
+                    value_categories)
+
+
+def save_taxonomy(taxonomy, cache_file):
+    """
+    Store a compiled Taxonomy, the file is replaced atomically
+
+    Parameters
+    ----------
+    taxonomy : Taxonomy
+            compiled taxonomy
+    cache_file : string
+            filename for the taxonomy cache
+
+    Returns
+    ----------
+
+    """
+    cache_dir = os.path.dirname(os.path.abspath(cache_file))
+    if not(os.path.isdir(cache_dir)):
+        os.makedirs(cache_dir)
+    fd, tmp_file = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(taxonomy, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+    except BaseException:
+        os.remove(tmp_file)
+        raise
+
+
+def load_taxonomy(cache_file=None):
+    """
+    Load a compiled Taxonomy from its cache file, compiling and storing it
+    when the cache is missing or older than the tag lists
+
+    Parameters
+    ----------
+    cache_file : string
+            filename for the taxonomy cache, None to compile without cache
+
+    Returns
+    ----------
+    Taxonomy
+            returns the compiled taxonomy
+    """
+    version = source_version()
+    if cache_file is None:
+        return compile_taxonomy(version=version)
+
+    try:
+        with open(cache_file, 'rb') as f:
+            cached = pickle.load(f)
+        if isinstance(cached, Taxonomy) and cached.version == version:
+            return cached
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError,
+            ImportError, TypeError, ValueError):
+        pass
+
+    compiled = compile_taxonomy(version=version)
+    try:
+        save_taxonomy(compiled, cache_file)
+    except OSError:
+        # read-only cache location, the compiled taxonomy is still usable
+        pass
+    return compiled
+
+
+_taxonomy = None
+_taxonomy_lock = threading.Lock()
+
+
+def get_taxonomy():
+    """
+    Taxonomy of the default cache file, loaded on first use
+
+    Returns
+    ----------
+    Taxonomy
+            returns the compiled taxonomy
+    """
+    global _taxonomy
+    with _taxonomy_lock:
+        if _taxonomy is None:
+            _taxonomy = load_taxonomy(DEFAULT_CACHE_FILE)
+        return _taxonomy
+
+
+class LazyTaxonomy(object):
+    """
+    Stand-in for the Taxonomy returned by `get_taxonomy`, nothing is read
+    or written before its first attribute access
+    """
+
+    def __getattr__(self, name):
+        return getattr(get_taxonomy(), name)
+
+
+# Taxonomy loaded from its cache on first use, compiled on a cache miss
+taxonomy = LazyTaxonomy()
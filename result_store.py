@@ -0,0 +1,158 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+# written in a result directory once its analysis has completed
+COMPLETE_MARKER = '.complete'
+
+
+def place_key(place, params):
+    """
+    Content address of an analysis.
+
+    Args:
+        place (str): input place
+        params (dict): analysis parameters (DBSCAN eps/minpts, network
+            type, taxonomy version, ...)
+
+    Returns:
+        (str): hexadecimal digest of the normalised place and parameters
+    """
+    content = json.dumps({'place': ' '.join(place.lower().split()),
+                          'params': params}, sort_keys=True)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+class ResultStore(object):
+    """
+    Analysis results stored per place and parameter set, one directory per
+    key, least recently used results evicted above a disk budget.
+
+    Args:
+        root (str): directory of the result directories
+        max_bytes (int): disk budget, None for no limit
+    """
+
+    def __init__(self, root, max_bytes=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def path(self, key):
+        """
+        Result directory of a key.
+
+        Args:
+            key (str): result key
+
+        Returns:
+            (str): directory
+        """
+        return os.path.join(self.root, key)
+
+    def is_complete(self, key):
+        """
+        Whether the analysis of a key has completed.
+
+        Args:
+            key (str): result key
+
+        Returns:
+            (bool)
+        """
+        return os.path.isfile(os.path.join(self.path(key), COMPLETE_MARKER))
+
+    def info(self, key):
+        """
+        Request information stored with a completed result.
+
+        Args:
+            key (str): result key
+
+        Returns:
+            (dict): None if the result is not complete
+        """
+        try:
+            with open(os.path.join(self.path(key), COMPLETE_MARKER)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def touch(self, key):
+        """
+        Marks a result as used, for the LRU eviction.
+
+        Args:
+            key (str): result key
+        """
+        marker = os.path.join(self.path(key), COMPLETE_MARKER)
+        try:
+            os.utime(marker, None)
+        except OSError:
+            pass
+
+    def complete(self, key, info=None):
+        """
+        Marks the analysis of a key as completed and evicts old results.
+
+        Args:
+            key (str): result key
+            info (dict): request information stored with the result
+        """
+        directory = self.path(key)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(info or {}, f)
+        os.replace(tmp_path, os.path.join(directory, COMPLETE_MARKER))
+        self.evict(keep=key)
+
+    def _size(self, directory):
+        size = 0
+        for entry_dir, _, filenames in os.walk(directory):
+            for filename in filenames:
+                try:
+                    size += os.path.getsize(os.path.join(entry_dir, filename))
+                except OSError:
+                    pass
+        return size
+
+    def evict(self, keep=None):
+        """
+        Removes least recently used completed results until the store fits
+        in its disk budget, results in progress are never removed.
+
+        Args:
+            keep (str): key never to remove
+
+        Returns:
+            (list): removed keys
+        """
+        if self.max_bytes is None or not os.path.isdir(self.root):
+            return []
+
+        with self._lock:
+            results, total = [], 0
+            for key in os.listdir(self.root):
+                directory = self.path(key)
+                if not os.path.isdir(directory):
+                    continue
+                size = self._size(directory)
+                total += size
+                if key != keep and self.is_complete(key):
+                    last_used = os.path.getmtime(
+                        os.path.join(directory, COMPLETE_MARKER))
+                    results.append((last_used, key, size))
+
+            removed = []
+            for _, key, size in sorted(results):
+                if total <= self.max_bytes:
+                    break
+                # marker first, so the result is never served half removed
+                os.remove(os.path.join(self.path(key), COMPLETE_MARKER))
+                shutil.rmtree(self.path(key), ignore_errors=True)
+                total -= size
+                removed.append(key)
+        return removed
@@ -0,0 +1,27 @@
+# Columnar assembly of building footprints
+from model.overpass import assemble
+
+
+def _square(first_node, x):
+    # nodes of a 10 m square with its lower left corner at x
+    corners = [(x, 0.), (x + 1e-4, 0.), (x + 1e-4, 1e-4), (x, 1e-4)]
+    return [{'type': 'node', 'id': first_node + i, 'lon': lon, 'lat': lat}
+            for i, (lon, lat) in enumerate(corners)]
+
+
+def test_way_and_relation_ids_collide():
+    elements = _square(1, 77.) + _square(5, 77.01) + [
+        {'type': 'way', 'id': 10, 'nodes': [1, 2, 3, 4, 1],
+         'tags': {'building': 'house'}},
+        {'type': 'way', 'id': 11, 'nodes': [5, 6, 7, 8, 5]},
+        {'type': 'relation', 'id': 10,
+         'members': [{'type': 'way', 'ref': 11, 'role': 'outer'}],
+         'tags': {'type': 'multipolygon', 'building': 'retail'}}]
+
+    df_building = assemble.buildings_from_elements(
+        elements, ['building', 'osm_id', 'geometry'])
+
+    assert df_building.osm_id.tolist() == [10, 10]
+    assert df_building.osm_type.tolist() == ['way', 'relation']
+    assert df_building.building.tolist() == ['house', 'retail']
+    assert df_building.geometry.is_valid.all()
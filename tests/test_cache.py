@@ -0,0 +1,63 @@
+# Overpass response cache
+import gzip
+import os
+
+from model.overpass import cache
+
+URL = 'https://overpass.example/api/interpreter'
+
+
+def test_scan_only_over_budget(tmpdir):
+    response_cache = cache.ResponseCache(str(tmpdir), max_bytes=10000)
+    scans = []
+    entries = response_cache.entries
+    response_cache.entries = lambda: scans.append(1) or entries()
+
+    for i in range(5):
+        response_cache.put(URL, 'node({});out;'.format(i), {'elements': []})
+    # the first commit learns the disk usage, the next ones track it
+    assert len(scans) == 1
+    assert response_cache.get(URL, 'node(3);out;') == {'elements': []}
+
+    # random names do not compress below the budget
+    big = {'elements': [{'id': i, 'name': os.urandom(8).hex()}
+                        for i in range(2000)]}
+    response_cache.put(URL, 'node(big);out;', big)
+    assert len(scans) == 2
+    assert response_cache.size() <= 10000
+    assert response_cache.stats()['evictions'] >= 1
+
+
+def test_scan_on_interval(tmpdir):
+    response_cache = cache.ResponseCache(str(tmpdir), evict_interval=0)
+    scans = []
+    entries = response_cache.entries
+    response_cache.entries = lambda: scans.append(1) or entries()
+
+    for i in range(3):
+        response_cache.put(URL, 'node({});out;'.format(i), {'elements': []})
+    assert len(scans) == 3
+
+
+def test_entry_evicted_after_lookup_is_a_miss(tmpdir):
+    response_cache = cache.ResponseCache(str(tmpdir))
+    response_cache.put(URL, 'node(1);out;', {'elements': []})
+    lookup = response_cache.lookup
+
+    def evicted_lookup(url, query):
+        path = lookup(url, query)
+        response_cache.clear()
+        return path
+
+    response_cache.lookup = evicted_lookup
+    assert response_cache.open_entry(URL, 'node(1);out;') is None
+    assert response_cache.stats()['hits'] == 0
+    assert response_cache.stats()['misses'] == 1
+
+
+def test_open_entry_survives_eviction(tmpdir):
+    response_cache = cache.ResponseCache(str(tmpdir))
+    response_cache.put(URL, 'node(1);out;', {'elements': []})
+    with response_cache.open_entry(URL, 'node(1);out;') as f:
+        response_cache.clear()
+        assert gzip.decompress(f.read()) == b'{"elements": []}'
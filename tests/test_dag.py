@@ -0,0 +1,35 @@
+# Pipeline runs with trusted stages
+from model.pipeline import dag
+
+
+def test_trusted_stage_with_changed_outputs(tmpdir):
+    poi_file = str(tmpdir.join('poi.txt'))
+    with open(poi_file, 'w') as f:
+        f.write('recorded')
+
+    def polygon_stage():
+        raise RuntimeError('upstream of a trusted stage must not run')
+
+    def poi_stage(polygon):
+        raise RuntimeError('trusted stage must not run')
+
+    def read_poi():
+        with open(poi_file) as f:
+            return f.read()
+
+    pipeline = dag.Pipeline([
+        dag.Stage('polygon', polygon_stage),
+        dag.Stage('poi', poi_stage, inputs=['polygon'], outputs=[poi_file],
+                  load=read_poi),
+        dag.Stage('double', lambda poi: poi * 2, inputs=['poi'])],
+        state_file=str(tmpdir.join('pipeline_state.json')))
+
+    results = pipeline.run(targets=['double'], trusted=['poi'])
+    assert results['double'].value == 'recordedrecorded'
+
+    # outputs changed after they were recorded
+    with open(poi_file, 'w') as f:
+        f.write('changed')
+    results = pipeline.run(targets=['double'], trusted=['poi'])
+    assert results['poi'].error is None
+    assert results['double'].value == 'changedchanged'
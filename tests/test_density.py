@@ -0,0 +1,42 @@
+# Kernel density raster
+import time
+
+import numpy as np
+import pytest
+
+from model.cluster import density
+
+
+def _points(n):
+    # POIs scattered over about 20 x 20 km around New Delhi
+    rng = np.random.RandomState(0)
+    return (77.1 + rng.uniform(0, .2, n), 28.5 + rng.uniform(0, .18, n))
+
+
+@pytest.mark.parametrize('kernel', density.KERNELS)
+def test_mass_conservation(kernel):
+    lon, lat = _points(5000)
+    surface, transform = density.density_raster(lon, lat, cell=25.,
+                                                bandwidth=150., kernel=kernel)
+    # the grid is padded by the kernel radius, no mass is cut
+    cell = transform['cell']
+    assert surface.sum() * cell * cell / 1e6 == pytest.approx(5000, rel=1e-6)
+    assert (surface >= 0).all()
+
+
+def test_sub_second_at_25m():
+    lon, lat = _points(100000)
+    started = time.time()
+    surface, transform = density.density_raster(lon, lat, cell=25.,
+                                                bandwidth=150.)
+    density.density_peaks(surface, transform)
+    assert time.time() - started < 1.
+    assert surface.shape[0] > 800 and surface.shape[1] > 800
+
+
+def test_no_points():
+    surface, transform = density.density_raster(np.zeros(0), np.zeros(0))
+    assert surface.shape == (0, 0)
+    peaks = density.density_peaks(surface, transform)
+    assert len(peaks) == 0
+    assert list(peaks.columns) == density.PEAK_COLUMNS
@@ -0,0 +1,144 @@
+# Overpass client against a local stand-in server
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import pytest
+import requests
+
+from model.overpass import cache
+from model.overpass import fetch
+
+
+class StandIn(object):
+    """
+    Overpass stand-in: the first answers of a query are the listed error
+    statuses, then `{"elements": [{"id": <query>}]}` after a delay
+    """
+
+    def __init__(self, errors=None, delays=None, retry_after='0'):
+        self.errors = errors or {}
+        self.delays = delays or {}
+        self.retry_after = retry_after
+        self.attempts = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def handler(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                query = parse_qs(body.decode('utf-8'))['data'][0]
+                with stand_in.lock:
+                    attempt = len(stand_in.attempts.setdefault(query, []))
+                    stand_in.attempts[query].append(time.monotonic())
+                    stand_in.in_flight += 1
+                    stand_in.max_in_flight = max(stand_in.max_in_flight,
+                                                 stand_in.in_flight)
+                try:
+                    errors = stand_in.errors.get(query, [])
+                    if attempt < len(errors):
+                        self.send_response(errors[attempt])
+                        self.send_header('Retry-After', stand_in.retry_after)
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                        return
+                    time.sleep(stand_in.delays.get(query, .02))
+                    content = json.dumps(
+                        {'elements': [{'type': 'node', 'id': int(query)}]})
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(content)))
+                    self.end_headers()
+                    self.wfile.write(content.encode('utf-8'))
+                finally:
+                    with stand_in.lock:
+                        stand_in.in_flight -= 1
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def start(stand_in):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), stand_in.handler())
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return 'http://127.0.0.1:{}/api/interpreter'.format(
+            server.server_address[1])
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_retry_after(serve):
+    stand_in = StandIn(errors={'1': [429], '2': [504, 504]},
+                       retry_after='0.2')
+    fetcher = fetch.OverpassFetcher(serve(stand_in), rate=None, backoff=.01)
+
+    results = fetcher.fetch_all(['1', '2', '3'])
+
+    assert [result['elements'][0]['id'] for result in results] == [1, 2, 3]
+    assert [len(stand_in.attempts[query]) for query in '123'] == [2, 3, 1]
+    # Retry-After is longer than the backoff and wins
+    for query in '12':
+        assert min(b - a for a, b in zip(stand_in.attempts[query],
+                                         stand_in.attempts[query][1:])) >= .2
+
+
+def test_backoff_gives_up(serve):
+    stand_in = StandIn(errors={'1': [503] * 10})
+    fetcher = fetch.OverpassFetcher(serve(stand_in), rate=None, backoff=.01,
+                                    max_retries=2)
+
+    with pytest.raises(requests.HTTPError):
+        fetcher.fetch('1')
+    assert len(stand_in.attempts['1']) == 3
+
+
+def test_max_in_flight_shared_by_callers(serve):
+    stand_in = StandIn(delays={str(i): .1 for i in range(8)})
+    fetcher = fetch.OverpassFetcher(serve(stand_in), rate=None,
+                                    max_in_flight=2)
+    # two stages downloading at once share the limit
+    callers = [threading.Thread(target=fetcher.fetch_all,
+                                args=([str(i) for i in range(j, 8, 2)],))
+               for j in range(2)]
+    for caller in callers:
+        caller.start()
+    for caller in callers:
+        caller.join()
+
+    assert stand_in.max_in_flight == 2
+    assert sum(len(attempts) for attempts in stand_in.attempts.values()) == 8
+
+
+def test_merge_order(serve, tmpdir):
+    # earlier queries answer last
+    stand_in = StandIn(delays={str(i): .03 * (6 - i) for i in range(6)})
+    fetcher = fetch.OverpassFetcher(serve(stand_in), rate=None,
+                                    max_in_flight=3,
+                                    cache=cache.ResponseCache(str(tmpdir)))
+    queries = [str(i) for i in range(6)]
+
+    assert [element['id']
+            for element in fetcher.iter_elements(queries)] == list(range(6))
+    # answered again from the cache
+    assert [result['elements'][0]['id']
+            for result in fetcher.fetch_all(queries)] == list(range(6))
+    assert [element['id']
+            for element in fetcher.iter_elements(queries)] == list(range(6))
+    assert all(len(attempts) == 1 for attempts in stand_in.attempts.values())
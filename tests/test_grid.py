@@ -0,0 +1,34 @@
+# Grid indexed DBSCAN
+import numpy as np
+import pytest
+from sklearn.cluster import DBSCAN
+
+from model.cluster import dbscan
+from model.cluster import grid
+from model.cluster import projection
+
+
+def _lon_lat():
+    rng = np.random.RandomState(1)
+    centres = rng.uniform(0, .1, size=(8, 2))
+    points = np.concatenate([centres[rng.randint(8, size=2000)] +
+                             rng.normal(scale=.002, size=(2000, 2)),
+                             rng.uniform(0, .1, size=(500, 2))])
+    return 77.15 + points[:, 0], 28.55 + points[:, 1]
+
+
+@pytest.mark.parametrize('eps, minpts', [(100, 5), (250, 10), (50, 1)])
+def test_same_labels_as_dbscan(eps, minpts):
+    lon, lat = _lon_lat()
+    xy, _ = projection.project_utm(lon, lat)
+    expected = DBSCAN(eps=eps, min_samples=minpts).fit_predict(xy)
+
+    np.testing.assert_array_equal(
+        grid.grid_dbscan(xy, eps, min_samples=minpts), expected)
+    np.testing.assert_array_equal(
+        dbscan.dbscan(lon, lat, eps, minpts, engine='grid'), expected)
+
+
+def test_unknown_engine():
+    with pytest.raises(ValueError):
+        dbscan.dbscan(np.zeros(1), np.zeros(1), 100, 5, engine='optics')
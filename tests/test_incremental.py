@@ -0,0 +1,40 @@
+# Incremental DBSCAN followed by the cluster statistics and hulls
+import numpy as np
+
+from model.cluster import hulls
+from model.cluster import incremental
+from model.cluster import stats
+
+
+def _blobs():
+    # three dense blobs about 2 km apart around New Delhi
+    rng = np.random.RandomState(0)
+    centres = [(77.20, 28.60), (77.22, 28.60), (77.24, 28.60)]
+    lon = np.concatenate([rng.normal(x, 0.0005, 30) for x, _ in centres])
+    lat = np.concatenate([rng.normal(y, 0.0005, 30) for _, y in centres])
+    return np.arange(len(lon)), lon, lat
+
+
+def test_update_with_deleted_cluster():
+    ids, lon, lat = _blobs()
+    clustering = incremental.IncrementalDBSCAN(eps=150, minpts=5)
+    labels = clustering.fit(ids, lon, lat)
+    assert sorted(np.unique(labels)) == [0, 1, 2]
+
+    # the first blob is deleted, cluster ids are not compacted
+    kept = labels != labels[0]
+    labels, report = clustering.update(ids[kept], lon[kept], lat[kept])
+    assert 'disappeared' in report.event.values
+    assert sorted(np.unique(labels)) == [1, 2]
+
+    table, n_noise = stats.cluster_statistics(lon[kept], lat[kept], labels)
+    assert table.spatial_cluster.tolist() == [1, 2]
+    assert table['count'].tolist() == [30, 30]
+    assert (table.hull_area > 0).all()
+    assert n_noise == 0
+
+    polygons = hulls.cluster_hulls(lon[kept], lat[kept], labels)
+    assert polygons.spatial_cluster.tolist() == [1, 2]
+    assert polygons['count'].tolist() == [30, 30]
+    assert polygons.geometry.is_valid.all()
+    assert (polygons.geometry.area > 0).all()
@@ -0,0 +1,48 @@
+# Background job queue
+import threading
+
+import jobs
+
+
+def test_job_done_after_on_done():
+    queue = jobs.JobQueue(max_workers=1)
+    entered = threading.Event()
+    release = threading.Event()
+    seen = []
+
+    def on_done(job):
+        # the job is not reported done while its result is stored
+        seen.append(job.state)
+        entered.set()
+        release.wait(10)
+
+    try:
+        job_id = queue.submit(max, (1, 2), on_done=on_done)
+        job = queue.get(job_id)
+        assert entered.wait(10)
+        assert job.state == jobs.RUNNING
+        assert queue.depth() == 1
+        release.set()
+        job._completed.wait(10)
+        assert seen == [jobs.RUNNING]
+        assert job.state == jobs.DONE
+        assert job.result() == 2
+    finally:
+        release.set()
+        queue.shutdown()
+
+
+def test_job_failed_when_on_done_raises():
+    queue = jobs.JobQueue(max_workers=1)
+
+    def on_done(job):
+        raise OSError('disk full')
+
+    try:
+        job = queue.get(queue.submit(max, (1, 2), on_done=on_done))
+        job.future.result(10)
+        job._completed.wait(10)
+        assert job.state == jobs.FAILED
+        assert 'disk full' in job.status()['error']
+    finally:
+        queue.shutdown()
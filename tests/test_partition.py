@@ -0,0 +1,46 @@
+# Tiled DBSCAN
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from sklearn.cluster import DBSCAN
+
+from model.cluster import partition
+
+
+def _points():
+    rng = np.random.RandomState(0)
+    centres = rng.uniform(0, 20000, size=(12, 2))
+    return np.concatenate([centres[rng.randint(12, size=3000)] +
+                           rng.normal(scale=300, size=(3000, 2)),
+                           rng.uniform(0, 20000, size=(1000, 2))])
+
+
+def test_same_labels_as_dbscan():
+    xy = _points()
+    expected = DBSCAN(eps=150, min_samples=5).fit_predict(xy)
+    labels = partition.tiled_dbscan(xy, 150, min_samples=5, tile_size=3000,
+                                    max_workers=1)
+    np.testing.assert_array_equal(labels, expected)
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        labels = partition.tiled_dbscan(xy, 150, min_samples=5,
+                                        tile_size=3000, executor=executor)
+    np.testing.assert_array_equal(labels, expected)
+
+
+def test_in_process_outside_the_main_thread(monkeypatch):
+    def no_pool(*args, **kwargs):
+        raise AssertionError('process pool started')
+
+    monkeypatch.setattr(partition, 'ProcessPoolExecutor', no_pool)
+    xy = _points()
+    labels = []
+    # e.g. a pipeline stage thread of a job worker
+    stage = threading.Thread(target=lambda: labels.append(
+        partition.tiled_dbscan(xy, 150, min_samples=5, tile_size=3000)))
+    stage.start()
+    stage.join()
+
+    np.testing.assert_array_equal(
+        labels[0], DBSCAN(eps=150, min_samples=5).fit_predict(xy))
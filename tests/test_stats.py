@@ -0,0 +1,35 @@
+# Cluster statistics
+import numpy as np
+import pytest
+
+from model.cluster import stats
+
+
+def test_against_per_cluster_loop():
+    rng = np.random.RandomState(3)
+    lon = 77.2 + rng.uniform(0, .05, 600)
+    lat = 28.6 + rng.uniform(0, .05, 600)
+    labels = rng.randint(-1, 5, 600)
+
+    table, n_noise = stats.cluster_statistics(lon, lat, labels)
+
+    assert n_noise == int((labels == -1).sum())
+    assert list(table.columns) == stats.CLUSTER_COLUMNS
+    assert table.spatial_cluster.tolist() == [0, 1, 2, 3, 4]
+    for row in table.itertuples():
+        member = labels == row.spatial_cluster
+        assert row.count == member.sum()
+        assert row.lon == pytest.approx(lon[member].mean())
+        assert row.lat == pytest.approx(lat[member].mean())
+        assert row.min_lon == lon[member].min()
+        assert row.max_lat == lat[member].max()
+        assert row.hull_area > 0
+        assert row.density == pytest.approx(
+            row.count / (row.hull_area / 1e6))
+
+
+def test_only_noise():
+    table, n_noise = stats.cluster_statistics(
+        np.array([77.2, 77.3]), np.array([28.6, 28.7]), np.array([-1, -1]))
+    assert len(table) == 0
+    assert n_noise == 2
@@ -0,0 +1,37 @@
+# Streaming Overpass JSON parser
+import json
+
+import pytest
+
+from model.overpass import stream
+
+BODY = json.dumps({
+    'version': 0.6,
+    'osm3s': {'copyright': 'ODbL'},
+    'elements': [{'type': 'node', 'id': i, 'lat': 28.6, 'lon': 77.2,
+                  'tags': {'name': 'Chāndnī Chowk {}'.format(i)}}
+                 for i in range(50)]}, ensure_ascii=False).encode('utf-8')
+
+
+def _chunks(body, size):
+    return [body[start:start + size] for start in range(0, len(body), size)]
+
+
+@pytest.mark.parametrize('size', [1, 7, 1 << 16])
+def test_elements_split_between_chunks(size):
+    # one byte chunks also split the multi-byte characters
+    elements = list(stream.iter_elements(_chunks(BODY, size)))
+    assert elements == json.loads(BODY.decode('utf-8'))['elements']
+
+
+def test_remark():
+    body = json.dumps({'elements': [{'type': 'node', 'id': 1}],
+                       'remark': 'runtime error: Query timed out'})
+    element_stream = stream.ElementStream(_chunks(body.encode('utf-8'), 5))
+    assert [element['id'] for element in element_stream] == [1]
+    assert element_stream.remark == 'runtime error: Query timed out'
+
+
+def test_truncated_body():
+    with pytest.raises(ValueError):
+        list(stream.iter_elements(_chunks(BODY[:len(BODY) // 2], 100)))
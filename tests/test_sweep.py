@@ -0,0 +1,41 @@
+# DBSCAN parameter sweeps from one neighbour graph
+import numpy as np
+import pytest
+from sklearn.cluster import DBSCAN
+
+from model.cluster import projection
+from model.cluster import sweep
+
+
+def _lon_lat():
+    rng = np.random.RandomState(2)
+    centres = rng.uniform(0, .08, size=(6, 2))
+    points = np.concatenate([centres[rng.randint(6, size=1500)] +
+                             rng.normal(scale=.003, size=(1500, 2)),
+                             rng.uniform(0, .08, size=(300, 2))])
+    return 77.15 + points[:, 0], 28.55 + points[:, 1]
+
+
+def test_labels_of_every_setting():
+    lon, lat = _lon_lat()
+    xy, _ = projection.project_utm(lon, lat)
+    graph = sweep.neighbour_graph(lon, lat, 300, engine='grid')
+
+    for eps in (100, 200, 300):
+        for minpts in (3, 10):
+            labels, core = graph.labels(eps, minpts)
+            model = DBSCAN(eps=eps, min_samples=minpts).fit(xy)
+            np.testing.assert_array_equal(labels, model.labels_)
+            assert core.sum() == len(model.core_sample_indices_)
+
+
+def test_sweep_table():
+    lon, lat = _lon_lat()
+    graph = sweep.neighbour_graph(lon, lat, 300)
+    table = graph.sweep([300, 100], [10, 3])
+
+    assert list(table.columns) == sweep.SWEEP_COLUMNS
+    assert table[['eps', 'minpts']].values.tolist() == \
+        [[100, 3], [100, 10], [300, 3], [300, 10]]
+    with pytest.raises(ValueError):
+        graph.pairs(400)
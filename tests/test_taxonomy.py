@@ -0,0 +1,25 @@
+# Compiled tag taxonomy and its cache
+import os
+
+from model.tags import taxonomy
+
+
+def test_cache_round_trip(tmpdir):
+    cache_file = str(tmpdir.join('cache', 'taxonomy.pickle'))
+    compiled = taxonomy.load_taxonomy(cache_file)
+    assert os.path.isfile(cache_file)
+
+    cached = taxonomy.load_taxonomy(cache_file)
+    assert cached.version == compiled.version == taxonomy.source_version()
+    assert cached.classify('shop', 'bakery') == \
+        compiled.classify('shop', 'bakery')
+
+
+def test_corrupt_cache_is_rebuilt(tmpdir):
+    cache_file = str(tmpdir.join('taxonomy.pickle'))
+    with open(cache_file, 'wb') as f:
+        f.write(b'not a pickle')
+    assert taxonomy.load_taxonomy(cache_file).keys
+    assert taxonomy.load_taxonomy(cache_file).version == \
+        taxonomy.source_version()
+
@@ -2,15 +2,40 @@ import numpy as np
 import requests
 
 import logging
+import math
 import os
+import re
+import threading
 import time
 
 from flask import (Flask, request, url_for, render_template, abort,
-                   send_from_directory)
+                   send_from_directory, jsonify, redirect)
 # POI analysis model
 from model import poi
+from model.cluster import dbscan
+from model.tags.taxonomy import taxonomy
+# background analysis jobs and their stored results
+import jobs
+import result_store
 app = Flask(__name__)
 app.config['PATH_TO_OUPUT_DATA'] = os.path.join(os.getcwd(), 'result_data')
+app.config['RESULT_STORE_MAX_BYTES'] = 5 * 1024 ** 3
+app.config['JOB_WORKERS'] = 2
+app.config['JOB_QUEUE_SIZE'] = 8
+job_queue = jobs.JobQueue(max_workers=app.config['JOB_WORKERS'],
+                          max_queued=app.config['JOB_QUEUE_SIZE'])
+# one result directory per place and analysis parameters
+results = result_store.ResultStore(
+    app.config['PATH_TO_OUPUT_DATA'],
+    max_bytes=app.config['RESULT_STORE_MAX_BYTES'])
+# result key -> id of the job computing it, changed by request threads and
+# the job completion thread
+result_jobs = {}
+result_jobs_lock = threading.RLock()
+
+NETWORK_TYPES = ('drive', 'drive_service', 'walk', 'bike', 'all',
+                 'all_private')
+RESULT_KEY = re.compile('^[0-9a-f]{40}$')
 
 
 @app.route('/poiAnalysis/place', methods=['GET', 'POST'])
@@ -18,40 +43,214 @@ def place_read():
     return render_template('place_read.html')
 
 
-@app.route('/poiAnalysis/result', methods=['POST'])
-def process_place_result():
+def analysis_params():
     """
-    Handles HTTP request by saving and processing place.
+    Reads the analysis parameters of the request form.
 
     Returns:
-        method call to `show_place_success` that calls to render our results'
-        template with the request result
+        (dict): DBSCAN eps/minpts, network type, clustering engine and
+            taxonomy version
+    """
+    try:
+        eps = float(request.form.get('eps') or 300)
+        minpts = int(request.form.get('minpts') or 5)
+    except ValueError:
+        abort(406, "Invalid DBSCAN parameters")
+    if not (math.isfinite(eps) and eps > 0 and minpts >= 1):
+        abort(406, "Invalid DBSCAN parameters")
+    network_type = request.form.get('network_type') or 'drive'
+    if network_type not in NETWORK_TYPES:
+        abort(406, "Invalid network type")
+    cluster_engine = request.form.get('cluster_engine') or 'haversine'
+    if cluster_engine not in dbscan.ENGINES:
+        abort(406, "Invalid clustering engine")
+    return {'eps': eps,
+            'minpts': minpts,
+            'network_type': network_type,
+            'cluster_engine': cluster_engine,
+            'taxonomy': taxonomy.version}
+
+
+def complete_place_job(job):
+    """
+    Stores the result of a finished analysis job.
+
+    Args:
+        job (:obj:`jobs.Job`): finished job
+    """
+    results.complete(job.info['key'], job.info)
+    with result_jobs_lock:
+        result_jobs.pop(job.info['key'], None)
+
+
+def submit_place_job():
     """
-    place_result = {}
-    request_timestamp = int(time.time() * 1000)
-    place_result['timestamp'] = request_timestamp
+    Queues the analysis of the place sent in the request form, unless its
+    result is already stored or being computed.
 
+    Returns:
+        (str, str): result key, and job id or None if the result is stored
+    """
     input_text = request.form['text']
     if input_text == '':
         abort(406, "No text provided")
 
-    place_result['text_input'] = input_text
+    params = analysis_params()
+    key = result_store.place_key(input_text, params)
+    if results.is_complete(key):
+        results.touch(key)
+        return key, None
+
+    info = {'text_input': input_text,
+            'timestamp': int(time.time() * 1000),
+            'key': key,
+            'params': params}
+    # one job per result key, the lookup and the submission are not
+    # interleaved with other requests
+    with result_jobs_lock:
+        job = job_queue.get(result_jobs.get(key, ''))
+        if job is not None and job.state in (jobs.QUEUED, jobs.RUNNING):
+            return key, job.job_id
+        try:
+            job_id = job_queue.submit(
+                poi.main,
+                (input_text, results.path(key), params['eps'],
+                 params['minpts'], params['network_type'],
+                 params['cluster_engine']),
+                info,
+                on_done=complete_place_job)
+        except jobs.QueueFull:
+            abort(503, "Too many analyses queued, try again later")
+        result_jobs[key] = job_id
+    return key, job_id
+
+
+@app.route('/poiAnalysis/result', methods=['POST'])
+def process_place_result():
+    """
+    Handles HTTP request by queueing the place analysis.
+
+    Returns:
+        rendered status template polling the job until its result is ready,
+        or a redirection to the stored result
+    """
+    key, job_id = submit_place_job()
+    if job_id is None:
+        return redirect(url_for('stored_place_result', key=key))
+    return render_template('place_status.html', job_id=job_id,
+                           **job_queue.get(job_id).info)
+
+
+@app.route('/poiAnalysis/jobs', methods=['POST'])
+def submit_job():
+    """
+    Handles HTTP request by queueing the place analysis.
+
+    Returns:
+        JSON with the job id and its status and result urls, only the result
+        url if the result is already stored
+    """
+    key, job_id = submit_place_job()
+    if job_id is None:
+        return jsonify(result_url=url_for('stored_place_result', key=key)), 200
+    return jsonify(job_id=job_id,
+                   status_url=url_for('job_status', job_id=job_id),
+                   result_url=url_for('job_result', job_id=job_id)), 202
+
 
-    processed_place_output = poi.main(
-        input_text, app.config['PATH_TO_OUPUT_DATA'])
+@app.route('/poiAnalysis/jobs/<job_id>')
+def job_status(job_id):
+    """
+    Handles job status polling.
+
+    Returns:
+        JSON job status
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        abort(404, "Unknown job")
+    status = job.status()
+    status['queue_depth'] = job_queue.depth()
+    return jsonify(**status)
+
+
+@app.route('/poiAnalysis/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """
+    Handles cancellation of a queued job.
+
+    Returns:
+        JSON with the cancellation outcome and the job status
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        abort(404, "Unknown job")
+    cancelled = job_queue.cancel(job_id)
+    return jsonify(cancelled=cancelled, **job.status())
+
+
+@app.route('/poiAnalysis/jobs/<job_id>/result')
+def job_result(job_id):
+    """
+    Handles the result of a finished job.
+
+    Returns:
+        redirection to the stored result
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        abort(404, "Unknown job")
+    state = job.state
+    if state in (jobs.QUEUED, jobs.RUNNING):
+        abort(409, "Job is {}".format(state))
+    if state != jobs.DONE:
+        abort(500, job.status().get('error', "Job {}".format(state)))
+    return redirect(url_for('stored_place_result', key=job.info['key']))
+
+
+def result_key(key):
+    """
+    Validates a result key taken from an url.
+
+    Args:
+        key (str): result key
+
+    Returns:
+        (str): result key of a stored result
+    """
+    if not RESULT_KEY.match(key) or not results.is_complete(key):
+        abort(404, "Unknown result")
+    return key
+
+
+@app.route('/poiAnalysis/results/<key>')
+def stored_place_result(key):
+    """
+    Handles a stored place Analysis.
+
+    Returns:
+        method call to `show_place_result` that calls to render our results'
+        template with the request result
+    """
+    key = result_key(key)
+    results.touch(key)
+    place_result = results.info(key) or {}
     print('Pre-processing done! \n')
-    place_result['poi_data'] = url_for('get_file', filename='poi_data.png')
+    place_result['poi_data'] = url_for(
+        'get_file', key=key, filename='poi_data.png')
     place_result['street_with_poi'] = url_for(
-        'get_file', filename='street_with_poi.png')
+        'get_file', key=key, filename='street_with_poi.png')
     place_result['type_of_poi'] = url_for(
-        'get_file', filename='type_of_poi.png')
+        'get_file', key=key, filename='type_of_poi.png')
+    place_result['commercial_clusters'] = url_for(
+        'get_file', key=key, filename='poi_commercial_clusters.geojson')
     print (place_result['poi_data'])
     return show_place_result(place_result)
 
 
-@app.route('/poiAnalysis/result/<path:filename>')
-def get_file(filename):
-    return send_from_directory(app.config['PATH_TO_OUPUT_DATA'], filename,
+@app.route('/poiAnalysis/result/<key>/<path:filename>')
+def get_file(key, filename):
+    return send_from_directory(results.path(result_key(key)), filename,
                                as_attachment=True)
 
 